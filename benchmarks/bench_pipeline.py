@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the lockscreen generation pipeline
+
+Generates synthetic sources, runs each stage of the pipeline against common
+monitor layouts through a stubbed xrandr, and reports the time, throughput
+and peak RSS of each as JSON. Two reports can be compared to flag
+regressions.
+
+    python benchmarks/bench_pipeline.py run -o before.json
+    python benchmarks/bench_pipeline.py run -o after.json
+    python benchmarks/bench_pipeline.py compare before.json after.json
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import PIL
+from harness import fake_xrandr, make_source
+
+from jyou import generator, utils
+
+SOURCES = {
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+    "24mp": (6000, 4000),
+    "50mp": (8660, 5773),
+}
+
+LAYOUTS = {
+    "1080p": "1920x1080+0+0",
+    "dual-1080p": "1920x1080+0+0 1920x1080+1920+0",
+    "4k": "3840x2160+0+0",
+    "triple-1440p": "2560x1440+0+0 2560x1440+2560+0 2560x1440+5120+0",
+}
+
+
+def time_stage(function, repeat: int) -> float:
+    """
+    Times a stage, taking the median of the repeats
+
+    Arguments:
+        function (callable): the stage to time
+        repeat (int): how many times to run it
+
+    Returns:
+        (float): the median time in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+
+def run_case(source_path: str, source_name: str, layout_name: str, options: Dict):
+    """
+    Runs every stage of the pipeline for one source and layout. Runs in its
+    own process so the peak RSS belongs to this case alone.
+
+    Arguments:
+        source_path (str): the path to the source
+        source_name (str): the name of the source size
+        layout_name (str): the name of the layout
+        options (Dict): the blur, brightness and repeat count
+
+    Returns:
+        (Dict): the results of the case
+    """
+    repeat = options["repeat"]
+    blur = options["blur"]
+
+    with fake_xrandr(LAYOUTS[layout_name]):
+        resolutions = generator.get_resolution_image()
+
+    source_megabytes = os.path.getsize(source_path) / 1e6
+    source_megapixels = SOURCES[source_name][0] * SOURCES[source_name][1] / 1e6
+    output_size = generator.get_accumulative_dimensions(resolutions)
+    output_megapixels = output_size[0] * output_size[1] / 1e6
+    dimensions = sorted(set(map(generator.get_resolution_dimensions, resolutions)))
+
+    image = generator.open_image(source_path, resolutions)
+    tiles = [generator.crop_image_to_dimensions(image, i) for i in dimensions]
+    lockscreen = generator.generate_lockscreen_image(
+        source_path, resolutions, blur, options["brightness"]
+    )
+
+    def encode():
+        generator.get_encoder("png").save(lockscreen, io.BytesIO())
+
+    stages = {
+        "md5": (lambda: utils.md5_file(source_path), source_megabytes, "MB/s"),
+        "decode": (
+            lambda: generator.open_image(source_path, resolutions),
+            source_megapixels,
+            "MP/s",
+        ),
+        "crop": (
+            lambda: [generator.crop_image_to_dimensions(image, i) for i in dimensions],
+            sum(i[0] * i[1] for i in dimensions) / 1e6,
+            "MP/s",
+        ),
+        "blur": (
+            lambda: [generator.blur_image(tile, blur) for tile in tiles],
+            sum(i[0] * i[1] for i in dimensions) / 1e6,
+            "MP/s",
+        ),
+        "generate": (
+            lambda: generator.generate_lockscreen_image(
+                source_path, resolutions, blur, options["brightness"]
+            ),
+            output_megapixels,
+            "MP/s",
+        ),
+        "encode": (encode, output_megapixels, "MP/s"),
+    }
+
+    results = {}
+    for name, (function, amount, unit) in stages.items():
+        seconds = time_stage(function, repeat)
+        results[name] = {
+            "seconds": seconds,
+            "throughput": amount / seconds if seconds else 0,
+            "unit": unit,
+        }
+
+    return {
+        "source": source_name,
+        "layout": layout_name,
+        "stages": results,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run(args: argparse.Namespace) -> Dict:
+    """
+    Runs the benchmarks
+
+    Arguments:
+        args (argparse.Namespace): the parsed command line
+
+    Returns:
+        (Dict): the report
+    """
+    options = {"repeat": args.repeat, "blur": args.blur, "brightness": 0.8}
+    context = multiprocessing.get_context("spawn")
+    results = []
+
+    with tempfile.TemporaryDirectory() as source_dir:
+        for source_name in args.sources:
+            source_path = os.path.join(source_dir, f"{source_name}.jpg")
+            make_source(source_path, SOURCES[source_name])
+
+            for layout_name in args.layouts:
+                with ProcessPoolExecutor(1, mp_context=context) as executor:
+                    result = executor.submit(
+                        run_case, source_path, source_name, layout_name, options
+                    ).result()
+                results.append(result)
+                print(
+                    f"{source_name:>6} {layout_name:>13}: "
+                    + " ".join(
+                        f"{name}={stage['seconds'] * 1000:.1f}ms"
+                        for name, stage in result["stages"].items()
+                    )
+                    + f" rss={result['peak_rss_kb'] / 1024:.0f}MiB",
+                    file=sys.stderr,
+                )
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.time(),
+            "options": options,
+        },
+        "results": results,
+    }
+
+
+def compare(before: Dict, after: Dict, threshold: float) -> List[str]:
+    """
+    Compares two reports
+
+    Arguments:
+        before (Dict): the report to compare against
+        after (Dict): the new report
+        threshold (float): the fraction a measurement may grow before it is a
+            regression
+
+    Returns:
+        (List[str]): a description of each regression
+    """
+    before_results = {(i["source"], i["layout"]): i for i in before["results"]}
+    regressions = []
+
+    for result in after["results"]:
+        key = (result["source"], result["layout"])
+        if key not in before_results:
+            continue
+
+        old_result = before_results[key]
+        measurements = [
+            (f"{name} time", stage["seconds"], old_result["stages"][name]["seconds"])
+            for name, stage in result["stages"].items()
+            if name in old_result["stages"]
+        ]
+        measurements.append(
+            ("peak RSS", result["peak_rss_kb"], old_result["peak_rss_kb"])
+        )
+
+        for name, new_value, old_value in measurements:
+            change = (new_value - old_value) / old_value if old_value else 0
+            line = f"{key[0]:>6} {key[1]:>13} {name:>14}: {change:+7.1%}"
+            if change > threshold:
+                regressions.append(line)
+                line += "  REGRESSION"
+            print(line)
+
+    return regressions
+
+
+def main():
+    """Runs the benchmark command line"""
+    parser = argparse.ArgumentParser(description="Benchmark the JYOU pipeline")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument(
+        "-o", "--output", metavar="path", help="Where to write the JSON report"
+    )
+    run_parser.add_argument(
+        "--sources", nargs="+", choices=list(SOURCES), default=list(SOURCES)
+    )
+    run_parser.add_argument(
+        "--layouts", nargs="+", choices=list(LAYOUTS), default=list(LAYOUTS)
+    )
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--blur", type=int, default=20)
+
+    compare_parser = commands.add_parser("compare", help="Compare two reports")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Fraction a measurement may grow before it is a regression",
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = json.dumps(run(args), indent=4)
+        if args.output:
+            with open(args.output, "w", encoding="UTF-8") as report_file:
+                report_file.write(report)
+        else:
+            print(report)
+    else:
+        with open(args.before, encoding="UTF-8") as before_file:
+            before = json.load(before_file)
+        with open(args.after, encoding="UTF-8") as after_file:
+            after = json.load(after_file)
+
+        regressions = compare(before, after, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions past {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for updating to an already rendered lockscreen
+
+Renders a small library once, then times cold runs of `jyou -i dir` in fresh
+interpreters against a stubbed xrandr. Fails if the median run takes longer
+than the budget, or if the update imports a module it should not need.
+
+    python benchmarks/bench_startup.py --budget 150
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from harness import fake_xrandr, make_source
+
+# Modules the update path must not import when the lockscreen is rendered
+FORBIDDEN_MODULES = ("PIL", "tqdm", "concurrent.futures")
+
+
+def run_jyou(arguments: List[str], env: Dict[str, str], *options) -> str:
+    """
+    Runs jyou in a fresh interpreter
+
+    Arguments:
+        arguments (List[str]): the arguments to jyou
+        env (Dict[str, str]): the environment to run in
+        *options: options to the interpreter
+
+    Returns:
+        (str): what jyou wrote to stderr
+    """
+    return subprocess.run(
+        [sys.executable, *options, "-m", "jyou", *arguments],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+        text=True,
+    ).stderr
+
+
+def get_imported_modules(importtime_output: str) -> List[str]:
+    """
+    Gets the modules imported from the output of `python -X importtime`
+
+    Arguments:
+        importtime_output (str): the output
+
+    Returns:
+        (List[str]): the names of the imported modules
+    """
+    return [
+        line.rsplit("|", 1)[1].strip()
+        for line in importtime_output.splitlines()
+        if line.startswith("import time:") and line.count("|") == 2
+    ][1:]
+
+
+def main():
+    """Runs the startup benchmark"""
+    parser = argparse.ArgumentParser(description="Benchmark the JYOU startup")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=150,
+        help="Milliseconds the median update may take",
+    )
+    parser.add_argument("-o", "--output", metavar="path", help="Where to write JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir, fake_xrandr("1920x1080+0+0"):
+        image_dir = os.path.join(temp_dir, "images")
+        os.mkdir(image_dir)
+        for i in range(4):
+            make_source(os.path.join(image_dir, f"{i}.jpg"), (640, 360))
+
+        env = dict(os.environ)
+        for name in ("CONFIG", "DATA", "CACHE"):
+            env[f"XDG_{name}_HOME"] = os.path.join(temp_dir, name.lower())
+        env["HOME"] = temp_dir
+        env.pop("XDG_RUNTIME_DIR", None)
+
+        run_jyou(["-i", image_dir, "-g"], env)
+
+        interpreter_times = []
+        update_times = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", "pass"], check=True)
+            interpreter_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            run_jyou(["-i", image_dir], env)
+            update_times.append(time.perf_counter() - start)
+
+        imported_modules = get_imported_modules(
+            run_jyou(["-i", image_dir], env, "-X", "importtime")
+        )
+
+    forbidden = sorted(
+        name
+        for name in imported_modules
+        if any(
+            name == module or name.startswith(module + ".")
+            for module in FORBIDDEN_MODULES
+        )
+    )
+    report = {
+        "runs": args.runs,
+        "budget_ms": args.budget,
+        "interpreter_ms": statistics.median(interpreter_times) * 1000,
+        "update_ms": statistics.median(update_times) * 1000,
+        "update_min_ms": min(update_times) * 1000,
+        "modules": len(imported_modules),
+        "forbidden_modules": forbidden,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="UTF-8") as report_file:
+            json.dump(report, report_file, indent=4)
+    print(json.dumps(report, indent=4))
+
+    if forbidden:
+        print(f"The update imported {', '.join(forbidden)}", file=sys.stderr)
+        sys.exit(1)
+
+    if report["update_ms"] > args.budget:
+        print(
+            f"The update took {report['update_ms']:.0f}ms, "
+            f"over the budget of {args.budget:.0f}ms",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
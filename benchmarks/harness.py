@@ -0,0 +1,46 @@
+"""Helpers shared by the benchmarks"""
+import contextlib
+import os
+from typing import Iterator
+
+from PIL import Image
+
+# Holds the xrandr the tests use, reporting FAKE_XRANDR_LAYOUT
+XRANDR_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "tests", "assets", "bin"
+)
+
+
+@contextlib.contextmanager
+def fake_xrandr(layout: str) -> Iterator[str]:
+    """
+    Puts an xrandr on the PATH that reports the given layout
+
+    Arguments:
+        layout (str): space separated WIDTHxHEIGHT+X+Y of each monitor
+
+    Yields:
+        (str): the directory containing the fake xrandr
+    """
+    environ = os.environ.copy()
+    os.environ["PATH"] = XRANDR_DIR + os.pathsep + environ.get("PATH", "")
+    os.environ["FAKE_XRANDR_LAYOUT"] = layout
+    try:
+        yield XRANDR_DIR
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+def make_source(source_path: str, size: tuple):
+    """
+    Saves a synthetic photo-like JPEG with both smooth and detailed areas
+
+    Arguments:
+        source_path (str): the path to save the source to
+        size (tuple): the width and height of the source
+    """
+    detail = Image.effect_mandelbrot(size, (-2.2, -1.2, 1.0, 1.2), 64)
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise((size[0] // 8, size[1] // 8), 48).resize(size)
+    Image.merge("RGB", (detail, gradient, noise)).save(source_path, quality=90)
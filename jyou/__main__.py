@@ -14,9 +14,19 @@ import logging
 import shutil
 
 from jyou.__init__ import __version__, __author__, __email__
-from jyou import log, config_handler
+from jyou import log, config_handler, stats, utils
 from jyou.settings import DATA_PATH, CONFIG_PATH
 from jyou.generator import LockscreenGenerator
+from jyou.cache import CacheManager
+from jyou.index import FingerprintIndex, INDEX_FILE_NAME
+from jyou.encoders import ENCODERS
+from jyou.selection import SELECTION_POLICIES
+from jyou.geometry import (
+    GEOMETRY_SOURCES,
+    GeometryError,
+    get_geometry_provider,
+    parse_layout,
+)
 
 logger = log.setup_logger(__name__, logging.ERROR, log.DefaultLoggingHandler())
 
@@ -33,7 +43,25 @@ def get_args():
     arg.add_argument(
         "-i", "--input", metavar='"path/to/dir"', help="The input file or directory"
     )
+    arg.add_argument(
+        "--include",
+        metavar="glob",
+        action="append",
+        help="Only use images matching the glob, can be given more than once",
+    )
+    arg.add_argument(
+        "--exclude",
+        metavar="glob",
+        action="append",
+        help="Skip images and directories matching the glob",
+    )
     arg.add_argument("-r", "--radius", metavar="radius", help="Radius for the blur")
+    arg.add_argument(
+        "--blur-quality",
+        metavar="quality",
+        type=float,
+        help="Quality of the blur, lower is faster (0 < quality <= 1)",
+    )
     arg.add_argument("--verbose", action="store_true", help="Verbose logging")
     arg.add_argument(
         "-b",
@@ -47,7 +75,86 @@ def get_args():
     arg.add_argument(
         "--clear", action="store_true", help="Clear all data relating to JYOU"
     )
+    arg.add_argument(
+        "--preset",
+        metavar="name",
+        help="Use the blur and brightness of a preset from the config",
+    )
+    arg.add_argument(
+        "--batch",
+        action="store_true",
+        help="Generate every batch layout and preset from the config",
+    )
+    arg.add_argument(
+        "--gc",
+        action="store_true",
+        help="Remove lockscreens for old layouts and missing images",
+    )
     arg.add_argument("--progress", action="store_true", help="Display progress")
+    arg.add_argument(
+        "-j",
+        "--jobs",
+        metavar="jobs",
+        type=int,
+        help="Number of images to generate in parallel (0 for one per CPU core)",
+    )
+
+    arg.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep the lockscreens of the input directory up to date and serve "
+        "updates over a socket",
+    )
+    arg.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="Render the next lockscreen in the background after updating",
+    )
+    arg.add_argument(
+        "--selection",
+        choices=list(SELECTION_POLICIES),
+        help="How to pick the image to update to",
+    )
+    arg.add_argument(
+        "--fingerprint",
+        choices=list(utils.FINGERPRINTS),
+        help="How to tell images apart",
+    )
+    arg.add_argument(
+        "--detach-hooks",
+        action="store_true",
+        help="Run the hooks in the background instead of waiting for them",
+    )
+    arg.add_argument(
+        "--encoder",
+        choices=list(ENCODERS),
+        help="How to save the lockscreens",
+    )
+    arg.add_argument(
+        "--layout",
+        metavar='"1920x1080+0+0,..."',
+        help="Explicit monitor layout, skipping monitor detection",
+    )
+    arg.add_argument(
+        "--layout-file",
+        metavar='"path/to/file"',
+        help="File containing a monitor layout or saved xrandr output",
+    )
+    arg.add_argument(
+        "--geometry",
+        choices=GEOMETRY_SOURCES,
+        help="Where to get the monitor layout from",
+    )
+    arg.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print the time and memory used by each stage when done",
+    )
+    arg.add_argument(
+        "--trace",
+        metavar='"path/to/file"',
+        help="Write the time and memory used by each stage as JSON lines",
+    )
 
     return arg
 
@@ -74,17 +181,72 @@ def parse_args(parser):
     log_level = get_log_level(verbose_logging)
     logger.setLevel(log_level)
 
+    if args.stats or args.trace:
+        stats.enable()
+
+    config = config_handler.parse_config()
+
     if args.input:
+        presets = config["presets"]
+        if args.preset and args.preset not in presets:
+            logger.critical("No preset named %s in the config", args.preset)
+            sys.exit(1)
+        preset = presets.get(args.preset, {})
+
         blur_strength = config_handler.compare_flag_with_config(
-            args.radius, config_handler.parse_config()["blur"]
+            args.radius, preset.get("blur", config["blur"])
         )
         brightness = config_handler.compare_flag_with_config(
-            args.brightness, config_handler.parse_config()["brightness"]
+            args.brightness,
+            preset.get("brightness", config["brightness"]),
+        )
+        blur_quality = config_handler.compare_flag_with_config(
+            args.blur_quality,
+            preset.get("blur_quality", config["blur_quality"]),
         )
         progress = config_handler.compare_flag_with_config(
-            args.progress, config_handler.parse_config()["progress"]
+            args.progress, config["progress"]
+        )
+        output_path = config["out_directory"]
+        jobs = args.jobs
+        if jobs is None:
+            jobs = config["jobs"]
+
+        prefetch = config_handler.compare_flag_with_config(
+            args.prefetch, config["prefetch"]
+        )
+        selection = config_handler.compare_flag_with_config(
+            args.selection, config["selection"]
+        )
+        fingerprint = config_handler.compare_flag_with_config(
+            args.fingerprint, config["fingerprint"]
         )
-        output_path = config_handler.parse_config()["out_directory"]
+        detach_hooks = config_handler.compare_flag_with_config(
+            args.detach_hooks, config["detach_hooks"]
+        )
+        encoder = config_handler.compare_flag_with_config(
+            args.encoder, config["encoder"]
+        )
+        layout_file = config_handler.compare_flag_with_config(
+            args.layout_file, config["layout_file"]
+        )
+        geometry_source = config_handler.compare_flag_with_config(
+            args.geometry, config["geometry"]
+        )
+        if args.layout_file and not args.geometry:
+            geometry_source = "file"
+
+        try:
+            geometry_provider = get_geometry_provider(
+                geometry_source,
+                layout=config_handler.compare_flag_with_config(
+                    args.layout, config["layout"]
+                ),
+                layout_file=layout_file,
+            )
+        except GeometryError as error:
+            logger.critical("%s", error)
+            sys.exit(1)
 
         generator = LockscreenGenerator(
             args.input,
@@ -93,13 +255,54 @@ def parse_args(parser):
             override=args.override,
             blur_strength=blur_strength,
             brightness=brightness,
+            blur_quality=blur_quality,
             output_path=output_path,
+            jobs=jobs,
+            encoder=encoder,
+            cache_max_mb=config["cache_max_mb"],
+            cache_max_files=config["cache_max_files"],
+            cache_layout_days=config["cache_layout_days"],
+            source_cache_mb=config["source_cache_mb"],
+            tile_cache_mb=config["tile_cache_mb"],
+            prefetch=prefetch,
+            selection=selection,
+            fingerprint=fingerprint,
+            hook_timeout=config["hook_timeout"],
+            hook_timeouts=config["hook_timeouts"],
+            detach_hooks=detach_hooks,
+            geometry_provider=geometry_provider,
+            include=config_handler.compare_flag_with_config(
+                args.include, config["include"]
+            ),
+            exclude=config_handler.compare_flag_with_config(
+                args.exclude, config["exclude"]
+            ),
         )
 
-        if args.generate:
+        updated = True
+        if args.watch:
+            # pylint: disable=import-outside-toplevel
+            from jyou.watch import WatchDaemon, WatchError
+
+            try:
+                WatchDaemon(generator, args.input).run()
+            except WatchError as error:
+                logger.critical("%s", error)
+                sys.exit(1)
+        elif args.batch:
+            generate_batch(generator, config)
+        elif args.generate:
             generator.generate()
         else:
-            generator.update()
+            updated = generator.update() is not None
+
+        report_stats(args)
+        # Lets hotkeys and scripts tell the lockscreen was not changed
+        if not updated:
+            sys.exit(1)
+
+    elif args.gc:
+        collect_garbage(config)
 
     elif args.clear:
         clear = input(
@@ -112,6 +315,75 @@ def parse_args(parser):
             logger.warning("Canceled clearing cache folders...")
 
 
+def generate_batch(generator: LockscreenGenerator, config: dict):
+    """
+    Generates the lockscreens of every batch layout and preset in the config
+
+    Arguments:
+        generator (LockscreenGenerator): the generator to generate with
+        config (dict): the config
+    """
+    try:
+        layouts = [parse_layout(layout) for layout in config["batch_layouts"]]
+    except GeometryError as error:
+        logger.critical("%s", error)
+        sys.exit(1)
+
+    presets = [
+        {
+            "blur": preset.get("blur", config["blur"]),
+            "brightness": preset.get("brightness", config["brightness"]),
+            "blur_quality": preset.get("blur_quality", config["blur_quality"]),
+        }
+        for preset in config["presets"].values()
+    ]
+
+    generator.generate_variants(
+        layouts or [generator.resolutions], presets or [generator.get_effects()]
+    )
+
+
+def report_stats(args):
+    """
+    Prints the stage summary and writes the trace, if requested
+
+    Arguments:
+        args (argparse.Namespace): the parsed arguments
+    """
+    records = stats.get_records()
+    if args.stats:
+        print(stats.format_summary(records), file=sys.stderr)
+    if args.trace:
+        stats.write_trace(records, args.trace)
+
+
+def collect_garbage(config: dict):
+    """
+    Removes lockscreens for layouts not seen recently and images that no
+    longer exist, then reports the space reclaimed
+
+    Arguments:
+        config (dict): the config
+    """
+    out_dir = config["out_directory"]
+    index = FingerprintIndex(os.path.join(out_dir, INDEX_FILE_NAME))
+    cache = CacheManager(
+        out_dir,
+        max_mb=config["cache_max_mb"],
+        max_files=config["cache_max_files"],
+        layout_days=config["cache_layout_days"],
+    )
+
+    removed_files, removed_bytes = cache.collect_garbage(index)
+    index.save()
+    cache.save()
+
+    print(
+        f"Removed {removed_files} lockscreens, "
+        f"reclaiming {utils.format_size(removed_bytes)}"
+    )
+
+
 def main():
     # Create required directories
     os.makedirs(DATA_PATH, exist_ok=True)
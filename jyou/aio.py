@@ -0,0 +1,447 @@
+"""
+asyncio counterparts of finding the monitors, updating and running the
+hooks, so an event loop is never blocked on them. Subprocesses are awaited,
+work on the generator's index and files runs in a thread and rendering runs
+in worker processes.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from . import generator, hooks, log
+from .generator import LockscreenGenerator
+from .geometry import (
+    CachedProvider,
+    FallbackProvider,
+    GeometryError,
+    GeometryProvider,
+    XrandrProvider,
+    get_drm_signature,
+    get_geometry_provider,
+    parse_layout,
+)
+
+# Rendering always has a spare worker, so a prefetch that is cancelled while
+# its render finishes never holds up the render of an update
+MIN_RENDER_WORKERS = 2
+
+logger = log.setup_logger(__name__, logging.WARN, log.DefaultLoggingHandler())
+
+
+class AsyncLockscreenGenerator:
+    """Updates and prefetches the lockscreens of a generator from an event loop"""
+
+    def __init__(self, lockscreen_generator: LockscreenGenerator, executor=None):
+        """
+        The initialisation method
+
+        Arguments:
+            lockscreen_generator (LockscreenGenerator): the generator to drive
+            executor (concurrent.futures.Executor): runs the renders, by
+                default a process pool with the generator's number of jobs
+        """
+        self.generator = lockscreen_generator
+        self.executor = executor
+        self.owns_executor = executor is None
+        # A single thread owns the index, caches and selection state, so
+        # overlapping updates and prefetches never change them at once
+        self.state_executor = ThreadPoolExecutor(max_workers=1)
+        self.prefetch_task = None
+        self.hook_tasks = set()
+        # Renders submitted to the executor and not yet done, cancelled when
+        # the generator is closed
+        self.futures = set()
+
+    async def __aenter__(self) -> AsyncLockscreenGenerator:
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def run_in_thread(self, function, *args):
+        """
+        Runs a function on the generator's state in its thread
+
+        Arguments:
+            function (Callable): the function to run
+            *args: the arguments to the function
+
+        Returns:
+            the result of the function
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.state_executor, function, *args)
+
+    def get_executor(self):
+        """
+        Gets the executor renders run in, starting it the first time it is
+        needed
+
+        Returns:
+            (concurrent.futures.Executor): the executor
+        """
+        if self.executor is None:
+            self.executor = generator.get_process_pool(
+                max(self.generator.jobs, MIN_RENDER_WORKERS)
+            )
+
+        return self.executor
+
+    async def render(self, image_path: str, out_path: str):
+        """
+        Renders the lockscreen of an image in the executor and records it in
+        the index. If cancelled, a render already running in a worker is left
+        to finish but not recorded.
+
+        Arguments:
+            image_path (str): the path to the image
+            out_path (str): the path to save the lockscreen to
+        """
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        render_args = await self.run_in_thread(
+            self.generator.get_render_args, image_path, out_path
+        )
+        future = self.get_executor().submit(generator.render_lockscreen, *render_args)
+        self.futures.add(future)
+        future.add_done_callback(self.futures.discard)
+        rendered = await asyncio.wrap_future(future)
+        await self.run_in_thread(self.generator.index.add_output, *rendered)
+
+    async def update(self) -> str:
+        """
+        Updates the lockscreen, see LockscreenGenerator.update. A prefetch
+        still running is cancelled first, since the update has overtaken it.
+
+        Returns:
+            (str): the path to the new lockscreen, None if it failed
+        """
+        await self.cancel_prefetch()
+
+        image_path, out_path = await self.run_in_thread(
+            self.generator.select_update_image
+        )
+        if image_path is None:
+            return None
+
+        if not os.path.isfile(out_path):
+            try:
+                await self.render(image_path, out_path)
+            # pylint: disable=broad-except
+            except Exception as error:
+                logger.error(
+                    "Could not generate a lockscreen for %s: %s", image_path, error
+                )
+                return None
+            await self.run_in_thread(self.generator.save_index)
+
+        await self.run_in_thread(self.generator.link_lockscreen, image_path, out_path)
+
+        hook_kwargs = {
+            "timeout": self.generator.hook_timeout,
+            "timeouts": self.generator.hook_timeouts,
+        }
+        if self.generator.detach_hooks:
+            hook_task = asyncio.ensure_future(run_hooks(**hook_kwargs))
+            self.hook_tasks.add(hook_task)
+            hook_task.add_done_callback(self.hook_tasks.discard)
+        else:
+            await run_hooks(**hook_kwargs)
+
+        if self.generator.background_prefetch:
+            self.start_prefetch(image_path)
+
+        return out_path
+
+    async def prefetch(self, current_image_path: str = None):
+        """
+        Picks the image for the next update and renders its lockscreen ahead
+        of time, see LockscreenGenerator.prefetch
+
+        Arguments:
+            current_image_path (str): the path to the image just shown
+        """
+        image_path = await self.run_in_thread(
+            self.generator.selection.select, self.generator, current_image_path
+        )
+        if image_path is None:
+            return
+
+        out_path = await self.run_in_thread(
+            self.generator.get_lockscreen_out_path, image_path
+        )
+        if not os.path.isfile(out_path):
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            if not generator.acquire_render_lock(out_path):
+                logger.info("%s is already being prefetched", image_path)
+                return
+
+            try:
+                await self.render(image_path, out_path)
+            finally:
+                generator.release_render_lock(out_path)
+
+        await self.run_in_thread(self.generator.save_prefetched_image_path, image_path)
+
+    def start_prefetch(self, current_image_path: str = None) -> asyncio.Task:
+        """
+        Prefetches the next lockscreen in the background, cancelling any
+        prefetch still running
+
+        Arguments:
+            current_image_path (str): the path to the image just shown
+
+        Returns:
+            (asyncio.Task): the prefetch
+        """
+        if self.prefetch_task is not None:
+            self.prefetch_task.cancel()
+
+        self.prefetch_task = asyncio.ensure_future(self.prefetch(current_image_path))
+        self.prefetch_task.add_done_callback(log_prefetch_error)
+        return self.prefetch_task
+
+    async def cancel_prefetch(self):
+        """Cancels the background prefetch, if one is running"""
+        prefetch_task, self.prefetch_task = self.prefetch_task, None
+        if prefetch_task is None or prefetch_task.done():
+            return
+
+        prefetch_task.cancel()
+        # Waits without taking on the cancellation of the prefetch
+        await asyncio.wait([prefetch_task])
+
+    async def close(self):
+        """
+        Cancels the background prefetch, waits for detached hooks and stops
+        the executors
+        """
+        await self.cancel_prefetch()
+        if self.hook_tasks:
+            await asyncio.gather(*self.hook_tasks, return_exceptions=True)
+
+        for future in list(self.futures):
+            future.cancel()
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.state_executor.shutdown)
+        if self.owns_executor and self.executor is not None:
+            # Waits for the renders already running without blocking the loop
+            await loop.run_in_executor(None, self.executor.shutdown)
+            self.executor = None
+
+
+def log_prefetch_error(prefetch_task: asyncio.Task):
+    """
+    Logs why a background prefetch failed, see
+    AsyncLockscreenGenerator.start_prefetch
+
+    Arguments:
+        prefetch_task (asyncio.Task): the finished prefetch
+    """
+    if not prefetch_task.cancelled() and prefetch_task.exception() is not None:
+        logger.error(
+            "Failed to prefetch the next lockscreen: %s", prefetch_task.exception()
+        )
+
+
+async def create_generator(image_path: str, **kwargs) -> AsyncLockscreenGenerator:
+    """
+    Creates a generator without blocking the event loop, finding the
+    monitors with get_layout unless given resolutions
+
+    Arguments:
+        image_path (str): location of the image or directory of images
+        **kwargs: the arguments to LockscreenGenerator, and executor, see
+            AsyncLockscreenGenerator
+
+    Returns:
+        (AsyncLockscreenGenerator): the generator
+    """
+    # The generator exits when there is no image, which must not happen
+    # within an event loop
+    if not os.path.exists(image_path):
+        raise FileNotFoundError(f"No image at {image_path}")
+
+    executor = kwargs.pop("executor", None)
+    if not kwargs.get("resolutions"):
+        kwargs["resolutions"] = await get_layout(kwargs.pop("geometry_provider", None))
+
+    loop = asyncio.get_running_loop()
+    lockscreen_generator = await loop.run_in_executor(
+        None, lambda: LockscreenGenerator(image_path, **kwargs)
+    )
+    return AsyncLockscreenGenerator(lockscreen_generator, executor)
+
+
+async def get_layout(provider: GeometryProvider = None) -> List[Tuple[int]]:
+    """
+    Gets the layout of the monitors, running xrandr as an async subprocess
+
+    Arguments:
+        provider (GeometryProvider): the provider to ask, by default the
+            automatic one, see geometry.get_geometry_provider
+
+    Returns:
+        (List[Tuple[int]]): the [width, height, offset_x, offset_y] of each
+            monitor
+    """
+    if provider is None:
+        provider = get_geometry_provider()
+
+    if isinstance(provider, XrandrProvider):
+        return await get_xrandr_layout()
+
+    if isinstance(provider, FallbackProvider):
+        errors = []
+        for fallback_provider in provider.providers:
+            try:
+                return await get_layout(fallback_provider)
+            except GeometryError as error:
+                errors.append(str(error))
+
+        raise GeometryError("; ".join(errors) or "No geometry providers")
+
+    if isinstance(provider, CachedProvider):
+        signature = get_drm_signature(provider.drm_path)
+        layout = provider.get_cached_layout(signature)
+        if layout is None:
+            layout = await get_layout(provider.provider)
+            provider.cache_layout(signature, layout)
+
+        return layout
+
+    # The rest only read files
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, provider.get_layout)
+
+
+async def get_xrandr_layout() -> List[Tuple[int]]:
+    """
+    Gets the layout from the output of xrandr, see geometry.XrandrProvider
+
+    Returns:
+        (List[Tuple[int]]): the [width, height, offset_x, offset_y] of each
+            monitor
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "xrandr",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError as error:
+        raise GeometryError(f"Could not run xrandr: {error}") from error
+
+    try:
+        command_output, _ = await process.communicate()
+    except asyncio.CancelledError:
+        await stop_process(process)
+        raise
+
+    if process.returncode:
+        raise GeometryError(f"Could not run xrandr: exited with {process.returncode}")
+
+    return parse_layout(command_output.decode("UTF-8", "replace"))
+
+
+async def run_hooks(
+    hooks_dir: str = hooks.HOOKS_PATH,
+    timeout: float = hooks.DEFAULT_TIMEOUT,
+    timeouts: Dict[str, float] = None,
+) -> List[Dict]:
+    """
+    Runs the hooks stage by stage as async subprocesses, see hooks.run_hooks.
+    Cancelling stops the hooks still running.
+
+    Arguments:
+        hooks_dir (str): the directory the hooks are in
+        timeout (float): the seconds a hook may run for, 0 for no limit
+        timeouts (Dict[str, float]): the timeout of hooks by name, overriding
+            the default timeout
+
+    Returns:
+        (List[Dict]): the name, exit code, run time and whether each hook
+            timed out
+    """
+    os.makedirs(hooks_dir, exist_ok=True)
+
+    results = []
+    for stage in hooks.get_hook_stages(hooks_dir):
+        results.extend(
+            await asyncio.gather(
+                *(
+                    run_hook(hooks_dir, name, (timeouts or {}).get(name, timeout))
+                    for name in stage
+                )
+            )
+        )
+
+    return results
+
+
+async def run_hook(hooks_dir: str, name: str, timeout: float) -> Dict:
+    """
+    Runs a hook, stopping it if it runs for longer than its timeout
+
+    Arguments:
+        hooks_dir (str): the directory the hooks are in
+        name (str): the name of the hook
+        timeout (float): the seconds the hook may run for, 0 for no limit
+
+    Returns:
+        (Dict): the result of the hook, see run_hooks
+    """
+    start = time.monotonic()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            os.path.join(hooks_dir, name),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True,
+        )
+    except OSError as error:
+        logger.warning("Could not run hook %s: %s", name, error)
+        return hooks.get_hook_result(name, None, 0)
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(process.wait(), float(timeout or 0) or None)
+    except asyncio.TimeoutError:
+        timed_out = True
+        await stop_process(process)
+    except asyncio.CancelledError:
+        await stop_process(process)
+        raise
+
+    return hooks.get_hook_result(
+        name, process.returncode, time.monotonic() - start, timed_out
+    )
+
+
+async def stop_process(process: asyncio.subprocess.Process):
+    """
+    Stops a subprocess and anything it started, killing them if they do not
+    exit when asked, see hooks.stop_hook
+
+    Arguments:
+        process (asyncio.subprocess.Process): the subprocess, started in a
+            new session
+    """
+    for signal_number in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, signal_number)
+        except ProcessLookupError:
+            pass
+
+        try:
+            await asyncio.wait_for(process.wait(), hooks.KILL_GRACE_PERIOD)
+            return
+        except asyncio.TimeoutError:
+            continue
@@ -0,0 +1,394 @@
+"""Management of the size and contents of the lockscreen cache"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+from . import utils
+from .index import FingerprintIndex
+from .settings import CACHE_PATH
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+CACHE_STATE_FILE_NAME = "cache.json"
+SECONDS_PER_DAY = 24 * 60 * 60
+SOURCE_CACHE_PATH = os.path.join(CACHE_PATH, "sources")
+TILE_CACHE_PATH = os.path.join(CACHE_PATH, "tiles")
+# Cached images are stored as PPM, uncompressed RGB behind a short header,
+# so loading one is little more than a read
+IMAGE_CACHE_EXTENSION = ".ppm"
+
+
+class CacheManager:
+    """
+    Keeps the lockscreen directory within a size and file count budget,
+    evicting the lockscreens least recently used by update() first, and
+    removes lockscreens for layouts and sources that are gone
+    """
+
+    def __init__(self, out_dir: str, **kwargs):
+        """
+        The initialisation method
+
+        Arguments:
+            out_dir (str): the directory the lockscreens are saved under
+        """
+        self.out_dir = out_dir
+        self.lockscreen_dir = os.path.join(out_dir, "lockscreen")
+        self.state_path = os.path.join(out_dir, CACHE_STATE_FILE_NAME)
+        self.max_bytes = int(float(kwargs.get("max_mb", 0)) * 1024 * 1024)
+        self.max_files = int(kwargs.get("max_files", 0))
+        self.layout_ttl = float(kwargs.get("layout_days", 30)) * SECONDS_PER_DAY
+
+        self.state = load_cache_state(self.state_path)
+        self.changed = False
+
+    def touch(self, out_path: str):
+        """
+        Records that a lockscreen was just used
+
+        Arguments:
+            out_path (str): the path to the lockscreen
+        """
+        self.state["used"][os.path.basename(out_path)] = time.time()
+        self.changed = True
+
+    def see_layout(self, screen_md5: str):
+        """
+        Records that a monitor layout was just seen
+
+        Arguments:
+            screen_md5 (str): the md5 of the layout
+        """
+        self.state["layouts"][screen_md5] = time.time()
+        self.changed = True
+
+    def enforce_budget(self) -> Tuple[int]:
+        """
+        Removes the least recently used lockscreens until the cache is within
+        its size and file count budget
+
+        Returns:
+            (Tuple[int]): the number of files and bytes removed
+        """
+        if not self.max_bytes and not self.max_files:
+            return (0, 0)
+
+        entries = self.get_entries()
+        total_bytes = sum(entry["size"] for entry in entries)
+        total_files = len(entries)
+        protected = get_current_lockscreens(self.out_dir)
+
+        removed = []
+        for entry in sorted(entries, key=lambda entry: entry["last_used"]):
+            over_bytes = self.max_bytes and total_bytes > self.max_bytes
+            over_files = self.max_files and total_files > self.max_files
+            if not over_bytes and not over_files:
+                break
+
+            if entry["path"] in protected:
+                continue
+
+            removed.append(entry)
+            total_bytes -= entry["size"]
+            total_files -= 1
+
+        return self.remove_entries(removed)
+
+    def collect_garbage(self, index: FingerprintIndex) -> Tuple[int]:
+        """
+        Removes the lockscreens of layouts not seen within the layout time to
+        live and of sources that no longer exist, then enforces the budget
+
+        Arguments:
+            index (FingerprintIndex): the index of the sources
+
+        Returns:
+            (Tuple[int]): the number of files and bytes removed
+        """
+        now = time.time()
+        protected = get_current_lockscreens(self.out_dir)
+        removed_paths = set()
+
+        for image_path in list(index.entries):
+            if not os.path.exists(image_path):
+                removed_paths.update(
+                    os.path.realpath(out_path)
+                    for out_path in index.get_outputs(image_path)
+                )
+                index.remove(image_path)
+
+        for entry in self.get_entries():
+            last_seen = self.state["layouts"].get(entry["screen_md5"], entry["mtime"])
+            if now - last_seen > self.layout_ttl:
+                removed_paths.add(entry["path"])
+
+        removed = [
+            entry
+            for entry in self.get_entries()
+            if entry["path"] in removed_paths and entry["path"] not in protected
+        ]
+        removed_files, removed_bytes = self.remove_entries(removed)
+
+        # Forget the last use of lockscreens removed by other means
+        names = {entry["name"] for entry in self.get_entries()}
+        for name in set(self.state["used"]) - names:
+            del self.state["used"][name]
+            self.changed = True
+
+        budget_files, budget_bytes = self.enforce_budget()
+        return (removed_files + budget_files, removed_bytes + budget_bytes)
+
+    def get_entries(self) -> List[Dict]:
+        """
+        Gets every lockscreen in the cache
+
+        Returns:
+            (List[Dict]): the real path, name, size, modification time,
+                layout md5 and last use of each lockscreen
+        """
+        try:
+            dir_entries = list(os.scandir(self.lockscreen_dir))
+        except FileNotFoundError:
+            return []
+
+        entries = []
+        for dir_entry in dir_entries:
+            name_parts = dir_entry.name.split("_")
+            if (
+                dir_entry.name.startswith(".")
+                or dir_entry.name.endswith(".lock")
+                or len(name_parts) < 2
+                or not dir_entry.is_file()
+            ):
+                continue
+
+            stat = dir_entry.stat()
+            entries.append(
+                {
+                    "path": os.path.realpath(dir_entry.path),
+                    "name": dir_entry.name,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "screen_md5": name_parts[1].split(".")[0],
+                    "last_used": self.state["used"].get(dir_entry.name, stat.st_mtime),
+                }
+            )
+
+        return entries
+
+    def remove_entries(self, entries: List[Dict]) -> Tuple[int]:
+        """
+        Removes lockscreens from the cache
+
+        Arguments:
+            entries (List[Dict]): the lockscreens to remove
+
+        Returns:
+            (Tuple[int]): the number of files and bytes removed
+        """
+        removed_files, removed_bytes = (0, 0)
+        for entry in entries:
+            try:
+                os.remove(entry["path"])
+            except FileNotFoundError:
+                continue
+
+            self.state["used"].pop(entry["name"], None)
+            removed_files += 1
+            removed_bytes += entry["size"]
+            self.changed = True
+
+        return (removed_files, removed_bytes)
+
+    def save(self):
+        """Writes the cache state to disk if it has changed"""
+        if not self.changed:
+            return
+
+        utils.write_json_atomic(self.state_path, self.state)
+        self.changed = False
+
+
+class ImageCache:
+    """
+    A directory of intermediate images named by a key, such as the
+    fingerprint of the source they were made from, kept within a size budget
+    by removing the least recently used first
+    """
+
+    def __init__(self, cache_dir: str, max_mb: float = 0):
+        """
+        The initialisation method
+
+        Arguments:
+            cache_dir (str): the directory the images are kept in
+            max_mb (float): the most megabytes the images may take up, 0 for
+                no limit
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = int(float(max_mb) * 1024 * 1024)
+
+    def get_path(self, key: str) -> str:
+        """
+        Gets the path an image is cached at
+
+        Arguments:
+            key (str): the key of the image
+
+        Returns:
+            (str): the path to the cached image
+        """
+        return os.path.join(self.cache_dir, key + IMAGE_CACHE_EXTENSION)
+
+    def enforce_budget(self) -> Tuple[int]:
+        """
+        Removes the least recently used images until the cache is within its
+        size budget
+
+        Returns:
+            (Tuple[int]): the number of files and bytes removed
+        """
+        if not self.max_bytes:
+            return (0, 0)
+
+        try:
+            dir_entries = [
+                (dir_entry.path, dir_entry.stat())
+                for dir_entry in os.scandir(self.cache_dir)
+                if dir_entry.name.endswith(IMAGE_CACHE_EXTENSION)
+                and not dir_entry.name.startswith(".")
+            ]
+        except FileNotFoundError:
+            return (0, 0)
+
+        total_bytes = sum(stat.st_size for _, stat in dir_entries)
+        removed_files = 0
+        removed_bytes = 0
+        for path, stat in sorted(dir_entries, key=lambda entry: entry[1].st_mtime):
+            if total_bytes <= self.max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= stat.st_size
+            removed_files += 1
+            removed_bytes += stat.st_size
+
+        return (removed_files, removed_bytes)
+
+
+def load_cached_image(cache_path: str) -> Image:
+    """
+    Loads an image from an image cache, marking it as used. A cached image
+    that can not be read is removed.
+
+    Arguments:
+        cache_path (str): the path to the cached image
+
+    Returns:
+        (PIL.Image): the image, None if it is not cached
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    try:
+        with Image.open(cache_path) as cached_image:
+            cached_image.load()
+            image = cached_image
+    except FileNotFoundError:
+        return None
+    except (OSError, SyntaxError, ValueError):
+        remove_cached_image(cache_path)
+        return None
+
+    try:
+        os.utime(cache_path)
+    except FileNotFoundError:
+        pass
+
+    return image
+
+
+def save_cached_image(image: Image, cache_path: str):
+    """
+    Saves an image to an image cache, writing to a temporary file first so
+    other processes never load a partial image
+
+    Arguments:
+        image (PIL.Image): the image to save
+        cache_path (str): the path to save it to
+    """
+    cache_dir, cache_name = os.path.split(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = os.path.join(cache_dir, f".{os.getpid()}-{cache_name}")
+    try:
+        image.save(temp_path, "PPM")
+        os.replace(temp_path, cache_path)
+    finally:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+
+def remove_cached_image(cache_path: str):
+    """
+    Removes an image from an image cache, if it is there
+
+    Arguments:
+        cache_path (str): the path to the cached image
+    """
+    try:
+        os.remove(cache_path)
+    except FileNotFoundError:
+        pass
+
+
+def load_cache_state(state_path: str) -> Dict:
+    """
+    Loads the last use of each lockscreen and when each layout was seen
+
+    Arguments:
+        state_path (str): the location of the state file
+
+    Returns:
+        (Dict): the cache state
+    """
+    state = {"used": {}, "layouts": {}}
+    try:
+        with open(state_path, encoding="UTF-8") as state_file:
+            loaded_state = json.load(state_file)
+    except (IOError, ValueError):
+        return state
+
+    if isinstance(loaded_state, dict):
+        for key, value in state.items():
+            value.update(loaded_state.get(key, {}))
+
+    return state
+
+
+def get_current_lockscreens(out_dir: str) -> List[str]:
+    """
+    Gets the lockscreens the current lockscreen links point to
+
+    Arguments:
+        out_dir (str): the directory the links are in
+
+    Returns:
+        (List[str]): the paths of the linked lockscreens
+    """
+    try:
+        names = os.listdir(out_dir)
+    except FileNotFoundError:
+        return []
+
+    return [
+        os.path.realpath(os.path.join(out_dir, name))
+        for name in names
+        if name.startswith("current_lockscreen")
+        and os.path.islink(os.path.join(out_dir, name))
+    ]
@@ -12,8 +12,29 @@ CONFIG_FILE_PATH = os.path.join(settings.CONFIG_PATH, "config.json")
 DEFAULT_CONFIG = {
     "blur": 0,
     "brightness": 1,
+    "blur_quality": 1,
     "out_directory": "$HOME/.local/share/jyou/",
+    "include": [],
+    "exclude": [],
     "progress": False,
+    "jobs": 1,
+    "encoder": "png",
+    "prefetch": False,
+    "selection": "random",
+    "fingerprint": "md5",
+    "hook_timeout": 30,
+    "hook_timeouts": {},
+    "detach_hooks": False,
+    "presets": {},
+    "batch_layouts": [],
+    "cache_max_mb": 0,
+    "cache_max_files": 0,
+    "cache_layout_days": 30,
+    "source_cache_mb": 0,
+    "tile_cache_mb": 0,
+    "geometry": "auto",
+    "layout": "",
+    "layout_file": "",
     "debug": False,
 }
 
@@ -34,6 +55,10 @@ def parse_config() -> Dict:
     except IOError:
         save_config(config)
 
+    config["out_directory"] = os.path.expanduser(
+        os.path.expandvars(config["out_directory"])
+    )
+
     return config
 
 
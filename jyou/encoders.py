@@ -0,0 +1,144 @@
+"""Encoders for saving generated lockscreens"""
+from __future__ import annotations
+
+import io
+from typing import TYPE_CHECKING, Dict, Tuple
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+class Encoder:
+    """Base class for anything that can save a lockscreen"""
+
+    def __init__(self, name: str, extension: str, link_extension: str):
+        """
+        The initialisation method
+
+        Arguments:
+            name (str): the name of the encoder, also used as its cache key
+            extension (str): the extension of the files it writes
+            link_extension (str): the extension of the current lockscreen link
+        """
+        self.name = name
+        self.extension = extension
+        self.link_extension = link_extension
+
+    def save(self, image: Image, out_path: str):
+        """
+        Saves the image to the out path
+
+        Arguments:
+            image (PIL.Image): the image to save
+            out_path (str): the path to save the image to, or a binary file
+        """
+        raise NotImplementedError
+
+    def encode(self, image: Image) -> bytes:
+        """
+        Encodes the image in memory, as it would be saved
+
+        Arguments:
+            image (PIL.Image): the image to encode
+
+        Returns:
+            (bytes): the encoded image
+        """
+        out_file = io.BytesIO()
+        self.save(image, out_file)
+        return out_file.getvalue()
+
+
+class PngEncoder(Encoder):
+    """Saves lockscreens as PNGs with the given zlib settings"""
+
+    def __init__(
+        self, name: str, extension: str, compress_level: int, optimize: bool = False
+    ):
+        """
+        The initialisation method
+
+        Arguments:
+            name (str): the name of the encoder
+            extension (str): the extension of the files it writes
+            compress_level (int): the zlib compression level, from 0 to 9
+            optimize (bool): search for the smallest possible encoding
+        """
+        super().__init__(name, extension, ".png")
+        self.compress_level = compress_level
+        self.optimize = optimize
+
+    def save(self, image: Image, out_path: str):
+        image.save(
+            out_path,
+            "PNG",
+            compress_level=self.compress_level,
+            optimize=self.optimize,
+        )
+
+
+class RawEncoder(Encoder):
+    """
+    Saves lockscreens as uncompressed pixels in the format read by
+    `i3lock --raw <width>x<height>:<format>`, so locking needs no decoding
+    """
+
+    def __init__(self, name: str, raw_mode: str):
+        """
+        The initialisation method
+
+        Arguments:
+            name (str): the name of the encoder
+            raw_mode (str): the Pillow raw mode to write, e.g. 'BGRX'
+        """
+        extension = f".{raw_mode.lower()}"
+        super().__init__(name, extension, extension)
+        self.raw_mode = raw_mode
+
+    def save(self, image: Image, out_path: str):
+        with open(out_path, "wb") as out_file:
+            out_file.write(self.encode(image))
+
+    def encode(self, image: Image) -> bytes:
+        return image.tobytes("raw", self.raw_mode)
+
+    def get_raw_format(self, dimensions: Tuple[int]) -> str:
+        """
+        Gets the value to pass to i3lock's --raw option
+
+        Arguments:
+            dimensions (Tuple[int]): the width and height of the lockscreen
+
+        Returns:
+            (str): the raw format, e.g. '3840x1080:bgrx'
+        """
+        width, height = dimensions
+        return f"{width}x{height}:{self.raw_mode.lower()}"
+
+
+ENCODERS: Dict[str, Encoder] = {
+    encoder.name: encoder
+    for encoder in (
+        PngEncoder("png", ".png", compress_level=6),
+        PngEncoder("png-fast", ".fast.png", compress_level=1),
+        PngEncoder("png-max", ".max.png", compress_level=9, optimize=True),
+        RawEncoder("raw-bgrx", "BGRX"),
+        RawEncoder("raw-rgb", "RGB"),
+    )
+}
+
+
+def get_encoder(name: str) -> Encoder:
+    """
+    Gets the encoder with the given name
+
+    Arguments:
+        name (str): the name of the encoder
+
+    Returns:
+        (Encoder): the encoder
+    """
+    try:
+        return ENCODERS[name]
+    except KeyError as error:
+        raise ValueError(f"Unknown encoder: {name}") from error
@@ -1,17 +1,59 @@
-"""The main generation file containing tools to generate the needed images"""
+"""
+The main generation file containing tools to generate the needed images
+
+Pillow and tqdm are imported by the functions that use them, so updating to
+a lockscreen that is already rendered never loads either.
+"""
+from __future__ import annotations
+
+import collections
+import functools
+import itertools
+import json
+import math
 import os
-import subprocess
-import re
-import random
 import sys
+import time
 import logging
-from typing import List, Tuple
-
-import tqdm
-from PIL import Image, ImageFilter, ImageEnhance
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Tuple
 
 from .settings import DATA_PATH, DEBUG_MODE
-from . import utils, log
+from . import hooks, utils, log, stats
+from . import cache as image_cache
+from .cache import CacheManager, ImageCache, SOURCE_CACHE_PATH, TILE_CACHE_PATH
+from .encoders import RawEncoder, get_encoder
+from .geometry import GeometryError, XrandrProvider, get_geometry_provider
+from .index import FingerprintIndex, INDEX_FILE_NAME
+from .selection import (  # pylint: disable=unused-import
+    get_random_image_path,
+    get_selection_policy,
+)
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# How many times larger than the target size an image is kept when it is
+# shrunk before the final resample, see PIL.Image.Image.resize(reducing_gap)
+REDUCING_GAP = 2.0
+# The smallest radius the fast blur will blur at after shrinking the image,
+# below this the upsampled result visibly drifts from the exact Gaussian
+FAST_BLUR_MIN_RADIUS = 4
+# The name of the PIL.Image filter screens are resized with, part of the
+# pipeline digest
+RESAMPLE = "LANCZOS"
+# Bump whenever a change to the renderer changes its output, so lockscreens
+# rendered by older versions are not reused
+RENDERER_VERSION = 1
+# Render locks older than this are assumed to be left over from a crash
+RENDER_LOCK_TIMEOUT = 600
+NEXT_LOCKSCREEN_FILE_NAME = "next_lockscreen"
+# How many images are hashed at once while planning, enough to keep network
+# storage busy without competing with the renderers for the CPU
+PLAN_THREADS = 8
+# How many images planning may get ahead of the one rendering
+PLAN_QUEUE_SIZE = PLAN_THREADS * 4
+# How many images per job are queued for the render processes
+RENDER_QUEUE_FACTOR = 2
 
 logger = log.setup_logger(
     __name__ + "default", logging.WARN, log.DefaultLoggingHandler()
@@ -36,114 +78,978 @@ class LockscreenGenerator:
         self.verbose_logging = kwargs.get("verbose_logging", False)
         self.override = kwargs.get("override", False)
         self.blur_strength = kwargs.get("blur_strength", 0)
-        self.brightness = kwargs.get("brightness", 1)
-        self.out_dir = kwargs.get("output_path", DATA_PATH)
+        self.brightness = float(kwargs.get("brightness", 1))
+        self.blur_quality = float(kwargs.get("blur_quality", 1))
+        # Absolute, as detached prefetches run from the root directory
+        self.out_dir = os.path.abspath(kwargs.get("output_path", DATA_PATH))
+        self.jobs = get_job_count(kwargs.get("jobs", 1))
+        self.encoder = get_encoder(kwargs.get("encoder", "png"))
+        self.background_prefetch = kwargs.get("prefetch", False)
+        self.hook_timeout = kwargs.get("hook_timeout", hooks.DEFAULT_TIMEOUT)
+        self.hook_timeouts = kwargs.get("hook_timeouts", {})
+        self.detach_hooks = kwargs.get("detach_hooks", False)
+        self.selection = get_selection_policy(
+            kwargs.get("selection", "random"), self.out_dir
+        )
 
-        self.resolutions = get_resolution_image()
-        self.screen_md5 = utils.md5(
-            ",".join(str(i) for j in self.resolutions for i in j)
-        )[:20]
+        self.resolutions = kwargs.get("resolutions")
+        if not self.resolutions:
+            geometry_provider = kwargs.get("geometry_provider")
+            try:
+                if geometry_provider is None:
+                    geometry_provider = get_geometry_provider()
+                self.resolutions = geometry_provider.get_layout()
+            except GeometryError as error:
+                logger.critical("Could not get the monitor layout: %s", error)
+                sys.exit(1)
+
+        self.screen_md5 = get_screen_md5(self.resolutions)
 
         if DEBUG_MODE:
             logger.setLevel(logging.DEBUG)
             tqdm_logger.setLevel(logging.DEBUG)
+            hooks.logger.setLevel(logging.DEBUG)
         elif self.verbose_logging:
             logger.setLevel(logging.INFO)
             tqdm_logger.setLevel(logging.INFO)
+            hooks.logger.setLevel(logging.INFO)
 
         os.makedirs(self.out_dir, exist_ok=True)
+        self.index = FingerprintIndex(
+            os.path.join(self.out_dir, INDEX_FILE_NAME),
+            kwargs.get("fingerprint", "md5"),
+        )
+        self.cache = CacheManager(
+            self.out_dir,
+            max_mb=kwargs.get("cache_max_mb", 0),
+            max_files=kwargs.get("cache_max_files", 0),
+            layout_days=kwargs.get("cache_layout_days", 30),
+        )
+        # Pre-scaled copies of the sources and finished screens, only kept
+        # when given a budget
+        self.source_cache = None
+        if kwargs.get("source_cache_mb"):
+            self.source_cache = ImageCache(
+                os.path.abspath(kwargs.get("source_cache_dir", SOURCE_CACHE_PATH)),
+                kwargs.get("source_cache_mb"),
+            )
+        self.tile_cache = None
+        if kwargs.get("tile_cache_mb"):
+            self.tile_cache = ImageCache(
+                os.path.abspath(kwargs.get("tile_cache_dir", TILE_CACHE_PATH)),
+                kwargs.get("tile_cache_mb"),
+            )
 
-        self.image_paths = get_image_path_list(image_path)
-        if not self.image_paths:
+        if not os.path.exists(image_path):
             logger.critical("File does not exist!")
             sys.exit(1)
 
-    def generate(self):
-        """Generate the lockscreen image"""
-        # Apply this function to every image in the passed list
-        non_generated_images = []
-        lockscreen_dir = os.path.join(self.out_dir, "lockscreen")
-        os.makedirs(lockscreen_dir, exist_ok=True)
+        # The library is only listed in full when something needs every
+        # image, updating streams it instead
+        self.image_source = os.path.abspath(image_path)
+        self.include = kwargs.get("include") or []
+        self.exclude = kwargs.get("exclude") or []
+        self._image_paths = None
 
-        for image_path in self.image_paths:
-            out_path = get_out_path_from_md5(
-                image_path, self.screen_md5, lockscreen_dir
-            )
+    @property
+    def image_paths(self) -> List[str]:
+        """
+        Every image in the library, listed on first use
 
-            if not os.path.isfile(out_path) or self.override:
-                non_generated_images.append(
-                    {"image_path": image_path, "out_path": out_path}
-                )
+        Returns:
+            (List[str]): the absolute paths to the images
+        """
+        if self._image_paths is None:
+            self._image_paths = list(self.iter_image_paths())
 
-        if len(non_generated_images) > 0:
-            for i in tqdm.tqdm(
-                range(len(non_generated_images)),
-                bar_format=log.BAR_FORMAT,
-                disable=not self.progress_bar,
-            ):
-                # Save the image
-                out_path = non_generated_images[i]["out_path"]
-                lockscreen_image = generate_lockscreen_image(
-                    non_generated_images[i]["image_path"],
-                    self.resolutions,
-                    self.blur_strength,
-                    self.brightness,
-                )
-                lockscreen_image.save(out_path)
+        return self._image_paths
+
+    @image_paths.setter
+    def image_paths(self, image_paths: List[str]):
+        """
+        Replaces the list of images, None listing the library again on use
+
+        Arguments:
+            image_paths (List[str]): the absolute paths to the images
+        """
+        self._image_paths = image_paths
+
+    def iter_image_paths(self) -> Iterator[str]:
+        """
+        Yields the images in the library as they are found, or from the list
+        of them if it has been made
+
+        Yields:
+            (str): the absolute path to each image
+        """
+        if self._image_paths is not None:
+            yield from self._image_paths
         else:
+            yield from get_image_path_list(
+                self.image_source, self.include, self.exclude, stream=True
+            )
+
+    def is_library_image(self, image_path: str) -> bool:
+        """
+        Checks if an image is part of the library without listing it
+
+        Arguments:
+            image_path (str): the absolute path to the image
+
+        Returns:
+            (bool): if the image is in the library
+        """
+        if self._image_paths is not None:
+            return image_path in self._image_paths
+
+        source = os.path.abspath(self.image_source)
+        if os.path.isfile(source):
+            return image_path == source
+
+        relative_path = os.path.relpath(image_path, source)
+        return (
+            not relative_path.startswith(os.pardir + os.sep)
+            and utils.is_image_path(image_path)
+            and utils.is_included_path(relative_path, self.include, self.exclude)
+            and os.path.isfile(image_path)
+        )
+
+    def get_rendered_image_paths(self) -> Iterator[str]:
+        """
+        Yields the images in the library whose lockscreen is already rendered
+        for the current screens and settings, from the index so the library
+        is not listed
+
+        Yields:
+            (str): the absolute path to each image
+        """
+        try:
+            rendered_names = set(os.listdir(os.path.join(self.out_dir, "lockscreen")))
+        except OSError:
+            return
+
+        suffix = (
+            f"_{self.screen_md5}"
+            f"_{get_pipeline_md5(self.get_effects(), self.encoder.name)}"
+            f"{self.encoder.extension}"
+        )
+        for image_path, entry in list(self.index.entries.items()):
+            out_name = entry["digest"][:20] + suffix
+            if out_name in rendered_names and self.is_library_image(image_path):
+                yield image_path
+
+    def generate(self, image_paths: List[str] = None):
+        """
+        Generate the lockscreen image
+
+        Arguments:
+            image_paths (List[str]): the images to generate for, defaulting
+                to every image in the parent class
+        """
+        with stats.stage("generate"):
+            self.generate_variants(
+                [self.resolutions], [self.get_effects()], image_paths
+            )
+
+    def generate_variants(
+        self,
+        layouts: List[List[Tuple[int]]],
+        presets: List[Dict],
+        image_paths: List[str] = None,
+    ):
+        """
+        Generate the lockscreens of every layout and effect preset, decoding
+        and hashing each image once for all of them
+
+        Arguments:
+            layouts (List[List[Tuple[int]]]): the layouts to generate for
+            presets (List[Dict]): the effects of each preset, see get_effects
+            image_paths (List[str]): the images to generate for, defaulting
+                to every image in the parent class
+        """
+        if image_paths is None:
+            image_paths = self.image_paths
+
+        planned_images = self.plan_lockscreens(layouts, presets, image_paths)
+        rendered_images, failed_images = self.render_lockscreens(planned_images)
+        if failed_images:
+            logger.warning(
+                "Failed to generate %d of %d lockscreens.",
+                failed_images,
+                rendered_images,
+            )
+        elif not rendered_images:
             logger.info("No lockscreens to generate.")
 
-    def update(self):
-        """Update the wallpaper based on the parsed image in the parent class"""
+        self.save_index()
+
+        for resolutions in layouts:
+            self.cache.see_layout(get_screen_md5(resolutions))
+        removed_files, removed_bytes = self.cache.enforce_budget()
+        if removed_files:
+            logger.info(
+                "Evicted %d lockscreens (%s) to stay within the cache budget.",
+                removed_files,
+                utils.format_size(removed_bytes),
+            )
+        self.cache.save()
+        self.enforce_image_cache_budgets()
+
+    def plan_lockscreens(
+        self,
+        layouts: List[List[Tuple[int]]],
+        presets: List[Dict],
+        image_paths: Iterable[str],
+    ) -> Iterator[Dict]:
+        """
+        Finds the lockscreens missing for each image, hashing the images in a
+        pool of threads so slow storage is read from in parallel. Images are
+        yielded in order as soon as they are planned, so rendering can start
+        while the rest are still being hashed.
+
+        Arguments:
+            layouts (List[List[Tuple[int]]]): the layouts to generate for
+            presets (List[Dict]): the effects of each preset, see get_effects
+            image_paths (Iterable[str]): the images to generate for
+
+        Yields:
+            (Dict): the path to each image missing lockscreens and the
+                variants to render for it, or failed if it could not be
+                planned
+        """
+        # pylint: disable=import-outside-toplevel
+        from concurrent.futures import ThreadPoolExecutor
+
         lockscreen_dir = os.path.join(self.out_dir, "lockscreen")
-        image_path = get_random_image_path(self.image_paths)
-        self.image_paths = [image_path]
+        os.makedirs(lockscreen_dir, exist_ok=True)
+        rendered_names = set(os.listdir(lockscreen_dir))
+        screen_md5s = [get_screen_md5(i) for i in layouts]
+        pipeline_md5s = [get_pipeline_md5(i, self.encoder.name) for i in presets]
+
+        def plan_image(image_path: str) -> Tuple[List[Dict], List[str], str, str]:
+            variants = []
+            out_paths = []
+            source_path = None
+            tile_prefix = None
+            with stats.stage("plan", image_path):
+                for resolutions, screen_md5 in zip(layouts, screen_md5s):
+                    for effects, pipeline_md5 in zip(presets, pipeline_md5s):
+                        out_path = get_out_path_from_md5(
+                            image_path,
+                            screen_md5,
+                            lockscreen_dir,
+                            self.index,
+                            self.encoder.extension,
+                            pipeline_md5,
+                        )
+
+                        out_name = os.path.basename(out_path)
+                        if self.override or out_name not in rendered_names:
+                            variants.append(
+                                {"out_path": out_path, "resolutions": resolutions}
+                            )
+                            variants[-1].update(effects)
+                        else:
+                            out_paths.append(out_path)
+
+                if variants:
+                    tile_prefix = self.get_tile_prefix(image_path)
+                    # Start loading the image while earlier ones render
+                    source_path = self.get_source_path(image_path)
+                    if source_path is not None and os.path.isfile(source_path):
+                        utils.read_ahead(source_path)
+                    else:
+                        utils.read_ahead(image_path)
+
+            return (variants, out_paths, source_path, tile_prefix)
+
+        def try_plan_image(image_path: str) -> Tuple[List[Dict], List[str], str, str]:
+            # A failing image is reported and skipped, see render_lockscreens
+            # pylint: disable=broad-except
+            try:
+                return plan_image(image_path)
+            except Exception as error:
+                tqdm_logger.error("Failed to plan %s: %s", image_path, error)
+                return None
+
+        # Each thread hashes a different image, so they never update the
+        # same index entry
+        with ThreadPoolExecutor(max_workers=PLAN_THREADS) as executor:
+            pending = collections.deque()
+            image_paths = iter(image_paths)
+            while True:
+                for image_path in itertools.islice(
+                    image_paths, PLAN_QUEUE_SIZE - len(pending)
+                ):
+                    pending.append(
+                        (image_path, executor.submit(try_plan_image, image_path))
+                    )
+                if not pending:
+                    break
+
+                image_path, future = pending.popleft()
+                planned_image = future.result()
+                if planned_image is None:
+                    yield {"image_path": image_path, "failed": True}
+                    continue
+
+                variants, out_paths, source_path, tile_prefix = planned_image
+                self.add_outputs(image_path, out_paths)
+                if variants:
+                    yield {
+                        "image_path": image_path,
+                        "variants": variants,
+                        "source_path": source_path,
+                        "tile_prefix": tile_prefix,
+                    }
+
+    def render_lockscreens(self, planned_images: Iterable[Dict]) -> Tuple[int]:
+        """
+        Renders the given lockscreens as they are planned, spreading the work
+        over a process pool when more than one job is requested. A failing
+        image is reported and skipped without stopping the rest of the batch.
+
+        Arguments:
+            planned_images (Iterable[Dict]): the image paths and the
+                variants to render for each, see plan_lockscreens
+
+        Returns:
+            (Tuple[int]): the number of images rendered and of those that
+                failed
+        """
+        # pylint: disable=import-outside-toplevel
+        import queue
+        import tqdm
+
+        rendered_images = 0
+        failed_images = 0
+        recording = stats.is_enabled()
+
+        # The total grows as images are planned
+        with tqdm.tqdm(
+            total=0,
+            bar_format=log.BAR_FORMAT,
+            disable=not self.progress_bar,
+        ) as progress:
+            if self.jobs > 1:
+                with get_process_pool(self.jobs) as executor:
+                    done = queue.SimpleQueue()
+                    pending = 0
+                    for image in planned_images:
+                        if image.get("failed"):
+                            rendered_images += 1
+                            failed_images += 1
+                            progress.total += 1
+                            progress.update()
+                            continue
+
+                        future = executor.submit(
+                            stats.run_recorded,
+                            recording,
+                            render_lockscreen_variants,
+                            image["image_path"],
+                            image["variants"],
+                            self.encoder.name,
+                            image.get("source_path"),
+                            image.get("tile_prefix"),
+                        )
+                        future.image_path = image["image_path"]
+                        future.add_done_callback(done.put)
+                        rendered_images += 1
+                        pending += 1
+                        progress.total += 1
+                        progress.refresh()
+
+                        # Plan no further ahead than the workers can keep up with
+                        while pending >= self.jobs * RENDER_QUEUE_FACTOR or (
+                            not done.empty()
+                        ):
+                            failed_images += self.add_rendered(done.get())
+                            pending -= 1
+                            progress.update()
+
+                    for _ in range(pending):
+                        failed_images += self.add_rendered(done.get())
+                        progress.update()
+            else:
+                for image in planned_images:
+                    rendered_images += 1
+                    progress.total += 1
+                    progress.refresh()
+                    if image.get("failed"):
+                        failed_images += 1
+                        progress.update()
+                        continue
+
+                    try:
+                        self.add_outputs(
+                            *render_lockscreen_variants(
+                                image["image_path"],
+                                image["variants"],
+                                self.encoder.name,
+                                image.get("source_path"),
+                                image.get("tile_prefix"),
+                            )
+                        )
+                    # pylint: disable=broad-except
+                    except Exception as error:
+                        failed_images += 1
+                        tqdm_logger.error(
+                            "Failed to generate %s: %s", image["image_path"], error
+                        )
+                    progress.update()
+
+        return (rendered_images, failed_images)
+
+    def add_rendered(self, future) -> int:
+        """
+        Records the lockscreens a worker process rendered, see
+        render_lockscreens
+
+        Arguments:
+            future (concurrent.futures.Future): the finished render
+
+        Returns:
+            (int): 1 if the render failed, otherwise 0
+        """
+        try:
+            self.add_outputs(*stats.add_records(*future.result()))
+        # pylint: disable=broad-except
+        except Exception as error:
+            tqdm_logger.error("Failed to generate %s: %s", future.image_path, error)
+            return 1
+
+        return 0
+
+    def add_outputs(self, image_path: str, out_paths: List[str]):
+        """
+        Records the lockscreens rendered from an image in the index
+
+        Arguments:
+            image_path (str): the path to the image
+            out_paths (List[str]): the paths to the rendered lockscreens
+        """
+        for out_path in out_paths:
+            self.index.add_output(image_path, out_path)
+
+    def get_source_path(self, image_path: str) -> str:
+        """
+        Gets where the pre-scaled copy of an image is cached, named by its
+        fingerprint so a changed image is never served an old copy
+
+        Arguments:
+            image_path (str): the path to the image
 
-        image_out_path = get_out_path_from_md5(
-            image_path, self.screen_md5, lockscreen_dir
+        Returns:
+            (str): the path to the cached copy, None if sources are not cached
+        """
+        if self.source_cache is None:
+            return None
+
+        return self.source_cache.get_path(self.index.get_digest(image_path))
+
+    def get_tile_prefix(self, image_path: str) -> str:
+        """
+        Gets the start of the paths the finished screens of an image are
+        cached at, see get_tile_path
+
+        Arguments:
+            image_path (str): the path to the image
+
+        Returns:
+            (str): the prefix, None if screens are not cached
+        """
+        if self.tile_cache is None:
+            return None
+
+        return os.path.join(
+            self.tile_cache.cache_dir, self.index.get_digest(image_path)
         )
-        # Copy the image if it exists
-        if os.path.isfile(image_out_path):
-            symlink_path = os.path.join(self.out_dir, "current_lockscreen.png")
+
+    def enforce_image_cache_budgets(self):
+        """Keeps the source and tile caches within their budgets"""
+        for cached_images, name in (
+            (self.source_cache, "sources"),
+            (self.tile_cache, "screens"),
+        ):
+            if cached_images is None:
+                continue
+
+            removed_files, removed_bytes = cached_images.enforce_budget()
+            if removed_files:
+                logger.info(
+                    "Evicted %d cached %s (%s) to stay within their budget.",
+                    removed_files,
+                    name,
+                    utils.format_size(removed_bytes),
+                )
+
+    def save_index(self):
+        """
+        Saves the index, pointing the current lockscreen links at the new
+        names of any lockscreens a fingerprint migration renamed
+        """
+        self.index.save()
+        if not self.index.renamed:
+            return
+
+        renamed = {
+            os.path.abspath(old_path): new_path
+            for old_path, new_path in self.index.renamed.items()
+        }
+        for name in os.listdir(self.out_dir):
+            link_path = os.path.join(self.out_dir, name)
+            if name.startswith("current_lockscreen") and os.path.islink(link_path):
+                new_path = renamed.get(os.readlink(link_path))
+                if new_path is not None:
+                    symlink_image(new_path, link_path)
+
+        self.index.renamed.clear()
+
+    def get_effects(self) -> Dict:
+        """
+        Gets the effects applied to the lockscreens
+
+        Returns:
+            (Dict): the blur, brightness and blur quality
+        """
+        return {
+            "blur": self.blur_strength,
+            "brightness": self.brightness,
+            "blur_quality": self.blur_quality,
+        }
+
+    def update(self) -> str:
+        """
+        Update the wallpaper based on the parsed image in the parent class
+
+        Returns:
+            (str): the path to the new lockscreen, None if it failed
+        """
+        image_path, image_out_path = self.select_update_image()
+        if image_path is None:
+            return None
+
+        # Generate the image if it does not exist
+        if not os.path.isfile(image_out_path):
+            self.generate([image_path])
+
+            if not os.path.isfile(image_out_path):
+                logger.error("Could not generate a lockscreen for %s", image_path)
+                return None
+
+        self.link_lockscreen(image_path, image_out_path)
+
+        # Run postscripts
+        with stats.stage("hooks"):
+            if self.detach_hooks:
+                hooks.spawn_hooks(
+                    timeout=self.hook_timeout, timeouts=self.hook_timeouts
+                )
+            else:
+                hooks.run_hooks(timeout=self.hook_timeout, timeouts=self.hook_timeouts)
+
+        if self.background_prefetch:
+            self.spawn_prefetch(image_path)
+
+        return image_out_path
+
+    def select_update_image(self) -> Tuple[str]:
+        """
+        Picks the image to update to, taking the prefetched one if it is ready
+
+        Returns:
+            (Tuple[str]): the path to the image and to its lockscreen, both
+                None if there are no images
+        """
+        with stats.stage("select"):
+            image_path = self.get_prefetched_image_path()
+            if image_path is None:
+                image_path = self.selection.select(self)
+            if image_path is None:
+                logger.error("No images found in %s", self.image_source)
+                return (None, None)
+
+            image_out_path = self.get_lockscreen_out_path(image_path)
+            self.save_index()
+
+        return (image_path, image_out_path)
+
+    def link_lockscreen(self, image_path: str, image_out_path: str):
+        """
+        Makes a rendered lockscreen the current one
+
+        Arguments:
+            image_path (str): the path to the image
+            image_out_path (str): the path to its lockscreen
+        """
+        with stats.stage("link", image_path):
+            symlink_path = os.path.join(
+                self.out_dir, "current_lockscreen" + self.encoder.link_extension
+            )
             symlink_image(image_out_path, symlink_path)
+            if isinstance(self.encoder, RawEncoder):
+                save_raw_format(
+                    self.encoder.get_raw_format(
+                        get_accumulative_dimensions(self.resolutions)
+                    ),
+                    os.path.join(self.out_dir, "current_lockscreen.raw"),
+                )
 
-            # Run postscripts
-            utils.run_hooks()
-        else:
-            self.generate()
-            self.update()
+            self.cache.touch(image_out_path)
+            self.cache.see_layout(self.screen_md5)
+            self.cache.save()
+            self.selection.record(image_path)
 
+    def get_lockscreen_out_path(self, image_path: str) -> str:
+        """
+        Gets the path the lockscreen for an image is saved to
 
-def get_resolution_image() -> List[Tuple[int]]:
-    """Gets the screen resolution"""
-    display_re = r"([0-9]+)x([0-9]+)\+([0-9]+)\+([0-9]+)"  # Regex to find the monitor resolutions
+        Arguments:
+            image_path (str): the path to the image
+
+        Returns:
+            (str): the path to the lockscreen
+        """
+        return get_out_path_from_md5(
+            image_path,
+            self.screen_md5,
+            os.path.join(self.out_dir, "lockscreen"),
+            self.index,
+            self.encoder.extension,
+            get_pipeline_md5(self.get_effects(), self.encoder.name),
+        )
+
+    def get_prefetched_image_path(self) -> str:
+        """
+        Takes the image picked by the last prefetch, if its lockscreen is
+        ready for the current screens and settings
+
+        Returns:
+            (str): the path to the image, None if there is none ready
+        """
+        next_path = os.path.join(self.out_dir, NEXT_LOCKSCREEN_FILE_NAME)
+        try:
+            with open(next_path, encoding="UTF-8") as next_file:
+                image_path = next_file.read().strip()
+            os.remove(next_path)
+        except IOError:
+            return None
+
+        if not self.is_library_image(image_path):
+            return None
+
+        if not os.path.isfile(self.get_lockscreen_out_path(image_path)):
+            return None
+
+        return image_path
+
+    def spawn_prefetch(self, current_image_path: str):
+        """
+        Prefetches the next lockscreen in a detached background process, so
+        the current update can return straight away
+
+        Arguments:
+            current_image_path (str): the path to the image just shown
+        """
+        utils.run_detached(self.prefetch, current_image_path)
+
+    def prefetch(self, current_image_path: str = None):
+        """
+        Picks the image for the next update and renders its lockscreen ahead
+        of time. A lock file next to the lockscreen stops two prefetchers from
+        rendering the same image.
+
+        Arguments:
+            current_image_path (str): the path to the image just shown
+        """
+        image_path = self.selection.select(self, current_image_path)
+        if image_path is None:
+            return
+
+        out_path = self.get_lockscreen_out_path(image_path)
+
+        if not os.path.isfile(out_path):
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            if not acquire_render_lock(out_path):
+                logger.info("%s is already being prefetched", image_path)
+                return
+
+            try:
+                self.index.add_output(
+                    *render_lockscreen(*self.get_render_args(image_path, out_path))
+                )
+            finally:
+                release_render_lock(out_path)
+
+        self.save_prefetched_image_path(image_path)
+
+    def get_render_args(self, image_path: str, out_path: str) -> Tuple:
+        """
+        Gets the arguments to render the lockscreen of an image with, see
+        render_lockscreen
+
+        Arguments:
+            image_path (str): the path to the image
+            out_path (str): the path to save the lockscreen to
+
+        Returns:
+            (Tuple): the arguments
+        """
+        return (
+            image_path,
+            out_path,
+            self.resolutions,
+            self.blur_strength,
+            self.brightness,
+            self.blur_quality,
+            self.encoder.name,
+            self.get_source_path(image_path),
+            self.get_tile_prefix(image_path),
+        )
+
+    def save_prefetched_image_path(self, image_path: str):
+        """
+        Records the image the next update should use, once its lockscreen is
+        rendered, see get_prefetched_image_path
+
+        Arguments:
+            image_path (str): the path to the prefetched image
+        """
+        self.save_index()
+        self.enforce_image_cache_budgets()
+
+        utils.write_file_atomic(
+            os.path.join(self.out_dir, NEXT_LOCKSCREEN_FILE_NAME), image_path
+        )
+
+
+def get_process_pool(max_workers: int):
+    """
+    Starts a pool of worker processes to render in. The workers are started
+    by a fork server rather than forked from this process, which may be
+    running threads, such as those planning lockscreens, and forking copies
+    any lock those threads hold.
+
+    Arguments:
+        max_workers (int): the number of worker processes
+
+    Returns:
+        (concurrent.futures.ProcessPoolExecutor): the pool
+    """
+    # pylint: disable=import-outside-toplevel
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    start_method = "spawn"
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        start_method = "forkserver"
+
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context(start_method)
+    )
+
+
+def get_job_count(jobs: int) -> int:
+    """
+    Gets the number of worker processes to render with
+
+    Arguments:
+        jobs (int): the requested number of jobs, 0 meaning one per CPU core
+
+    Returns:
+        (int): the number of worker processes
+    """
+    jobs = int(jobs or 0)
+    if jobs <= 0:
+        return os.cpu_count() or 1
+
+    return jobs
+
+
+def render_lockscreen(
+    image_path: str,
+    out_path: str,
+    resolutions: List[Tuple[int]],
+    blur: int,
+    brightness: float,
+    blur_quality: float = 1,
+    encoder: str = "png",
+    source_path: str = None,
+    tile_prefix: str = None,
+) -> Tuple[str]:
+    """
+    Generates the lockscreen for an image and saves it to the out path
+
+    Arguments:
+        image_path (str): the path to the image
+        out_path (str): the path to save the lockscreen to
+        resolutions (List[tuple]): the resolutions of the screens to generate for
+        blur (int): the strength of the blur to be applied
+        brightness (float): how bright the image should be
+        blur_quality (float): the quality of the blur, see blur_image
+        encoder (str): the name of the encoder to save with
+        source_path (str): where the image is cached pre-scaled, see open_source
+        tile_prefix (str): where the screens are cached, see get_tile_path
+
+    Returns:
+        (Tuple[str]): the path to the image and the path it was saved to
+    """
+    with stats.stage("render", image_path):
+        lockscreen_image = generate_lockscreen_image(
+            image_path,
+            resolutions,
+            blur,
+            brightness,
+            blur_quality,
+            source_path,
+            tile_prefix,
+        )
+        save_lockscreen(lockscreen_image, out_path, encoder)
+
+    return (image_path, out_path)
+
+
+def render_lockscreen_variants(
+    image_path: str,
+    variants: List[Dict],
+    encoder: str = "png",
+    source_path: str = None,
+    tile_prefix: str = None,
+) -> Tuple:
+    """
+    Generates every variant of the lockscreen for an image from a single
+    decode and saves each to its out path
+
+    Arguments:
+        image_path (str): the path to the image
+        variants (List[Dict]): the out path, resolutions, blur, brightness and
+            blur quality of each variant
+        encoder (str): the name of the encoder to save with
+        source_path (str): where the image is cached pre-scaled, see open_source
+        tile_prefix (str): where the screens are cached, see get_tile_path
 
-    command_output = subprocess.check_output(["xrandr"])
-    resolution_list = [
-        [int(j) for j in i] for i in re.findall(display_re, str(command_output))
-    ]
+    Returns:
+        (Tuple): the path to the image and the paths the variants were saved to
+    """
+    out_paths = []
+    with stats.stage("render", image_path):
+        for variant, lockscreen_image in zip(
+            variants,
+            generate_lockscreen_variants(
+                image_path, variants, source_path, tile_prefix
+            ),
+        ):
+            save_lockscreen(lockscreen_image, variant["out_path"], encoder)
+            out_paths.append(variant["out_path"])
 
-    return [tuple(i) for i in resolution_list]
+    return (image_path, out_paths)
 
 
-def get_out_path_from_md5(image_path: str, screen_md5: str, out_directory: str) -> str:
+def save_lockscreen(lockscreen_image: Image, out_path: str, encoder: str = "png"):
+    """
+    Saves a lockscreen, writing to a temporary file first so a failed save
+    never leaves a partial lockscreen behind
+
+    Arguments:
+        lockscreen_image (PIL.Image): the lockscreen to save
+        out_path (str): the path to save the lockscreen to
+        encoder (str): the name of the encoder to save with
+    """
+    out_directory, out_name = os.path.split(out_path)
+    temp_path = os.path.join(out_directory, f".{os.getpid()}-{out_name}")
+    try:
+        with stats.stage("encode"):
+            get_encoder(encoder).save(lockscreen_image, temp_path)
+        os.replace(temp_path, out_path)
+    finally:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+
+def get_screen_md5(resolutions: List[Tuple[int]]) -> str:
+    """
+    Gets the md5 identifying a layout of screens
+
+    Arguments:
+        resolutions (List[Tuple[int]]): the resolutions of the screens
+
+    Returns:
+        (str): the md5 of the layout
+    """
+    return utils.md5(",".join(str(i) for j in resolutions for i in j))[:20]
+
+
+def get_pipeline_md5(effects: Dict, encoder: str = "png") -> str:
+    """
+    Gets the md5 identifying everything that changes how a lockscreen is
+    rendered from an image, so changing a setting renders new lockscreens
+    next to the old ones instead of reusing them
+
+    Arguments:
+        effects (Dict): the blur, brightness and blur quality
+        encoder (str): the name of the encoder
+
+    Returns:
+        (str): the md5 of the pipeline
+    """
+    pipeline = {
+        "blur": float(effects.get("blur") or 0),
+        "brightness": float(effects.get("brightness") or 0),
+        "blur_quality": float(effects.get("blur_quality", 1)),
+        "resample": RESAMPLE,
+        "encoder": encoder,
+        "version": RENDERER_VERSION,
+    }
+    return utils.md5(json.dumps(pipeline, sort_keys=True))[:8]
+
+
+def get_resolution_image() -> List[Tuple[int]]:
+    """Gets the screen resolution from xrandr"""
+    return XrandrProvider().get_layout()
+
+
+def get_out_path_from_md5(
+    image_path: str,
+    screen_md5: str,
+    out_directory: str,
+    index: FingerprintIndex = None,
+    extension: str = ".png",
+    pipeline_md5: str = "",
+) -> str:
     """
     Gets the out path path from the image and screen md5
 
     Arguments:
-        image_path (str):       the path to the image
-        screen_md5 (str):       the md5 of the screen
-        out_directory (str):    the directory to append to the start of the path
+        image_path (str):           the path to the image
+        screen_md5 (str):           the md5 of the screen
+        out_directory (str):        the directory to append to the start of the path
+        index (FingerprintIndex):   the index to look the image fingerprint up in
+        extension (str):            the extension of the encoder's files
+        pipeline_md5 (str):         the md5 of the render pipeline, if any
 
     Returns:
         (str): the generated path
     """
-    image_md5 = utils.md5_file(image_path)[:20]
-    return os.path.join(out_directory, f"{image_md5}_{screen_md5}.png")
+    if index is not None:
+        image_md5 = index.get_digest(image_path)[:20]
+    else:
+        image_md5 = utils.md5_file(image_path)[:20]
+    pipeline_suffix = f"_{pipeline_md5}" if pipeline_md5 else ""
+    return os.path.join(
+        out_directory, f"{image_md5}_{screen_md5}{pipeline_suffix}{extension}"
+    )
 
 
+# pylint: disable=too-many-arguments
 def generate_lockscreen_image(
-    image_path: str, resolutions: List[Tuple[int]], blur: int, brightness: float
+    image_path: str,
+    resolutions: List[Tuple[int]],
+    blur: int,
+    brightness: float,
+    blur_quality: float = 1,
+    source_path: str = None,
+    tile_prefix: str = None,
 ) -> Image:
     """
     Generates the image for the lockscreen
@@ -153,36 +1059,355 @@ def generate_lockscreen_image(
         resolutions (List[tuple]): the resolutions of the screens to generate for
         blur (int): the strength of the blur to be applied
         brightness (float): how bright the image should be
+        blur_quality (float): the quality of the blur, see blur_image
+        source_path (str): where the image is cached pre-scaled, see open_source
+        tile_prefix (str): where the screens are cached, see get_tile_path
+
+    Returns:
+        (PIL.Image): the raw generated image
+    """
+    variant = {
+        "resolutions": resolutions,
+        "blur": blur,
+        "brightness": brightness,
+        "blur_quality": blur_quality,
+    }
+    return next(
+        generate_lockscreen_variants(image_path, [variant], source_path, tile_prefix)
+    )
+
+
+def generate_lockscreen_variants(
+    image_path: str,
+    variants: List[Dict],
+    source_path: str = None,
+    tile_prefix: str = None,
+) -> Iterator:
+    """
+    Generates every variant of the lockscreen for an image, decoding the
+    image once at the size needed by the largest screen of any variant and
+    sharing the tiles of screens with the same size and blur. With a tile
+    prefix, finished screens are loaded from and saved to the tile cache, and
+    the image is not decoded at all when every screen is cached.
+
+    Arguments:
+        image_path (str): the path to the image, or an open binary file
+        variants (List[Dict]): the resolutions, blur, brightness and blur
+            quality of each variant
+        source_path (str): where the image is cached pre-scaled, see open_source
+        tile_prefix (str): where the screens are cached, see get_tile_path
+
+    Yields:
+        (PIL.Image): the generated image of each variant in order
+    """
+    # Images rendered from memory are recorded under the enclosing stage
+    stats_path = image_path if isinstance(image_path, str) else None
+    tiles = {}
+    # The paths to save the finished screens missing from the tile cache to
+    missing_tile_paths = {}
+    if tile_prefix is not None:
+        with stats.stage("tiles", stats_path):
+            for variant in variants:
+                for resolution in variant["resolutions"]:
+                    tile_key = get_tile_key(
+                        resolution,
+                        variant["blur"],
+                        variant["brightness"],
+                        variant.get("blur_quality", 1),
+                    )
+                    if tile_key in tiles or tile_key in missing_tile_paths:
+                        continue
+
+                    tile_path = get_tile_path(tile_prefix, tile_key)
+                    tile = image_cache.load_cached_image(tile_path)
+                    if tile is None:
+                        missing_tile_paths[tile_key] = tile_path
+                    else:
+                        tiles[tile_key] = tile
+
+    image = None
+    if tile_prefix is None or missing_tile_paths:
+        with stats.stage("decode", stats_path):
+            image = open_source(
+                image_path,
+                [resolution for i in variants for resolution in i["resolutions"]],
+                source_path,
+            )
+
+    for variant in variants:
+        lockscreen_image = compose_lockscreen_image(
+            image,
+            variant["resolutions"],
+            variant["blur"],
+            variant["brightness"],
+            variant.get("blur_quality", 1),
+            tiles,
+        )
+
+        for tile_key in [i for i in missing_tile_paths if i in tiles]:
+            image_cache.save_cached_image(
+                tiles[tile_key], missing_tile_paths.pop(tile_key)
+            )
+
+        yield lockscreen_image
+
+
+# pylint: disable=too-many-arguments
+def compose_lockscreen_image(
+    image: Image,
+    resolutions: List[Tuple[int]],
+    blur: int,
+    brightness: float,
+    blur_quality: float = 1,
+    tiles: Dict = None,
+) -> Image:
+    """
+    Composes the lockscreen from an opened image
+
+    Arguments:
+        image (PIL.Image): the opened image, see open_image
+        resolutions (List[tuple]): the resolutions of the screens to generate for
+        blur (int): the strength of the blur to be applied
+        brightness (float): how bright the image should be
+        blur_quality (float): the quality of the blur, see blur_image
+        tiles (Dict): the tiles already made from this image, shared between
+            calls to reuse them
 
     Returns:
         (PIL.Image): the raw generated image
     """
-    screens = []
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    if tiles is None:
+        tiles = {}
+
+    # A single screen at the origin covers the whole lockscreen, so its tile
+    # is the lockscreen and no canvas is needed
+    if len(resolutions) == 1 and get_resolution_offset(resolutions[0]) == (0, 0):
+        return get_tile(image, resolutions[0], blur, brightness, blur_quality, tiles)
 
-    image = Image.open(image_path).convert("RGB")
     output_image_width, output_image_height = get_accumulative_dimensions(resolutions)
 
-    # Repeat for every screen the user has
+    output_image = Image.new(
+        "RGB", (output_image_width, output_image_height), (0, 0, 0)
+    )
+
+    # Repeat for every screen the user has, rendering each distinct screen
+    # size once and pasting it at every offset with that size
     for resolution in resolutions:
+        tile = get_tile(image, resolution, blur, brightness, blur_quality, tiles)
+        with stats.stage("paste"):
+            output_image.paste(tile, get_resolution_offset(resolution))
+
+    return output_image
+
+
+# pylint: disable=too-many-arguments
+def get_tile(
+    image: Image,
+    resolution: Tuple[int],
+    blur: int,
+    brightness: float,
+    blur_quality: float,
+    tiles: Dict,
+) -> Image:
+    """
+    Gets the finished image of a single screen, cropped, blurred and with its
+    brightness adjusted. The blurred tile is kept apart from the adjusted one
+    so variants differing only in brightness share the blur.
+
+    Arguments:
+        image (PIL.Image): the opened image, see open_image
+        resolution (Tuple[int]): the resolution of the screen
+        blur (int): the strength of the blur to be applied
+        brightness (float): how bright the image should be
+        blur_quality (float): the quality of the blur, see blur_image
+        tiles (Dict): the tiles already made from this image
+
+    Returns:
+        (PIL.Image): the tile
+    """
+    adjusted_key = get_tile_key(resolution, blur, brightness, blur_quality)
+    if adjusted_key in tiles:
+        return tiles[adjusted_key]
+
+    tile_key = get_tile_key(resolution, blur, 1, blur_quality)
+    if tile_key not in tiles:
         dimensions = get_resolution_dimensions(resolution)
-        resolution_image = crop_image_to_dimensions(image, dimensions)
+        with stats.stage("resize"):
+            resolution_image = crop_image_to_dimensions(image, dimensions)
         if blur:
-            resolution_image = blur_image(resolution_image, blur)
-        screens.append([resolution_image, get_resolution_offset(resolution)])
+            with stats.stage("blur"):
+                resolution_image = blur_image(resolution_image, blur, blur_quality)
+        tiles[tile_key] = resolution_image
 
-    output_image = Image.new(
-        "RGB", (output_image_width, output_image_height), (0, 0, 0)
+    if adjusted_key == tile_key:
+        return tiles[tile_key]
+
+    with stats.stage("brightness"):
+        tiles[adjusted_key] = tiles[tile_key].point(
+            get_brightness_lut(brightness) * len(tiles[tile_key].getbands())
+        )
+
+    return tiles[adjusted_key]
+
+
+def get_tile_key(
+    resolution: Tuple[int], blur: int, brightness: float, blur_quality: float
+) -> Tuple:
+    """
+    Gets the key a finished screen is kept under, see get_tile
+
+    Arguments:
+        resolution (Tuple[int]): the resolution of the screen
+        blur (int): the strength of the blur to be applied
+        brightness (float): how bright the image should be
+        blur_quality (float): the quality of the blur, see blur_image
+
+    Returns:
+        (Tuple): the dimensions, blur and blur quality of the screen, and its
+            brightness if that changes the screen
+    """
+    tile_key = (get_resolution_dimensions(resolution), blur, blur_quality)
+    # A brightness of 0 has always meant unchanged, and 1 is unchanged
+    if not brightness or brightness == 1:
+        return tile_key
+
+    return tile_key + (brightness,)
+
+
+def get_tile_path(tile_prefix: str, tile_key: Tuple) -> str:
+    """
+    Gets the path a finished screen is cached at, named by the image, the
+    size of the screen and a digest of the effects applied to it
+
+    Arguments:
+        tile_prefix (str): the tile cache directory joined with the
+            fingerprint of the image
+        tile_key (Tuple): the key of the screen, see get_tile_key
+
+    Returns:
+        (str): the path to the cached screen
+    """
+    (width, height), blur, blur_quality, *brightness = tile_key
+    effects_md5 = get_pipeline_md5(
+        {
+            "blur": blur,
+            "brightness": brightness[0] if brightness else 1,
+            "blur_quality": blur_quality,
+        },
+        "tile",
     )
+    extension = image_cache.IMAGE_CACHE_EXTENSION
+    return f"{tile_prefix}_{width}x{height}_{effects_md5}{extension}"
 
-    # Add the images in their locations onto the new image
-    for screen in screens:
-        output_image.paste(*screen)
 
-    if brightness:
-        enhancer = ImageEnhance.Brightness(output_image)
-        output_image = enhancer.enhance(brightness)
+@functools.lru_cache(maxsize=16)
+def get_brightness_lut(brightness: float) -> List[int]:
+    """
+    Gets the lookup table that adjusts the brightness of a band the same way
+    as ImageEnhance.Brightness, found by running it over every band value
 
-    return output_image
+    Arguments:
+        brightness (float): how bright the image should be
+
+    Returns:
+        (List[int]): the adjusted value of each band value
+    """
+    from PIL import Image, ImageEnhance  # pylint: disable=import-outside-toplevel
+
+    band_values = Image.frombytes("L", (256, 1), bytes(range(256)))
+    return list(ImageEnhance.Brightness(band_values).enhance(brightness).tobytes())
+
+
+def open_image(image_path: str, resolutions: List[Tuple[int]]) -> Image:
+    """
+    Opens the image at the smallest size that still gives a full quality
+    resample for every screen. JPEGs are decoded with DCT scaling and the
+    result is shrunk with Image.reduce() until it is at most REDUCING_GAP
+    times larger than the largest size the screens need.
+
+    Arguments:
+        image_path (str): the path to the image, or an open binary file
+        resolutions (List[tuple]): the resolutions of the screens to open for
+
+    Returns:
+        (PIL.Image): the opened image
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    image = Image.open(image_path)
+    width, height = get_required_dimensions(image.size, resolutions)
+    reduced_size = (int(width * REDUCING_GAP), int(height * REDUCING_GAP))
+
+    image.draft("RGB", reduced_size)
+    image = image.convert("RGB")
+
+    factor = int(min(image.width / reduced_size[0], image.height / reduced_size[1]))
+    if factor > 1:
+        image = image.reduce(factor)
+
+    return image
+
+
+def open_source(
+    image_path: str, resolutions: List[Tuple[int]], source_path: str = None
+) -> Image:
+    """
+    Opens an image from its pre-scaled copy in the source cache, if there is
+    one large enough for every screen. Otherwise the image is opened, scaled
+    down to just cover the screens and the copy cached for the next render.
+
+    Arguments:
+        image_path (str): the path to the image, or an open binary file
+        resolutions (List[tuple]): the resolutions of the screens to open for
+        source_path (str): where the copy is cached, None to open the image
+            without caching it
+
+    Returns:
+        (PIL.Image): the opened image
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    if source_path is None:
+        return open_image(image_path, resolutions)
+
+    image = image_cache.load_cached_image(source_path)
+    if image is not None:
+        width, height = get_required_dimensions(image.size, resolutions)
+        if width <= image.width and height <= image.height:
+            return image
+
+    image = open_image(image_path, resolutions)
+    width, height = get_required_dimensions(image.size, resolutions)
+    if width < image.width and height < image.height:
+        image = image.resize((width, height), getattr(Image, RESAMPLE))
+    image_cache.save_cached_image(image, source_path)
+
+    return image
+
+
+def get_required_dimensions(
+    image_size: Tuple[int], resolutions: List[Tuple[int]]
+) -> Tuple[int]:
+    """
+    Gets the smallest size an image can be scaled to while still covering
+    every screen
+
+    Arguments:
+        image_size (Tuple[int]): the width and height of the image
+        resolutions (List[Tuple[int]]): the resolutions of the screens
+
+    Returns:
+        (Tuple[int]): the width and height the image is needed at
+    """
+    image_width, image_height = image_size
+    scale = max(
+        max(width / image_width, height / image_height)
+        for width, height in map(get_resolution_dimensions, resolutions)
+    )
+
+    return (math.ceil(image_width * scale), math.ceil(image_height * scale))
 
 
 def get_resolution_dimensions(resolution: Tuple[int]) -> Tuple[int]:
@@ -250,12 +1475,14 @@ def crop_image_to_dimensions(image: Image, dimensions: Tuple[int]) -> Image:
     Returns:
         (PIL.Image): the cropped image
     """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
     image_width, image_height = image.size
     width, height = dimensions
 
     ratio = min(image_width / width, image_height / height)
     ratio_dimensions = (int(image_width / ratio), int(image_height / ratio))
-    resized_image = image.resize(ratio_dimensions, Image.LANCZOS)
+    resized_image = image.resize(ratio_dimensions, getattr(Image, RESAMPLE))
 
     crop_box = (
         (ratio_dimensions[0] - width) / 2,
@@ -269,64 +1496,224 @@ def crop_image_to_dimensions(image: Image, dimensions: Tuple[int]) -> Image:
     return cropped_image
 
 
-def blur_image(image: Image, blur: int) -> Image:
+def blur_image(image: Image, blur: int, quality: float = 1) -> Image:
     """
     Blur the image by the strength given
 
     Arguments:
         image (PIL.Image): the image to be blurred
         blur (int): the strength to blur the image
+        quality (float): 1 for an exact Gaussian blur, lower values trade
+            accuracy for speed by blurring a shrunken copy of the image
 
     Returns:
         (PIL.Image): the blurred image
     """
+    from PIL import ImageFilter  # pylint: disable=import-outside-toplevel
+
     if int(blur) != 0:
-        image = image.filter(ImageFilter.GaussianBlur(int(blur)))
+        scale = get_blur_scale(int(blur), quality)
+        if scale > 1:
+            image = fast_blur_image(image, int(blur), scale)
+        else:
+            image = image.filter(ImageFilter.GaussianBlur(int(blur)))
 
     return image
 
 
-def get_image_path_list(image_directory: str) -> List[str]:
+def get_blur_scale(blur: int, quality: float) -> int:
     """
-    Gets the absolute image paths within a directory
+    Gets how many times the image can be shrunk before being blurred. The
+    blur is done at a radius of blur * quality, but never below
+    FAST_BLUR_MIN_RADIUS.
 
     Arguments:
-        image_directory (str): the path to the image or the directory
+        blur (int): the strength of the blur
+        quality (float): the quality of the blur, from 0 to 1
 
     Returns:
-        (List[str]): the list of absolute paths to images
+        (int): the factor to shrink the image by, 1 for an exact blur
     """
-    if os.path.isfile(image_directory):
-        return [utils.get_absolute_image_path(image_directory)]
+    if quality >= 1:
+        return 1
 
-    return [
-        utils.get_absolute_image_path(os.path.join(image_directory, img))
-        for img in utils.get_directory_image_paths(image_directory)
-    ]
+    working_radius = max(FAST_BLUR_MIN_RADIUS, blur * quality)
+    return max(1, int(blur / working_radius))
 
 
-def get_random_image_path(image_paths: List[str]) -> str:
-    """Gets a random path to a image from a given list
+def fast_blur_image(image: Image, blur: int, scale: int) -> Image:
+    """
+    Approximates a Gaussian blur by blurring a shrunken copy of the image and
+    scaling it back up. With a working radius of at least
+    FAST_BLUR_MIN_RADIUS the result measures within a mean of 1 and a
+    maximum of 8 levels of the exact blur, see measure_blur_error.
 
     Arguments:
-        image_paths (List[str]): a list containing paths to images
+        image (PIL.Image): the image to be blurred
+        blur (int): the strength to blur the image
+        scale (int): how many times to shrink the image by
 
     Returns:
-        (str): a randomly picked image path
+        (PIL.Image): the blurred image
     """
-    random.shuffle(image_paths)
-    return image_paths[0]
+    from PIL import Image, ImageFilter  # pylint: disable=import-outside-toplevel
+
+    width, height = image.size
+    small_image = image.resize(
+        (math.ceil(width / scale), math.ceil(height / scale)), Image.BOX
+    )
+    small_image = small_image.filter(ImageFilter.GaussianBlur(blur / scale))
+
+    return small_image.resize((width, height), Image.BILINEAR)
+
+
+def measure_blur_error(image: Image, blur: int, quality: float) -> Tuple[float]:
+    """
+    Measures how far the blur at the given quality is from the exact Gaussian
+
+    Arguments:
+        image (PIL.Image): the image to blur
+        blur (int): the strength of the blur
+        quality (float): the quality of the blur to measure
+
+    Returns:
+        (Tuple[float]): the mean and the maximum absolute difference per pixel
+    """
+    from PIL import ImageChops, ImageStat  # pylint: disable=import-outside-toplevel
+
+    difference = ImageChops.difference(
+        blur_image(image, blur), blur_image(image, blur, quality)
+    )
+    mean_error = max(ImageStat.Stat(difference).mean)
+    max_error = max(band_max for _, band_max in difference.getextrema())
+
+    return (mean_error, float(max_error))
+
+
+def get_image_path_list(
+    image_directory: str,
+    include: List[str] = (),
+    exclude: List[str] = (),
+    stream: bool = False,
+) -> List[str]:
+    """
+    Gets the absolute image paths within a directory and its subdirectories
+
+    Arguments:
+        image_directory (str): the path to the image or the directory
+        include (List[str]): globs an image must match one of, if any
+        exclude (List[str]): globs of images and directories to skip
+        stream (bool): yield the paths as they are found instead
+
+    Returns:
+        (List[str]): the list of absolute paths to images
+    """
+    if os.path.isfile(image_directory):
+        image_paths = [utils.get_absolute_image_path(image_directory)]
+    else:
+        image_paths = utils.scan_image_paths(image_directory, include, exclude)
+
+    return image_paths if stream else list(image_paths)
 
 
 def symlink_image(image_path: str, symlink_path: str):
     """
-    Symlink an image to a given path
+    Symlink an image to a given path, swapping out any existing link in one
+    step so the path always points at a complete image
 
     Arguments:
         image_path (str):   the path to the original image
         symlink_path(str):  the path to symlink to
     """
-    if os.path.isfile(symlink_path):
-        os.remove(symlink_path)
+    temp_path = f"{symlink_path}.{os.getpid()}.tmp"
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
 
-    os.symlink(image_path, symlink_path)
+    os.symlink(os.path.abspath(image_path), temp_path)
+    os.replace(temp_path, symlink_path)
+
+
+def acquire_render_lock(out_path: str) -> bool:
+    """
+    Tries to take the lock for rendering a lockscreen. Locks held by a
+    process that no longer exists, or older than RENDER_LOCK_TIMEOUT, are
+    broken.
+
+    Arguments:
+        out_path (str): the path of the lockscreen to be rendered
+
+    Returns:
+        (bool): if the lock was taken
+    """
+    lock_path = out_path + ".lock"
+    for _ in range(2):
+        try:
+            lock_file = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not is_render_lock_stale(lock_path):
+                return False
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+            continue
+
+        with os.fdopen(lock_file, "w", encoding="UTF-8") as lock:
+            lock.write(str(os.getpid()))
+        return True
+
+    return False
+
+
+def is_render_lock_stale(lock_path: str) -> bool:
+    """
+    Checks if a render lock was left behind by a crashed process
+
+    Arguments:
+        lock_path (str): the path to the lock
+
+    Returns:
+        (bool): if the lock is stale
+    """
+    try:
+        if time.time() - os.path.getmtime(lock_path) > RENDER_LOCK_TIMEOUT:
+            return True
+        with open(lock_path, encoding="UTF-8") as lock:
+            pid = int(lock.read())
+    except (IOError, ValueError):
+        # A lock that is still being written is not stale
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+
+    return False
+
+
+def release_render_lock(out_path: str):
+    """
+    Releases the lock for rendering a lockscreen
+
+    Arguments:
+        out_path (str): the path of the rendered lockscreen
+    """
+    try:
+        os.remove(out_path + ".lock")
+    except FileNotFoundError:
+        pass
+
+
+def save_raw_format(raw_format: str, raw_format_path: str):
+    """
+    Saves the i3lock --raw format of the current lockscreen, so lock scripts
+    can run `i3lock --raw "$(cat current_lockscreen.raw)" -i current_lockscreen.bgrx`
+
+    Arguments:
+        raw_format (str): the raw format, e.g. '3840x1080:bgrx'
+        raw_format_path (str): the path to save the format to
+    """
+    utils.write_file_atomic(raw_format_path, raw_format)
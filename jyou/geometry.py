@@ -0,0 +1,379 @@
+"""Providers for the geometry of the connected monitors"""
+import json
+import os
+import re
+import subprocess
+import time
+from typing import List, Tuple
+
+from . import utils
+from .settings import CACHE_PATH
+
+LAYOUT_RE = r"([0-9]+)x([0-9]+)\+([0-9]+)\+([0-9]+)"
+MODE_RE = r"^([0-9]+)x([0-9]+)"
+DRM_PATH = "/sys/class/drm"
+GEOMETRY_CACHE_PATH = os.path.join(CACHE_PATH, "geometry.json")
+# Seconds the cached layout is trusted for, as moving a monitor without
+# replugging it leaves the DRM connectors unchanged
+GEOMETRY_CACHE_TTL = 300
+GEOMETRY_SOURCES = ("auto", "xrandr", "drm", "file")
+
+
+class GeometryError(Exception):
+    """Raised when the monitor geometry can not be found"""
+
+
+class GeometryProvider:
+    """Base class for anything that can find the layout of the monitors"""
+
+    def get_layout(self) -> List[Tuple[int]]:
+        """
+        Gets the layout of the monitors
+
+        Returns:
+            (List[Tuple[int]]): the [width, height, offset_x, offset_y] of
+                each monitor
+        """
+        raise NotImplementedError
+
+
+class XrandrProvider(GeometryProvider):
+    """Gets the layout from the output of xrandr"""
+
+    def get_layout(self) -> List[Tuple[int]]:
+        try:
+            command_output = subprocess.check_output(
+                ["xrandr"], stderr=subprocess.DEVNULL
+            )
+        except (OSError, subprocess.CalledProcessError) as error:
+            raise GeometryError(f"Could not run xrandr: {error}") from error
+
+        return parse_layout(command_output.decode("UTF-8", "replace"))
+
+
+class DrmProvider(GeometryProvider):
+    """
+    Gets the layout from the DRM connectors in sysfs. Sysfs does not know
+    where the screens are placed, so connected screens are put side by side
+    in connector order using their preferred mode.
+    """
+
+    def __init__(self, drm_path: str = DRM_PATH):
+        """
+        The initialisation method
+
+        Arguments:
+            drm_path (str): the location of the DRM class in sysfs
+        """
+        self.drm_path = drm_path
+
+    def get_layout(self) -> List[Tuple[int]]:
+        layout = []
+        offset_x = 0
+        for connector in get_drm_connectors(self.drm_path):
+            if connector["status"] != "connected" or not connector["modes"]:
+                continue
+
+            mode = re.match(MODE_RE, connector["modes"][0])
+            if not mode:
+                continue
+
+            width, height = (int(i) for i in mode.groups())
+            layout.append((width, height, offset_x, 0))
+            offset_x += width
+
+        if not layout:
+            raise GeometryError("No connected DRM connectors were found")
+
+        return layout
+
+
+class LayoutProvider(GeometryProvider):
+    """Gets the layout from a string such as '1920x1080+0+0,1920x1080+1920+0'"""
+
+    def __init__(self, layout: str):
+        """
+        The initialisation method
+
+        Arguments:
+            layout (str): the layout of the monitors
+        """
+        self.layout = layout
+
+    def get_layout(self) -> List[Tuple[int]]:
+        return parse_layout(self.layout)
+
+
+class FileProvider(GeometryProvider):
+    """
+    Gets the layout from a file containing either a layout string or saved
+    xrandr output. Useful as a stand-in for xrandr when there is no X server.
+    """
+
+    def __init__(self, layout_path: str):
+        """
+        The initialisation method
+
+        Arguments:
+            layout_path (str): the location of the layout file
+        """
+        self.layout_path = layout_path
+
+    def get_layout(self) -> List[Tuple[int]]:
+        try:
+            with open(self.layout_path, encoding="UTF-8") as layout_file:
+                return parse_layout(layout_file.read())
+        except IOError as error:
+            raise GeometryError(f"Could not read layout file: {error}") from error
+
+
+class FallbackProvider(GeometryProvider):
+    """Tries each provider in order until one finds a layout"""
+
+    def __init__(self, providers: List[GeometryProvider]):
+        """
+        The initialisation method
+
+        Arguments:
+            providers (List[GeometryProvider]): the providers to try in order
+        """
+        self.providers = providers
+
+    def get_layout(self) -> List[Tuple[int]]:
+        errors = []
+        for provider in self.providers:
+            try:
+                return provider.get_layout()
+            except GeometryError as error:
+                errors.append(str(error))
+
+        raise GeometryError("; ".join(errors) or "No geometry providers")
+
+
+class CachedProvider(GeometryProvider):
+    """
+    Serves the last known layout while the DRM connectors are unchanged,
+    only asking the wrapped provider when a monitor is (un)plugged, enabled,
+    disabled or its modes change, or the cached layout has expired
+    """
+
+    def __init__(
+        self,
+        provider: GeometryProvider,
+        cache_path: str = GEOMETRY_CACHE_PATH,
+        drm_path: str = DRM_PATH,
+        refresh: bool = False,
+        ttl: float = GEOMETRY_CACHE_TTL,
+    ):
+        """
+        The initialisation method
+
+        Arguments:
+            provider (GeometryProvider): the provider to refresh the cache from
+            cache_path (str): the location of the cache file
+            drm_path (str): the location of the DRM class in sysfs
+            refresh (bool): always ask the provider, updating the cache
+            ttl (float): the seconds the cached layout is used for
+        """
+        self.provider = provider
+        self.cache_path = cache_path
+        self.drm_path = drm_path
+        self.refresh = refresh
+        self.ttl = ttl
+
+    def get_layout(self) -> List[Tuple[int]]:
+        signature = get_drm_signature(self.drm_path)
+        layout = self.get_cached_layout(signature)
+        if layout is None:
+            layout = self.provider.get_layout()
+            self.cache_layout(signature, layout)
+
+        return layout
+
+    def get_cached_layout(self, signature: str) -> List[Tuple[int]]:
+        """
+        Gets the cached layout, if it was cached for the same connectors no
+        longer than the TTL ago
+
+        Arguments:
+            signature (str): the signature of the connectors, see
+                get_drm_signature
+
+        Returns:
+            (List[Tuple[int]]): the cached layout, None if there is none
+        """
+        if not signature or self.refresh:
+            return None
+
+        cache = load_geometry_cache(self.cache_path)
+        if cache.get("signature") != signature:
+            return None
+
+        try:
+            age = time.time() - float(cache.get("time", 0))
+        except (TypeError, ValueError):
+            return None
+        # A cache from the future means the clock changed, so is not trusted
+        if not 0 <= age < self.ttl:
+            return None
+
+        return [tuple(i) for i in cache["layout"]]
+
+    def cache_layout(self, signature: str, layout: List[Tuple[int]]):
+        """
+        Caches the layout for the connectors, if they are known
+
+        Arguments:
+            signature (str): the signature of the connectors
+            layout (List[Tuple[int]]): the layout of the monitors
+        """
+        if signature:
+            save_geometry_cache(
+                self.cache_path,
+                {"signature": signature, "layout": layout, "time": time.time()},
+            )
+
+
+def get_geometry_provider(
+    source: str = "auto", layout: str = None, layout_file: str = None
+) -> GeometryProvider:
+    """
+    Gets the geometry provider for the given source
+
+    Arguments:
+        source (str): one of GEOMETRY_SOURCES
+        layout (str): an explicit layout, used instead of any source
+        layout_file (str): the location of the layout file for the file source
+
+    Returns:
+        (GeometryProvider): the geometry provider
+    """
+    if layout:
+        return LayoutProvider(layout)
+
+    if source == "xrandr":
+        return CachedProvider(XrandrProvider(), refresh=True)
+
+    if source == "drm":
+        return DrmProvider()
+
+    if source == "file":
+        if not layout_file:
+            raise GeometryError("The file geometry source needs a layout file")
+        return FileProvider(layout_file)
+
+    if source != "auto":
+        raise GeometryError(f"Unknown geometry source: {source}")
+
+    return CachedProvider(FallbackProvider([XrandrProvider(), DrmProvider()]))
+
+
+def parse_layout(layout: str) -> List[Tuple[int]]:
+    """
+    Parses every WIDTHxHEIGHT+X+Y found within a string
+
+    Arguments:
+        layout (str): the string containing the layout
+
+    Returns:
+        (List[Tuple[int]]): the [width, height, offset_x, offset_y] of each monitor
+    """
+    resolutions = [tuple(int(j) for j in i) for i in re.findall(LAYOUT_RE, layout)]
+    if not resolutions:
+        raise GeometryError(f"No monitors found in layout: {layout!r}")
+
+    return resolutions
+
+
+def get_drm_connectors(drm_path: str = DRM_PATH) -> List[dict]:
+    """
+    Gets the status, enabled state and modes of every DRM connector
+
+    Arguments:
+        drm_path (str): the location of the DRM class in sysfs
+
+    Returns:
+        (List[dict]): the name, status, enabled state and modes of each
+            connector
+    """
+    try:
+        names = sorted(os.listdir(drm_path))
+    except OSError:
+        return []
+
+    connectors = []
+    for name in names:
+        connector_path = os.path.join(drm_path, name)
+        status_path = os.path.join(connector_path, "status")
+        if not os.path.isfile(status_path):
+            continue
+
+        try:
+            with open(status_path, encoding="UTF-8") as status_file:
+                status = status_file.read().strip()
+            with open(
+                os.path.join(connector_path, "modes"), encoding="UTF-8"
+            ) as modes_file:
+                modes = modes_file.read().split()
+            with open(
+                os.path.join(connector_path, "enabled"), encoding="UTF-8"
+            ) as enabled_file:
+                enabled = enabled_file.read().strip()
+        except IOError:
+            continue
+
+        connectors.append(
+            {"name": name, "status": status, "enabled": enabled, "modes": modes}
+        )
+
+    return connectors
+
+
+def get_drm_signature(drm_path: str = DRM_PATH) -> str:
+    """
+    Gets a cheap signature of the connected monitors used to tell when the
+    cached layout is out of date
+
+    Arguments:
+        drm_path (str): the location of the DRM class in sysfs
+
+    Returns:
+        (str): the signature, empty when there are no DRM connectors
+    """
+    return ";".join(
+        f"{i['name']}={i['status']},{i['enabled']}:{','.join(i['modes'])}"
+        for i in get_drm_connectors(drm_path)
+    )
+
+
+def load_geometry_cache(cache_path: str) -> dict:
+    """
+    Loads the cached layout
+
+    Arguments:
+        cache_path (str): the location of the cache file
+
+    Returns:
+        (dict): the cached signature and layout, empty if there is none
+    """
+    try:
+        with open(cache_path, encoding="UTF-8") as cache_file:
+            cache = json.load(cache_file)
+    except (IOError, ValueError):
+        return {}
+
+    if not isinstance(cache, dict) or not cache.get("layout"):
+        return {}
+
+    return cache
+
+
+def save_geometry_cache(cache_path: str, cache: dict):
+    """
+    Saves the layout to the cache
+
+    Arguments:
+        cache_path (str): the location of the cache file
+        cache (dict): the signature and layout to cache
+    """
+    utils.write_json_atomic(cache_path, cache)
@@ -0,0 +1,189 @@
+"""Running the hooks after the lockscreen is switched"""
+import logging
+import os
+import re
+import signal
+import subprocess
+import time
+from typing import Dict, List
+
+from . import log, utils
+from .settings import CONFIG_PATH
+
+HOOKS_PATH = os.path.join(CONFIG_PATH, "hooks")
+HOOK_NAME_RE = r"^([0-9]{2})-\w+"
+DEFAULT_TIMEOUT = 30
+# How often running hooks are checked on
+POLL_INTERVAL = 0.01
+# How long a hook has to exit after being asked to before it is killed
+KILL_GRACE_PERIOD = 1
+
+logger = log.setup_logger(__name__, logging.WARN, log.DefaultLoggingHandler())
+
+
+def get_hook_stages(hooks_dir: str = HOOKS_PATH) -> List[List[str]]:
+    """
+    Gets the executable hooks grouped into stages by their number, in the
+    order the stages run
+
+    Arguments:
+        hooks_dir (str): the directory the hooks are in
+
+    Returns:
+        (List[List[str]]): the names of the hooks in each stage
+    """
+    stages = {}
+    for name in sorted(os.listdir(hooks_dir)):
+        match = re.match(HOOK_NAME_RE, name)
+        if match and os.access(os.path.join(hooks_dir, name), os.X_OK):
+            stages.setdefault(match.group(1), []).append(name)
+
+    return [stages[number] for number in sorted(stages)]
+
+
+def run_hooks(
+    hooks_dir: str = HOOKS_PATH,
+    timeout: float = DEFAULT_TIMEOUT,
+    timeouts: Dict[str, float] = None,
+) -> List[Dict]:
+    """
+    Runs the hooks stage by stage, the hooks of a stage running at the same
+    time. A hook failing or timing out is logged and does not stop the rest.
+
+    Arguments:
+        hooks_dir (str): the directory the hooks are in
+        timeout (float): the seconds a hook may run for, 0 for no limit
+        timeouts (Dict[str, float]): the timeout of hooks by name, overriding
+            the default timeout
+
+    Returns:
+        (List[Dict]): the name, exit code, run time and whether each hook
+            timed out
+    """
+    os.makedirs(hooks_dir, exist_ok=True)
+
+    results = []
+    for stage in get_hook_stages(hooks_dir):
+        results.extend(run_stage(hooks_dir, stage, timeout, timeouts or {}))
+
+    return results
+
+
+def run_stage(
+    hooks_dir: str, names: List[str], timeout: float, timeouts: Dict[str, float]
+) -> List[Dict]:
+    """
+    Runs the hooks of a stage at the same time, waiting for all of them
+
+    Arguments:
+        hooks_dir (str): the directory the hooks are in
+        names (List[str]): the names of the hooks in the stage
+        timeout (float): the seconds a hook may run for, 0 for no limit
+        timeouts (Dict[str, float]): the timeout of hooks by name
+
+    Returns:
+        (List[Dict]): the result of each hook, see run_hooks
+    """
+    results = []
+    pending = {}
+    start = time.monotonic()
+
+    with open(os.devnull, "w", encoding="UTF-8") as devnull:
+        for name in names:
+            try:
+                process = subprocess.Popen(
+                    [os.path.join(hooks_dir, name)],
+                    stdout=devnull,
+                    stderr=subprocess.STDOUT,
+                    start_new_session=True,
+                )
+            except OSError as error:
+                logger.warning("Could not run hook %s: %s", name, error)
+                results.append(get_hook_result(name, None, 0))
+                continue
+
+            hook_timeout = float(timeouts.get(name, timeout) or 0)
+            deadline = start + hook_timeout if hook_timeout > 0 else None
+            pending[name] = (process, deadline)
+
+    while pending:
+        now = time.monotonic()
+        for name, (process, deadline) in list(pending.items()):
+            timed_out = False
+            if process.poll() is None:
+                if deadline is None or now < deadline:
+                    continue
+                timed_out = True
+                stop_hook(process)
+
+            del pending[name]
+            results.append(
+                get_hook_result(name, process.returncode, now - start, timed_out)
+            )
+
+        if pending:
+            time.sleep(POLL_INTERVAL)
+
+    return results
+
+
+def get_hook_result(
+    name: str, returncode: int, seconds: float, timed_out: bool = False
+) -> Dict:
+    """
+    Logs how a hook finished
+
+    Arguments:
+        name (str): the name of the hook
+        returncode (int): the exit code of the hook, None if it did not run
+        seconds (float): how long the hook ran for
+        timed_out (bool): whether the hook was stopped for taking too long
+
+    Returns:
+        (Dict): the result of the hook, see run_hooks
+    """
+    if timed_out:
+        logger.warning("Hook %s timed out after %.2fs", name, seconds)
+    elif returncode:
+        logger.warning("Hook %s exited with %d in %.2fs", name, returncode, seconds)
+    elif returncode is not None:
+        logger.info("Hook %s exited with 0 in %.2fs", name, seconds)
+
+    return {
+        "name": name,
+        "returncode": returncode,
+        "seconds": seconds,
+        "timed_out": timed_out,
+    }
+
+
+def stop_hook(process: subprocess.Popen):
+    """
+    Stops a hook and anything it started, killing them if they do not exit
+    when asked
+
+    Arguments:
+        process (subprocess.Popen): the hook process
+    """
+    for signal_number in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, signal_number)
+        except ProcessLookupError:
+            pass
+
+        try:
+            process.wait(KILL_GRACE_PERIOD)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def spawn_hooks(**kwargs):
+    """
+    Runs the hooks in a detached background process, so the caller does not
+    wait on them
+
+    Arguments:
+        **kwargs: the arguments to run_hooks
+    """
+    utils.run_detached(run_hooks, **kwargs)
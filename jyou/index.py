@@ -0,0 +1,198 @@
+"""Persistent index of source image fingerprints and their rendered lockscreens"""
+import json
+import os
+from typing import Dict, List
+
+from . import utils
+
+INDEX_FILE_NAME = "index.json"
+# How many characters of an image fingerprint name its lockscreens
+OUT_NAME_DIGEST_LENGTH = 20
+
+
+class FingerprintIndex:
+    """
+    An on-disk index keyed by the path of a source image. Each entry stores
+    the (size, mtime, inode) of the file when it was last hashed, its
+    fingerprint and the lockscreens rendered from it, so unchanged files
+    never need to be read again.
+    """
+
+    def __init__(self, index_path: str, fingerprint: str = "md5"):
+        """
+        The initialisation method
+
+        Arguments:
+            index_path (str): the location of the index file
+            fingerprint (str): how images are fingerprinted, see
+                utils.FINGERPRINTS
+        """
+        if fingerprint not in utils.FINGERPRINTS:
+            raise ValueError(f"Unknown fingerprint: {fingerprint}")
+
+        self.index_path = index_path
+        self.fingerprint = fingerprint
+        self.entries = load_index(index_path)
+        self.changed = False
+        # Lockscreens renamed by fingerprint migrations, by their old path
+        self.renamed = {}
+
+    def get_digest(self, image_path: str) -> str:
+        """
+        Gets the fingerprint of an image, only hashing it if it changed since
+        it was last indexed. Lockscreens rendered from an unchanged image
+        under another fingerprint are renamed to the new one.
+
+        Arguments:
+            image_path (str): the path to the image
+
+        Returns:
+            (str): the fingerprint of the given image
+        """
+        stat_key = get_stat_key(os.stat(image_path))
+        entry = self.entries.get(image_path)
+        unchanged = entry is not None and entry["stat"] == stat_key
+        if unchanged and entry["fingerprint"] == self.fingerprint:
+            return entry["digest"]
+
+        digest = utils.fingerprint_file(image_path, self.fingerprint)
+        outputs = []
+        if unchanged:
+            outputs = self.migrate_outputs(entry["outputs"], entry["digest"], digest)
+        elif entry and entry["digest"] == digest:
+            outputs = entry["outputs"]
+
+        self.entries[image_path] = {
+            "stat": stat_key,
+            "fingerprint": self.fingerprint,
+            "digest": digest,
+            "outputs": outputs,
+        }
+        self.changed = True
+        return digest
+
+    def migrate_outputs(
+        self, out_paths: List[str], old_digest: str, new_digest: str
+    ) -> List[str]:
+        """
+        Renames lockscreens named after an old fingerprint of an image to
+        its new one
+
+        Arguments:
+            out_paths (List[str]): the paths of the lockscreens
+            old_digest (str): the fingerprint they are named after
+            new_digest (str): the fingerprint to name them after
+
+        Returns:
+            (List[str]): the new paths of the lockscreens that still exist
+        """
+        old_prefix = old_digest[:OUT_NAME_DIGEST_LENGTH]
+        new_prefix = new_digest[:OUT_NAME_DIGEST_LENGTH]
+
+        migrated_paths = []
+        for out_path in out_paths:
+            out_directory, out_name = os.path.split(out_path)
+            if not out_name.startswith(old_prefix):
+                continue
+
+            new_path = os.path.join(
+                out_directory, new_prefix + out_name[len(old_prefix) :]
+            )
+            try:
+                os.replace(out_path, new_path)
+            except FileNotFoundError:
+                continue
+
+            self.renamed[out_path] = new_path
+            migrated_paths.append(new_path)
+
+        return migrated_paths
+
+    def get_outputs(self, image_path: str) -> List[str]:
+        """
+        Gets the lockscreens rendered from an image
+
+        Arguments:
+            image_path (str): the path to the image
+
+        Returns:
+            (List[str]): the paths of the rendered lockscreens
+        """
+        entry = self.entries.get(image_path)
+        if not entry:
+            return []
+
+        return list(entry["outputs"])
+
+    def add_output(self, image_path: str, out_path: str):
+        """
+        Records a lockscreen rendered from an indexed image
+
+        Arguments:
+            image_path (str): the path to the image
+            out_path (str): the path of the rendered lockscreen
+        """
+        entry = self.entries.get(image_path)
+        if entry and out_path not in entry["outputs"]:
+            entry["outputs"].append(out_path)
+            self.changed = True
+
+    def remove(self, image_path: str):
+        """
+        Removes an image from the index
+
+        Arguments:
+            image_path (str): the path to the image
+        """
+        if self.entries.pop(image_path, None) is not None:
+            self.changed = True
+
+    def save(self):
+        """Writes the index to disk if it has changed"""
+        if not self.changed:
+            return
+
+        utils.write_json_atomic(self.index_path, self.entries)
+        self.changed = False
+
+
+def load_index(index_path: str) -> Dict:
+    """
+    Loads the index entries from disk, starting afresh if the index is
+    missing or corrupt
+
+    Arguments:
+        index_path (str): the location of the index file
+
+    Returns:
+        (Dict): the index entries
+    """
+    try:
+        with open(index_path, encoding="UTF-8") as index_file:
+            entries = json.load(index_file)
+    except (IOError, ValueError):
+        return {}
+
+    if not isinstance(entries, dict):
+        return {}
+
+    # Entries written before fingerprints were configurable hold an md5
+    for entry in entries.values():
+        if "md5" in entry:
+            entry["fingerprint"] = "md5"
+            entry["digest"] = entry.pop("md5")
+
+    return entries
+
+
+def get_stat_key(stat: os.stat_result) -> List[int]:
+    """
+    Gets the part of a file's stat used to tell if it has changed
+
+    Arguments:
+        stat (os.stat_result): the stat of the file
+
+    Returns:
+        (List[int]): the size, modification time and inode of the file
+    """
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
@@ -1,6 +1,5 @@
 """Logging functions"""
 import logging
-import tqdm
 
 DEFAULT_FORMAT = "[%(levelname)s\033[0m] " "\033[1;31m%(module)s\033[0m: " "%(message)s"
 BAR_FORMAT = "{percentage:3.0f}% {n}/{total}"
@@ -13,6 +12,9 @@ class TqdmLoggingHandler(logging.Handler):
         super().__init__(level)
 
     def emit(self, record):
+        # Imported here so logging does not load tqdm before a bar is shown
+        import tqdm  # pylint: disable=import-outside-toplevel
+
         try:
             self.setFormatter(logging.Formatter(DEFAULT_FORMAT))
             msg = self.format(record)
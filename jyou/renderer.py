@@ -0,0 +1,394 @@
+"""
+Rendering lockscreens in memory, for processes that embed JYOU rather than
+running it. Nothing here looks up the monitors, writes a lockscreen to disk
+or exits the process.
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, Tuple, Union
+
+from . import generator, stats, utils
+from .cache import ImageCache, SOURCE_CACHE_PATH, TILE_CACHE_PATH
+from .encoders import get_encoder
+from .geometry import parse_layout
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# A path to an image, its encoded bytes or a binary file to read them from
+Source = Union[str, os.PathLike, bytes, bytearray, memoryview, io.IOBase]
+
+
+class RenderError(Exception):
+    """Raised when a lockscreen can not be rendered from a source"""
+
+
+class Renderer:
+    """
+    Renders lockscreens for a fixed monitor layout. A renderer is meant to be
+    constructed once and reused, its worker processes kept between calls.
+    """
+
+    def __init__(self, resolutions, **kwargs):
+        """
+        The initialisation method
+
+        Arguments:
+            resolutions (List[Tuple[int]]): the [width, height, offset_x,
+                offset_y] of each monitor, or a layout string such as
+                '1920x1080+0+0,2560x1440+1920+0'
+        """
+        if isinstance(resolutions, str):
+            resolutions = parse_layout(resolutions)
+        self.resolutions = [tuple(resolution) for resolution in resolutions]
+        self.blur_strength = kwargs.get("blur_strength", 0)
+        self.brightness = float(kwargs.get("brightness", 1))
+        self.blur_quality = float(kwargs.get("blur_quality", 1))
+        self.encoder = get_encoder(kwargs.get("encoder", "png"))
+        self.jobs = generator.get_job_count(kwargs.get("jobs", 1))
+        self.fingerprint = kwargs.get("fingerprint", "md5")
+        if self.fingerprint not in utils.FINGERPRINTS:
+            raise ValueError(f"Unknown fingerprint: {self.fingerprint}")
+
+        # Shared with the command line by default, so either can reuse the
+        # sources and screens cached by the other
+        self.source_cache = None
+        if kwargs.get("source_cache_mb"):
+            self.source_cache = ImageCache(
+                kwargs.get("source_cache_dir", SOURCE_CACHE_PATH),
+                kwargs.get("source_cache_mb"),
+            )
+        self.tile_cache = None
+        if kwargs.get("tile_cache_mb"):
+            self.tile_cache = ImageCache(
+                kwargs.get("tile_cache_dir", TILE_CACHE_PATH),
+                kwargs.get("tile_cache_mb"),
+            )
+
+        self.executor = None
+        # Renders submitted to the workers and not yet done, cancelled when
+        # the renderer is closed
+        self.futures = set()
+
+    def __enter__(self) -> Renderer:
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_variant(self, resolutions=None, effects: Dict = None) -> Dict:
+        """
+        Gets the variant to render, see generator.generate_lockscreen_variants
+
+        Arguments:
+            resolutions (List[Tuple[int]]): the layout to render for instead
+                of the renderer's, as a list or a layout string
+            effects (Dict): the blur, brightness and blur quality to use
+                instead of the renderer's
+
+        Returns:
+            (Dict): the resolutions, blur, brightness and blur quality
+        """
+        if isinstance(resolutions, str):
+            resolutions = parse_layout(resolutions)
+        effects = effects or {}
+        return {
+            "resolutions": list(resolutions or self.resolutions),
+            "blur": effects.get("blur", self.blur_strength),
+            "brightness": float(effects.get("brightness", self.brightness)),
+            "blur_quality": float(effects.get("blur_quality", self.blur_quality)),
+        }
+
+    def get_cache_dirs(self) -> Tuple[str]:
+        """
+        Gets the directories of the source and tile caches
+
+        Returns:
+            (Tuple[str]): the directory of each cache, None where it is unused
+        """
+        return tuple(
+            None if cached_images is None else cached_images.cache_dir
+            for cached_images in (self.source_cache, self.tile_cache)
+        )
+
+    def render(self, source: Source, resolutions=None, effects: Dict = None) -> Image:
+        """
+        Renders the lockscreen for a source
+
+        Arguments:
+            source (Source): the path to the image, its bytes or a binary file
+            resolutions (List[Tuple[int]]): the layout to render for instead
+                of the renderer's
+            effects (Dict): the blur, brightness and blur quality to use
+                instead of the renderer's
+
+        Returns:
+            (PIL.Image): the lockscreen
+        """
+        return render_source(
+            read_source(source),
+            self.get_variant(resolutions, effects),
+            None,
+            self.fingerprint,
+            *self.get_cache_dirs(),
+        )
+
+    def render_bytes(
+        self, source: Source, resolutions=None, effects: Dict = None
+    ) -> bytes:
+        """
+        Renders the lockscreen for a source, encoded with the renderer's
+        encoder
+
+        Arguments:
+            source (Source): the path to the image, its bytes or a binary file
+            resolutions (List[Tuple[int]]): the layout to render for instead
+                of the renderer's
+            effects (Dict): the blur, brightness and blur quality to use
+                instead of the renderer's
+
+        Returns:
+            (bytes): the encoded lockscreen
+        """
+        return render_source(
+            read_source(source),
+            self.get_variant(resolutions, effects),
+            self.encoder.name,
+            self.fingerprint,
+            *self.get_cache_dirs(),
+        )
+
+    def render_many(
+        self, sources: Iterable[Source], encode: bool = False
+    ) -> Iterator[Tuple]:
+        """
+        Renders the lockscreens of many sources, yielding each as soon as it
+        is done. With more than one job the sources are rendered by worker
+        processes, so they may finish out of order. A source that fails is
+        yielded with its error instead of stopping the rest.
+
+        Arguments:
+            sources (Iterable[Source]): the sources to render, read as they
+                are needed
+            encode (bool): yield the encoded lockscreens instead of images
+
+        Yields:
+            (Tuple): the source and its lockscreen, or the RenderError it
+                failed with
+        """
+        variant = self.get_variant()
+        render_args = (
+            variant,
+            self.encoder.name if encode else None,
+            self.fingerprint,
+            *self.get_cache_dirs(),
+        )
+
+        if self.jobs <= 1:
+            for source in sources:
+                try:
+                    yield (source, render_source(read_source(source), *render_args))
+                except RenderError as error:
+                    yield (source, error)
+            self.enforce_cache_budgets()
+            return
+
+        # pylint: disable=import-outside-toplevel
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        executor = self.get_executor()
+        recording = stats.is_enabled()
+        pending = {}
+        try:
+            for source in sources:
+                try:
+                    data = read_source(source)
+                except RenderError as error:
+                    yield (source, error)
+                    continue
+
+                future = executor.submit(
+                    stats.run_recorded, recording, render_source, data, *render_args
+                )
+                self.futures.add(future)
+                future.add_done_callback(self.futures.discard)
+                pending[future] = source
+
+                # Read no further ahead than the workers can keep up with
+                while len(pending) >= self.jobs * generator.RENDER_QUEUE_FACTOR:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from get_finished_renders(done, pending)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from get_finished_renders(done, pending)
+        finally:
+            # Renders nobody will collect are dropped if they have not started
+            for future in pending:
+                future.cancel()
+
+        self.enforce_cache_budgets()
+
+    def get_executor(self):
+        """
+        Gets the worker processes, starting them the first time they are
+        needed
+
+        Returns:
+            (concurrent.futures.ProcessPoolExecutor): the worker processes
+        """
+        if self.executor is None:
+            self.executor = generator.get_process_pool(self.jobs)
+
+        return self.executor
+
+    def enforce_cache_budgets(self) -> Tuple[int]:
+        """
+        Keeps the source and tile caches within their budgets
+
+        Returns:
+            (Tuple[int]): the number of files and bytes removed
+        """
+        removed_files = 0
+        removed_bytes = 0
+        for cached_images in (self.source_cache, self.tile_cache):
+            if cached_images is not None:
+                files, size = cached_images.enforce_budget()
+                removed_files += files
+                removed_bytes += size
+
+        return (removed_files, removed_bytes)
+
+    def close(self):
+        """Stops the worker processes, if any were started"""
+        if self.executor is not None:
+            # Shutting down waits for every submitted render otherwise
+            for future in list(self.futures):
+                future.cancel()
+            self.executor.shutdown()
+            self.executor = None
+
+
+def get_finished_renders(done, pending: Dict) -> Iterator[Tuple]:
+    """
+    Collects the renders of worker processes, see Renderer.render_many
+
+    Arguments:
+        done (Set[concurrent.futures.Future]): the finished renders
+        pending (Dict): the source of each unfinished render, the finished
+            ones being removed
+
+    Yields:
+        (Tuple): the source and its lockscreen, or the RenderError it
+            failed with
+    """
+    for future in done:
+        source = pending.pop(future)
+        try:
+            yield (source, stats.add_records(*future.result()))
+        except RenderError as error:
+            yield (source, error)
+        # pylint: disable=broad-except
+        except Exception as error:
+            yield (source, RenderError(f"Could not render: {error}"))
+
+
+def read_source(source: Source) -> Union[str, bytes]:
+    """
+    Reads a source into something that can be sent to a worker process
+
+    Arguments:
+        source (Source): the path to the image, its bytes or a binary file
+
+    Returns:
+        (Union[str, bytes]): the absolute path to the image, or its bytes
+    """
+    if isinstance(source, (str, os.PathLike)):
+        image_path = os.path.abspath(os.fspath(source))
+        if not os.path.isfile(image_path):
+            raise RenderError(f"No image at {image_path}")
+        return image_path
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+
+    if hasattr(source, "read"):
+        try:
+            return source.read()
+        except OSError as error:
+            raise RenderError(f"Could not read the image: {error}") from error
+
+    raise TypeError(f"Can not render from {type(source).__name__}")
+
+
+def get_source_digest(source: Union[str, bytes], fingerprint: str = "md5") -> str:
+    """
+    Gets the digest the caches know a source by. Paths are fingerprinted as
+    the generator does, so they share its cached screens, while bytes are
+    always hashed with md5, the same as an md5 fingerprint of their file.
+
+    Arguments:
+        source (Union[str, bytes]): the path to the image, or its bytes
+        fingerprint (str): the fingerprint strategy for paths, see
+            utils.FINGERPRINTS
+
+    Returns:
+        (str): the digest of the source
+    """
+    if isinstance(source, str):
+        return utils.fingerprint_file(source, fingerprint)
+
+    return hashlib.md5(source).hexdigest()
+
+
+# pylint: disable=too-many-arguments
+def render_source(
+    source: Union[str, bytes],
+    variant: Dict,
+    encoder: str = None,
+    fingerprint: str = "md5",
+    source_cache_dir: str = None,
+    tile_cache_dir: str = None,
+):
+    """
+    Renders the lockscreen for a source that has been read, see read_source
+
+    Arguments:
+        source (Union[str, bytes]): the path to the image, or its bytes
+        variant (Dict): the resolutions, blur, brightness and blur quality
+        encoder (str): the name of the encoder to encode with, None to
+            return the image
+        fingerprint (str): the fingerprint strategy, see get_source_digest
+        source_cache_dir (str): where pre-scaled sources are cached, if at all
+        tile_cache_dir (str): where finished screens are cached, if at all
+
+    Returns:
+        (Union[PIL.Image, bytes]): the lockscreen, encoded if given an encoder
+    """
+    source_path = None
+    tile_prefix = None
+    try:
+        if source_cache_dir is not None or tile_cache_dir is not None:
+            digest = get_source_digest(source, fingerprint)
+            if source_cache_dir is not None:
+                source_path = ImageCache(source_cache_dir).get_path(digest)
+            if tile_cache_dir is not None:
+                tile_prefix = os.path.join(tile_cache_dir, digest)
+
+        image_file = source if isinstance(source, str) else io.BytesIO(source)
+        with stats.stage("render", source if isinstance(source, str) else None):
+            lockscreen_image = next(
+                generator.generate_lockscreen_variants(
+                    image_file, [variant], source_path, tile_prefix
+                )
+            )
+            if encoder is None:
+                return lockscreen_image
+
+            with stats.stage("encode"):
+                return get_encoder(encoder).encode(lockscreen_image)
+    except (OSError, SyntaxError, ValueError) as error:
+        raise RenderError(f"Could not render the image: {error}") from error
@@ -0,0 +1,375 @@
+"""Policies for picking the image shown by an update"""
+from __future__ import annotations
+
+import itertools
+import json
+import math
+import os
+import random
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, Sequence, Tuple
+
+from . import utils
+
+if TYPE_CHECKING:
+    from .generator import LockscreenGenerator
+
+SELECTION_STATE_FILE_NAME = "selection.json"
+# The shuffled order of a round, one JSON encoded path per line, so each pick
+# reads a single line rather than the whole order
+SHUFFLE_QUEUE_FILE_NAME = "shuffle.queue"
+# Images last shown longer ago than this are all equally likely to be picked
+# by the recency policy
+RECENCY_HORIZON = 7 * 24 * 60 * 60
+
+
+class SelectionPolicy:
+    """Picks images uniformly at random"""
+
+    name = "random"
+
+    def __init__(self, state_path: str):
+        """
+        The initialisation method
+
+        Arguments:
+            state_path (str): the location of the file the policy keeps its
+                state in between runs
+        """
+        self.state_path = state_path
+        self.state = None
+        # The version of the state file when it was last read or written
+        self.state_version = None
+
+    def select(self, generator: LockscreenGenerator, exclude_path: str = None) -> str:
+        """
+        Picks an image from the library of the generator
+
+        Arguments:
+            generator (LockscreenGenerator): the generator to pick for
+            exclude_path (str): an image not to pick unless it is the only one
+
+        Returns:
+            (str): the path to the image, None if there are none
+        """
+        return pick_excluding(
+            get_random_image_path, generator.iter_image_paths(), exclude_path
+        )
+
+    def record(self, image_path: str):
+        """
+        Records that an image was shown
+
+        Arguments:
+            image_path (str): the path to the image
+        """
+
+    def load_state(self) -> Dict:
+        """
+        Loads the state of the policy, again whenever another process, such
+        as a background prefetch, has changed it
+
+        Returns:
+            (Dict): the state
+        """
+        state_version = get_file_version(self.state_path)
+        if self.state is None or state_version != self.state_version:
+            self.state = load_selection_state(self.state_path)
+            self.state_version = state_version
+
+        return self.state
+
+    def save_state(self):
+        """Writes the state of the policy to disk"""
+        utils.write_json_atomic(self.state_path, self.state)
+        self.state_version = get_file_version(self.state_path)
+
+
+class PreferCachedPolicy(SelectionPolicy):
+    """
+    Picks at random among the images whose lockscreen is already rendered for
+    the current screens and settings, so an update only renders when nothing
+    is rendered yet
+    """
+
+    name = "prefer-cached"
+
+    def select(self, generator: LockscreenGenerator, exclude_path: str = None) -> str:
+        image_path = pick_excluding(
+            get_random_image_path, generator.get_rendered_image_paths(), exclude_path
+        )
+        if image_path is not None:
+            return image_path
+
+        return super().select(generator, exclude_path)
+
+
+class ShufflePolicy(SelectionPolicy):
+    """
+    Shows every image once in a shuffled order before any is repeated,
+    keeping the order between runs. The order is written once a round, each
+    pick only moving the position in it.
+    """
+
+    name = "shuffle"
+
+    def __init__(self, state_path: str):
+        super().__init__(state_path)
+        self.queue_path = os.path.join(
+            os.path.dirname(state_path), SHUFFLE_QUEUE_FILE_NAME
+        )
+
+    def select(self, generator: LockscreenGenerator, exclude_path: str = None) -> str:
+        state = self.load_state()
+        excluded = False
+
+        for refill in (False, True):
+            if refill:
+                self.write_queue(generator, exclude_path)
+                state["shuffle_position"] = 0
+
+            for image_path, position in read_queue(
+                self.queue_path, state["shuffle_position"]
+            ):
+                state["shuffle_position"] = position
+                if image_path == exclude_path:
+                    excluded = True
+                elif generator.is_library_image(image_path):
+                    self.save_state()
+                    return image_path
+
+        self.save_state()
+        if excluded and generator.is_library_image(exclude_path):
+            return exclude_path
+
+        return None
+
+    def write_queue(self, generator: LockscreenGenerator, exclude_path: str):
+        """
+        Shuffles the library into the order of the next round
+
+        Arguments:
+            generator (LockscreenGenerator): the generator to pick for
+            exclude_path (str): the image just shown, not to start the round
+        """
+        queue = list(generator.iter_image_paths())
+        random.shuffle(queue)
+        if len(queue) > 1 and queue[0] == exclude_path:
+            queue.append(queue.pop(0))
+
+        utils.write_file_atomic(
+            self.queue_path, "".join(json.dumps(i) + "\n" for i in queue)
+        )
+
+
+class RecencyPolicy(SelectionPolicy):
+    """
+    Picks images with a weight growing with the time since they were last
+    shown, up to RECENCY_HORIZON, so recently shown images are rarely repeated
+    """
+
+    name = "recency"
+
+    def select(self, generator: LockscreenGenerator, exclude_path: str = None) -> str:
+        last_used = self.load_state()["last_used"]
+        now = time.time()
+
+        def get_weight(image_path: str) -> float:
+            age = now - last_used.get(image_path, now - RECENCY_HORIZON)
+            return min(max(age, 1), RECENCY_HORIZON)
+
+        return pick_excluding(
+            lambda image_paths: get_weighted_image_path(image_paths, get_weight),
+            generator.iter_image_paths(),
+            exclude_path,
+        )
+
+    def record(self, image_path: str):
+        self.load_state()["last_used"][image_path] = time.time()
+        self.save_state()
+
+
+SELECTION_POLICIES = {
+    policy.name: policy
+    for policy in (SelectionPolicy, PreferCachedPolicy, ShufflePolicy, RecencyPolicy)
+}
+
+
+def get_selection_policy(name: str, out_dir: str) -> SelectionPolicy:
+    """
+    Gets the selection policy with the given name
+
+    Arguments:
+        name (str): the name of the policy
+        out_dir (str): the directory the policy keeps its state in
+
+    Returns:
+        (SelectionPolicy): the policy
+    """
+    try:
+        policy = SELECTION_POLICIES[name]
+    except KeyError as error:
+        raise ValueError(f"Unknown selection policy: {name}") from error
+
+    return policy(os.path.join(out_dir, SELECTION_STATE_FILE_NAME))
+
+
+def load_selection_state(state_path: str) -> Dict:
+    """
+    Loads the position in the shuffle queue and when each image was last
+    shown
+
+    Arguments:
+        state_path (str): the location of the state file
+
+    Returns:
+        (Dict): the selection state
+    """
+    state = {"shuffle_position": 0, "last_used": {}}
+    try:
+        with open(state_path, encoding="UTF-8") as state_file:
+            loaded_state = json.load(state_file)
+    except (IOError, ValueError):
+        return state
+
+    if isinstance(loaded_state, dict):
+        for key, value in state.items():
+            if isinstance(loaded_state.get(key), type(value)):
+                state[key] = loaded_state[key]
+
+    return state
+
+
+def read_queue(queue_path: str, position: int) -> Iterator[Tuple]:
+    """
+    Reads the shuffle queue from a position on, stopping at a line that is
+    not a path, such as when the queue was replaced mid-round
+
+    Arguments:
+        queue_path (str): the location of the queue file
+        position (int): the byte offset to read from
+
+    Yields:
+        (Tuple): each path and the byte offset of the line after it
+    """
+    try:
+        with open(queue_path, "rb") as queue_file:
+            queue_file.seek(position)
+            for line in queue_file:
+                position += len(line)
+                try:
+                    image_path = json.loads(line)
+                except ValueError:
+                    return
+                if not isinstance(image_path, str):
+                    return
+
+                yield (image_path, position)
+    except IOError:
+        return
+
+
+def get_file_version(file_path: str) -> Tuple[int]:
+    """
+    Gets what changes when a file is rewritten, its inode changing even when
+    it is replaced within the resolution of its modification time
+
+    Arguments:
+        file_path (str): the path to the file
+
+    Returns:
+        (Tuple[int]): the inode and modification time, None if there is no
+            file
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+
+    return (stat.st_ino, stat.st_mtime_ns)
+
+
+def pick_excluding(pick, image_paths: Iterable[str], exclude_path: str) -> str:
+    """
+    Picks an image, avoiding one unless it is the only image
+
+    Arguments:
+        pick (callable): picks a path from an iterable of paths
+        image_paths (Iterable[str]): the paths to pick from
+        exclude_path (str): the path to avoid, if any
+
+    Returns:
+        (str): the picked path, None if there are none
+    """
+    if exclude_path is None:
+        return pick(image_paths)
+
+    excluded = []
+
+    def without_excluded():
+        for image_path in image_paths:
+            if image_path == exclude_path:
+                excluded.append(image_path)
+            else:
+                yield image_path
+
+    image_path = pick(without_excluded())
+    if image_path is None and excluded:
+        return exclude_path
+
+    return image_path
+
+
+def get_random_image_path(image_paths: Iterable[str]) -> str:
+    """
+    Gets a random path to a image, picking from a list by index and from
+    any other iterable by reservoir sampling so it is never listed in full
+
+    Arguments:
+        image_paths (Iterable[str]): the paths to images
+
+    Returns:
+        (str): a randomly picked image path, None if there are none
+    """
+    if isinstance(image_paths, Sequence):
+        return random.choice(image_paths) if image_paths else None
+
+    # Algorithm L: rather than drawing a number for every path, draw how many
+    # paths are skipped before the next one replaces the pick
+    paths = iter(image_paths)
+    image_path = next(paths, None)
+    weight = 1 - random.random()
+    while weight:
+        skip = math.floor(math.log(1 - random.random()) / math.log1p(-weight))
+        next_path = next(itertools.islice(paths, skip, None), None)
+        if next_path is None:
+            break
+
+        image_path = next_path
+        weight *= 1 - random.random()
+
+    return image_path
+
+
+def get_weighted_image_path(image_paths: Iterable[str], get_weight) -> str:
+    """
+    Gets a random path to an image with a chance proportional to its weight,
+    by weighted reservoir sampling so the paths are never listed in full
+
+    Arguments:
+        image_paths (Iterable[str]): the paths to images
+        get_weight (callable): gets the weight of a path, above 0
+
+    Returns:
+        (str): a randomly picked image path, None if there are none
+    """
+    # Efraimidis-Spirakis: keep the path with the largest u ** (1 / weight),
+    # compared as logarithms so large weights keep their precision
+    image_path = None
+    best_key = -math.inf
+    for candidate_path in image_paths:
+        key = math.log(1 - random.random()) / get_weight(candidate_path)
+        if key > best_key or image_path is None:
+            image_path, best_key = candidate_path, key
+
+    return image_path
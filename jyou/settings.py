@@ -18,3 +18,8 @@ if "XDG_CACHE_HOME" in os.environ:
     CACHE_PATH = os.path.join(os.getenv("XDG_CACHE_HOME"), APP_NAME)
 else:
     CACHE_PATH = os.path.expanduser("~/.cache/" + APP_NAME)
+
+if "XDG_RUNTIME_DIR" in os.environ:
+    RUNTIME_PATH = os.path.join(os.getenv("XDG_RUNTIME_DIR"), APP_NAME)
+else:
+    RUNTIME_PATH = CACHE_PATH
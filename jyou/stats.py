@@ -0,0 +1,276 @@
+"""Per-stage timing and memory statistics of the generation pipeline"""
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from . import utils
+
+# Returned by stage() while recording is disabled, so an instrumented stage
+# costs a function call and an empty with block
+NULL_STAGE = contextlib.nullcontext()
+STATM_PATH = "/proc/self/statm"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+_recorder = None
+
+
+class StatsRecorder:
+    """
+    Records the wall time, CPU time and memory growth of each stage. Memory
+    is measured from the resident set size as Pillow allocates image buffers
+    outside of the Python allocator, where tracemalloc can not see them.
+    Stages may run in several threads at once, the CPU time and image of a
+    stage being those of its own thread.
+    """
+
+    def __init__(self):
+        """The initialisation method"""
+        self.records = []
+        self.local = threading.local()
+
+    @property
+    def image_path(self) -> str:
+        """
+        The image the stages of the current thread work on
+
+        Returns:
+            (str): the path to the image, None if there is none
+        """
+        return getattr(self.local, "image_path", None)
+
+    @image_path.setter
+    def image_path(self, image_path: str):
+        """
+        Sets the image the stages of the current thread work on
+
+        Arguments:
+            image_path (str): the path to the image
+        """
+        self.local.image_path = image_path
+
+    @contextlib.contextmanager
+    def stage(self, name: str, image_path: str = None):
+        """
+        Records a stage, nested stages inheriting the image of the outer one
+
+        Arguments:
+            name (str): the name of the stage
+            image_path (str): the image the stage works on, if any
+        """
+        outer_image_path = self.image_path
+        if image_path is not None:
+            self.image_path = image_path
+
+        start_rss = get_rss()
+        start_peak_rss = get_peak_rss()
+        start_cpu = time.thread_time()
+        start_wall = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.thread_time() - start_cpu
+            self.records.append(
+                {
+                    "stage": name,
+                    "image": self.image_path,
+                    "wall": wall,
+                    "cpu": cpu,
+                    "rss_delta": get_rss() - start_rss,
+                    "peak_rss_delta": get_peak_rss() - start_peak_rss,
+                    "pid": os.getpid(),
+                }
+            )
+            self.image_path = outer_image_path
+
+
+def enable() -> StatsRecorder:
+    """
+    Starts recording stages in this process
+
+    Returns:
+        (StatsRecorder): the recorder
+    """
+    global _recorder  # pylint: disable=global-statement
+    _recorder = StatsRecorder()
+    return _recorder
+
+
+def disable():
+    """Stops recording stages in this process"""
+    global _recorder  # pylint: disable=global-statement
+    _recorder = None
+
+
+def is_enabled() -> bool:
+    """
+    Checks whether stages are being recorded
+
+    Returns:
+        (bool): whether stages are being recorded
+    """
+    return _recorder is not None
+
+
+def stage(name: str, image_path: str = None):
+    """
+    Records a stage if recording is enabled
+
+    Arguments:
+        name (str): the name of the stage
+        image_path (str): the image the stage works on, if any
+
+    Returns:
+        (contextmanager): the context to run the stage in
+    """
+    if _recorder is None:
+        return NULL_STAGE
+
+    return _recorder.stage(name, image_path)
+
+
+def get_records() -> List[Dict]:
+    """
+    Gets the stages recorded so far
+
+    Returns:
+        (List[Dict]): the recorded stages
+    """
+    if _recorder is None:
+        return []
+
+    return _recorder.records
+
+
+def run_recorded(enabled: bool, function: Callable, *args) -> Tuple:
+    """
+    Runs a function in a worker process, recording its stages if recording
+    is enabled in the parent
+
+    Arguments:
+        enabled (bool): whether recording is enabled in the parent
+        function (Callable): the function to run
+        *args: the arguments to the function
+
+    Returns:
+        (Tuple): the result of the function and the stages it recorded
+    """
+    if not enabled:
+        return (function(*args), [])
+
+    global _recorder  # pylint: disable=global-statement
+    outer_recorder = _recorder
+    recorder = enable()
+    try:
+        return (function(*args), recorder.records)
+    finally:
+        _recorder = outer_recorder
+
+
+def add_records(result, records: List[Dict]):
+    """
+    Adds the stages recorded by a worker process, see run_recorded
+
+    Arguments:
+        result: the result of the function the worker ran
+        records (List[Dict]): the stages the worker recorded
+
+    Returns:
+        the result of the function
+    """
+    if _recorder is not None:
+        _recorder.records.extend(records)
+
+    return result
+
+
+def summarise(records: List[Dict]) -> List[Dict]:
+    """
+    Totals the recorded stages by name, in the order they were first seen
+
+    Arguments:
+        records (List[Dict]): the recorded stages
+
+    Returns:
+        (List[Dict]): the count, total wall and CPU time and the largest
+            memory growth of each stage
+    """
+    summary = {}
+    for record in records:
+        total = summary.setdefault(
+            record["stage"],
+            {"stage": record["stage"], "count": 0, "wall": 0, "cpu": 0, "memory": 0},
+        )
+        total["count"] += 1
+        total["wall"] += record["wall"]
+        total["cpu"] += record["cpu"]
+        total["memory"] = max(
+            total["memory"], record["rss_delta"], record["peak_rss_delta"]
+        )
+
+    return list(summary.values())
+
+
+def format_summary(records: List[Dict]) -> str:
+    """
+    Formats the recorded stages as a table
+
+    Arguments:
+        records (List[Dict]): the recorded stages
+
+    Returns:
+        (str): the table
+    """
+    lines = [
+        f"{'stage':<12}{'count':>7}{'wall (s)':>11}{'cpu (s)':>11}"
+        f"{'mean (ms)':>11}{'memory':>12}"
+    ]
+    for total in summarise(records):
+        lines.append(
+            f"{total['stage']:<12}{total['count']:>7}{total['wall']:>11.3f}"
+            f"{total['cpu']:>11.3f}{total['wall'] / total['count'] * 1000:>11.1f}"
+            f"{utils.format_size(total['memory']):>12}"
+        )
+
+    return "\n".join(lines)
+
+
+def write_trace(records: List[Dict], trace_path: str):
+    """
+    Writes the recorded stages as JSON lines
+
+    Arguments:
+        records (List[Dict]): the recorded stages
+        trace_path (str): the path to write to
+    """
+    with open(trace_path, "w", encoding="UTF-8") as trace_file:
+        for record in records:
+            trace_file.write(json.dumps(record) + "\n")
+
+
+def get_rss() -> int:
+    """
+    Gets the current resident set size of this process
+
+    Returns:
+        (int): the resident set size in bytes, 0 if it is unknown
+    """
+    try:
+        with open(STATM_PATH, "rb") as statm_file:
+            return int(statm_file.read().split()[1]) * PAGE_SIZE
+    except (IOError, IndexError, ValueError):
+        return 0
+
+
+def get_peak_rss() -> int:
+    """
+    Gets the peak resident set size of this process
+
+    Returns:
+        (int): the peak resident set size in bytes
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
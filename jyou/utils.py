@@ -1,12 +1,23 @@
 """An assortment of utilities to aid this project"""
+import fnmatch
 import hashlib
+import json
+import logging
+import mmap
 import os
-import re
-import subprocess
 
-from typing import List
+from typing import Callable, Iterator, List
 
-from .settings import CONFIG_PATH
+from . import log
+
+IMAGE_FILE_TYPES = ("png", "jpg", "jpeg")
+HASH_BUFFER_SIZE = 1024 * 1024
+# Bytes read from each of the start, middle and end of a sampled file
+SAMPLE_BLOCK_SIZE = 256 * 1024
+# Bytes in a BLAKE2b fingerprint, the same length as an md5
+FINGERPRINT_DIGEST_SIZE = 16
+
+logger = log.setup_logger(__name__, logging.WARN, log.DefaultLoggingHandler())
 
 
 def md5(string: str) -> str:
@@ -33,11 +44,250 @@ def md5_file(file_path: str) -> str:
     Returns:
         (str): md5 encoding of the given file
     """
-    hash_md5 = hashlib.md5()
+    return hash_file(file_path, hashlib.md5())
+
+
+def blake2b_file(file_path: str) -> str:
+    """
+    Generates a BLAKE2b hash of the whole file, mapping it into memory so it
+    is hashed in one call without copying it through read buffers
+
+    Arguments:
+        file_path (str): location of the file ('/home/bob/pic.png')
+
+    Returns:
+        (str): the 128 bit BLAKE2b hash of the file
+    """
+    file_hash = hashlib.blake2b(digest_size=FINGERPRINT_DIGEST_SIZE)
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+        if os.fstat(f.fileno()).st_size == 0:
+            return file_hash.hexdigest()
+
+        try:
+            mapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Some file systems can not be mapped
+            return hash_file(file_path, file_hash)
+
+        with mapped_file:
+            if hasattr(mapped_file, "madvise"):
+                mapped_file.madvise(mmap.MADV_SEQUENTIAL)
+            file_hash.update(mapped_file)
+
+    return file_hash.hexdigest()
+
+
+def sample_file(file_path: str) -> str:
+    """
+    Generates a BLAKE2b hash of the size of the file and blocks from its
+    start, middle and end, reading the same amount however large it is.
+    Files smaller than the blocks are hashed whole.
+
+    Arguments:
+        file_path (str): location of the file ('/home/bob/pic.png')
+
+    Returns:
+        (str): the 128 bit hash of the sampled file
+    """
+    file_hash = hashlib.blake2b(digest_size=FINGERPRINT_DIGEST_SIZE)
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        file_hash.update(str(size).encode())
+        if size <= SAMPLE_BLOCK_SIZE * 3:
+            file_hash.update(f.read())
+        else:
+            last_offset = size - SAMPLE_BLOCK_SIZE
+            offsets = (0, last_offset // 2, last_offset)
+            # Ask for every block up front so slow storage fetches them together
+            for offset in offsets:
+                advise_file(f.fileno(), "WILLNEED", offset, SAMPLE_BLOCK_SIZE)
+            for offset in offsets:
+                file_hash.update(os.pread(f.fileno(), SAMPLE_BLOCK_SIZE, offset))
+
+    return file_hash.hexdigest()
+
+
+def hash_file(file_path: str, file_hash) -> str:
+    """
+    Feeds a file to a hash in large chunks read into one reused buffer
+
+    Arguments:
+        file_path (str): location of the file ('/home/bob/pic.png')
+        file_hash: the hashlib hash to update
+
+    Returns:
+        (str): the hex digest of the hash
+    """
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        advise_file(f.fileno(), "SEQUENTIAL")
+        for size in iter(lambda: f.readinto(buffer), 0):
+            file_hash.update(view[:size])
+
+    return file_hash.hexdigest()
+
+
+def advise_file(fd: int, advice: str, offset: int = 0, length: int = 0):
+    """
+    Tells the kernel how a file is about to be read, so it can start reading
+    ahead. Does nothing where posix_fadvise is not available.
+
+    Arguments:
+        fd (int): the file descriptor of the file
+        advice (str): the name of the advice, e.g. "WILLNEED" for
+            os.POSIX_FADV_WILLNEED
+        offset (int): where the advised range starts
+        length (int): the length of the advised range, 0 for the whole file
+    """
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, offset, length, getattr(os, f"POSIX_FADV_{advice}"))
+
+
+def read_ahead(file_path: str):
+    """
+    Starts reading a file into the page cache in the background, so it does
+    not have to wait on storage when it is read
+
+    Arguments:
+        file_path (str): location of the file ('/home/bob/pic.png')
+    """
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        advise_file(fd, "WILLNEED")
+    finally:
+        os.close(fd)
+
+
+FINGERPRINTS = {"md5": md5_file, "blake2b": blake2b_file, "sampled": sample_file}
+
+
+def fingerprint_file(file_path: str, fingerprint: str = "md5") -> str:
+    """
+    Fingerprints a file with the given strategy
+
+    Arguments:
+        file_path (str): location of the file ('/home/bob/pic.png')
+        fingerprint (str): the name of the strategy, see FINGERPRINTS
+
+    Returns:
+        (str): the fingerprint of the file
+    """
+    try:
+        fingerprinter = FINGERPRINTS[fingerprint]
+    except KeyError as error:
+        raise ValueError(f"Unknown fingerprint: {fingerprint}") from error
+
+    return fingerprinter(file_path)
+
+
+def format_size(size: int) -> str:
+    """
+    Formats a number of bytes to be read by a human
+
+    Arguments:
+        size (int): the number of bytes
+
+    Returns:
+        (str): the formatted size ('1.5 MiB')
+    """
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024 or unit == "GiB":
+            break
+        size /= 1024
+
+    if unit == "B":
+        return f"{size} {unit}"
+
+    return f"{size:.1f} {unit}"
+
+
+def run_detached(function: Callable, *args, **kwargs):
+    """
+    Runs a function in a detached background process, so the caller does not
+    wait on it. The process is forked twice and put in its own session, so
+    it is not left a zombie or stopped along with the caller's terminal, and
+    runs from the root directory without any of the caller's files, so
+    nothing reading the caller's output or sockets waits on it.
+
+    Arguments:
+        function (Callable): the function to run
+        *args: the positional arguments to the function
+        **kwargs: the keyword arguments to the function
+    """
+    pid = os.fork()
+    if pid != 0:
+        os.waitpid(pid, 0)
+        return
+
+    # pylint: disable=broad-except
+    try:
+        os.setsid()
+        if os.fork() == 0:
+            detach_files()
+            function(*args, **kwargs)
+    except Exception as error:
+        logger.error("Failed to run %s: %s", function.__name__, error)
+    finally:
+        os._exit(0)  # pylint: disable=protected-access
+
+
+def detach_files():
+    """
+    Moves the process to the root directory, points its standard streams at
+    /dev/null and closes every other file it inherited
+    """
+    os.chdir("/")
+    null_fd = os.open(os.devnull, os.O_RDWR)
+    for fd in range(3):
+        os.dup2(null_fd, fd)
+
+    try:
+        fds = [int(i) for i in os.listdir("/proc/self/fd")]
+    except OSError:
+        fds = range(3, os.sysconf("SC_OPEN_MAX"))
+    for fd in fds:
+        if fd > 2:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def write_file_atomic(file_path: str, text: str):
+    """
+    Writes text to a file through a temporary file swapped in place, so
+    readers only ever see the old or the new contents
+
+    Arguments:
+        file_path (str): the path to the file
+        text (str): the contents of the file
+    """
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "w", encoding="UTF-8") as temp_file:
+            temp_file.write(text)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_json_atomic(file_path: str, data):
+    """
+    Writes compact JSON to a file, see write_file_atomic
+
+    Arguments:
+        file_path (str): the path to the file
+        data (Any): the data to serialise
+    """
+    write_file_atomic(file_path, json.dumps(data, separators=(",", ":")))
 
 
 def get_absolute_image_path(image_path: str) -> str:
@@ -66,29 +316,108 @@ def get_directory_image_paths(image_directory: str) -> List[str]:
     Returns:
         (List[str]): list of all file paths in a directory
     """
-    file_types = ("png", "jpg", "jpeg")
-    return [
-        img.name
-        for img in os.scandir(image_directory)
-        if img.name.lower().endswith(file_types)
-    ]
+    return [img.name for img in os.scandir(image_directory) if is_image_path(img.name)]
+
+
+def is_image_path(image_path: str) -> bool:
+    """
+    Checks if a path has the extension of a supported image
+
+    Arguments:
+        image_path (str): the path to check
+
+    Returns:
+        (bool): if the path is to an image
+    """
+    return image_path.lower().endswith(IMAGE_FILE_TYPES)
+
+
+def scan_image_paths(
+    image_directory: str, include: List[str] = (), exclude: List[str] = ()
+) -> Iterator[str]:
+    """
+    Yields the absolute paths of the images within a directory and all of its
+    subdirectories as they are found, using the file types os.scandir already
+    read instead of a stat per entry
+
+    Arguments:
+        image_directory (str): the directory to scan
+        include (List[str]): globs an image must match one of, if any
+        exclude (List[str]): globs of images and directories to skip
 
+    Yields:
+        (str): the absolute path of each image
+    """
+    root = os.path.abspath(image_directory)
+    directories = [root]
+    visited = {os.path.realpath(root)}
 
-def run_hooks():
-    """Run all scripts within the hooks folder"""
-    hooks_dir = os.path.join(CONFIG_PATH, "hooks")
-    os.makedirs(hooks_dir, exist_ok=True)
+    while directories:
+        try:
+            dir_entries = os.scandir(directories.pop())
+        except OSError:
+            continue
 
-    scripts = [
-        f
-        for f in os.listdir(hooks_dir)
-        if re.match(r"^([0-9]{2}-\w+)", f)
-        and os.access(os.path.join(hooks_dir, f), os.X_OK)
-    ]
-    scripts.sort()
+        with dir_entries:
+            for dir_entry in dir_entries:
+                relative_path = dir_entry.path[len(root) + 1 :]
+                try:
+                    if dir_entry.is_dir():
+                        if match_globs(dir_entry.name, relative_path, exclude):
+                            continue
+                        # Only symlinks can lead back to a directory already seen
+                        if dir_entry.is_symlink():
+                            real_path = os.path.realpath(dir_entry.path)
+                            if real_path in visited:
+                                continue
+                            visited.add(real_path)
+                        directories.append(dir_entry.path)
+                    elif (
+                        is_image_path(dir_entry.name)
+                        and dir_entry.is_file()
+                        and is_included_path(relative_path, include, exclude)
+                    ):
+                        yield dir_entry.path
+                except OSError:
+                    continue
 
-    for script in scripts:
-        script = os.path.join(hooks_dir, script)
 
-        with open(os.devnull, "w", encoding="UTF-8") as devnull:
-            subprocess.run(script, stdout=devnull, stderr=subprocess.STDOUT, check=True)
+def is_included_path(
+    relative_path: str, include: List[str] = (), exclude: List[str] = ()
+) -> bool:
+    """
+    Checks if a path within the image directory passes the include and
+    exclude globs
+
+    Arguments:
+        relative_path (str): the path relative to the image directory
+        include (List[str]): globs the path must match one of, if any
+        exclude (List[str]): globs the path must not match
+
+    Returns:
+        (bool): if the path passes
+    """
+    name = os.path.basename(relative_path)
+    if include and not match_globs(name, relative_path, include):
+        return False
+
+    return not match_globs(name, relative_path, exclude)
+
+
+def match_globs(name: str, relative_path: str, globs: List[str]) -> bool:
+    """
+    Checks if a file name or its path relative to the image directory matches
+    any of the globs
+
+    Arguments:
+        name (str): the name of the file
+        relative_path (str): the path relative to the image directory
+        globs (List[str]): the globs to match against
+
+    Returns:
+        (bool): if any glob matches
+    """
+    return any(
+        fnmatch.fnmatch(name, glob) or fnmatch.fnmatch(relative_path, glob)
+        for glob in globs
+    )
@@ -0,0 +1,543 @@
+"""A long running daemon that keeps lockscreens in sync with a directory"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import selectors
+import signal
+import socket
+import struct
+import sys
+from typing import Dict, List
+
+from . import log, utils
+from .cache import get_current_lockscreens
+from .generator import LockscreenGenerator
+from .index import OUT_NAME_DIGEST_LENGTH
+from .settings import RUNTIME_PATH
+
+SOCKET_PATH = os.path.join(RUNTIME_PATH, "jyou.sock")
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+logger = log.setup_logger(__name__, logging.WARN, log.DefaultLoggingHandler())
+
+
+class WatchError(Exception):
+    """Raised when the directory can not be watched"""
+
+
+class Inotify:
+    """A minimal wrapper around the Linux inotify API"""
+
+    def __init__(self):
+        """The initialisation method"""
+        libc_name = ctypes.util.find_library("c")
+        try:
+            self.libc = ctypes.CDLL(libc_name or "libc.so.6", use_errno=True)
+            self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError) as error:
+            raise WatchError(f"inotify is not available: {error}") from error
+
+        if self.fd < 0:
+            raise WatchError(
+                f"inotify is not available: {os.strerror(ctypes.get_errno())}"
+            )
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        """
+        Starts watching a path
+
+        Arguments:
+            path (str): the path to watch
+            mask (int): the events to watch for
+
+        Returns:
+            (int): the watch descriptor
+        """
+        watch_descriptor = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(path), mask
+        )
+        if watch_descriptor < 0:
+            raise WatchError(
+                f"Could not watch {path}: {os.strerror(ctypes.get_errno())}"
+            )
+
+        return watch_descriptor
+
+    def remove_watch(self, watch_descriptor: int):
+        """
+        Stops watching a path
+
+        Arguments:
+            watch_descriptor (int): the watch descriptor of the path
+        """
+        self.libc.inotify_rm_watch(self.fd, watch_descriptor)
+
+    def read_events(self) -> List[Dict]:
+        """
+        Reads the pending events
+
+        Returns:
+            (List[Dict]): the watch descriptor, mask and name of each event
+        """
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        return parse_events(buffer)
+
+    def fileno(self) -> int:
+        """
+        Gets the inotify file descriptor
+
+        Returns:
+            (int): the file descriptor
+        """
+        return self.fd
+
+    def close(self):
+        """Stops watching all paths"""
+        os.close(self.fd)
+
+
+class WatchDaemon:
+    """
+    Keeps the lockscreens of a directory up to date as files are added,
+    changed or removed, and serves update requests over a Unix socket
+    """
+
+    def __init__(
+        self,
+        generator: LockscreenGenerator,
+        image_directory: str,
+        socket_path: str = SOCKET_PATH,
+    ):
+        """
+        The initialisation method
+
+        Arguments:
+            generator (LockscreenGenerator): the generator to render with
+            image_directory (str): the directory to watch
+            socket_path (str): the location of the socket to listen on
+        """
+        if not os.path.isdir(image_directory):
+            raise WatchError(f"{image_directory} is not a directory")
+
+        self.generator = generator
+        self.image_directory = os.path.abspath(image_directory)
+        self.socket_path = socket_path
+        self.running = False
+        # The directory each watch descriptor watches
+        self.watches = {}
+
+    def run(self):
+        """Generates any missing lockscreens, then watches until stopped"""
+        inotify = Inotify()
+        self.watch_directory(inotify, self.image_directory)
+        server = open_socket(self.socket_path)
+
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        self.generator.generate()
+        self.running = True
+        logger.info("Watching %s", self.image_directory)
+
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(
+                    inotify, selectors.EVENT_READ, lambda: self.handle_events(inotify)
+                )
+                selector.register(
+                    server, selectors.EVENT_READ, lambda: self.handle_connection(server)
+                )
+                while self.running:
+                    for key, _ in selector.select():
+                        key.data()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            inotify.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def handle_events(self, inotify: Inotify):
+        """
+        Handles the pending inotify events, rendering added or changed
+        images together so the generator can render them in parallel
+
+        Arguments:
+            inotify (Inotify): the inotify instance to read from
+        """
+        changed_paths = []
+        for event in inotify.read_events():
+            directory = self.watches.get(event["wd"])
+            if directory is None:
+                continue
+
+            if event["mask"] & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                # Subdirectories are handled through the events of their parent
+                if directory == self.image_directory:
+                    logger.warning("%s is no longer being watched", directory)
+                    self.running = False
+                    return
+                if event["mask"] & IN_IGNORED:
+                    del self.watches[event["wd"]]
+                continue
+
+            path = os.path.join(directory, event["name"])
+            relative_path = os.path.relpath(path, self.image_directory)
+            if event["mask"] & IN_ISDIR:
+                if event["mask"] & (IN_CREATE | IN_MOVED_TO):
+                    if not utils.match_globs(
+                        event["name"], relative_path, self.generator.exclude
+                    ):
+                        # Images can be added before the directory is watched
+                        changed_paths.extend(
+                            i
+                            for i in self.watch_directory(inotify, path)
+                            if i not in changed_paths
+                        )
+                elif event["mask"] & (IN_DELETE | IN_MOVED_FROM):
+                    changed_paths = [i for i in changed_paths if not is_within(i, path)]
+                    self.remove_directory(inotify, path)
+                continue
+
+            if not utils.is_image_path(event["name"]) or not utils.is_included_path(
+                relative_path, self.generator.include, self.generator.exclude
+            ):
+                continue
+
+            if event["mask"] & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                if path not in changed_paths:
+                    changed_paths.append(path)
+            elif event["mask"] & (IN_DELETE | IN_MOVED_FROM):
+                if path in changed_paths:
+                    changed_paths.remove(path)
+                # pylint: disable=broad-except
+                try:
+                    self.remove_image(path)
+                except Exception as error:
+                    logger.error("Failed to remove %s: %s", path, error)
+
+        if changed_paths:
+            # A file can vanish or fail to read before it is rendered, which
+            # must not stop the daemon
+            # pylint: disable=broad-except
+            try:
+                self.add_images(changed_paths)
+            except Exception as error:
+                logger.error("Failed to generate lockscreens: %s", error)
+
+    def watch_directory(self, inotify: Inotify, directory: str) -> List[str]:
+        """
+        Watches a directory and all of its subdirectories that are not
+        excluded, the same ones the library is scanned in
+
+        Arguments:
+            inotify (Inotify): the inotify instance to watch with
+            directory (str): the directory to watch
+
+        Returns:
+            (List[str]): the images found in the directories
+        """
+        watched = {os.path.realpath(i) for i in self.watches.values()}
+        directories = [directory]
+        image_paths = []
+        while directories:
+            directory = directories.pop()
+            real_path = os.path.realpath(directory)
+            if real_path in watched:
+                continue
+
+            try:
+                watch_descriptor = inotify.add_watch(directory)
+                dir_entries = list(os.scandir(directory))
+            except (OSError, WatchError) as error:
+                # The root must be watched, anything under it may vanish
+                if directory == self.image_directory:
+                    raise
+                logger.warning("Could not watch %s: %s", directory, error)
+                continue
+
+            self.watches[watch_descriptor] = directory
+            watched.add(real_path)
+            for dir_entry in dir_entries:
+                relative_path = os.path.relpath(dir_entry.path, self.image_directory)
+                try:
+                    if dir_entry.is_dir():
+                        if not utils.match_globs(
+                            dir_entry.name, relative_path, self.generator.exclude
+                        ):
+                            directories.append(dir_entry.path)
+                    elif (
+                        utils.is_image_path(dir_entry.name)
+                        and dir_entry.is_file()
+                        and utils.is_included_path(
+                            relative_path,
+                            self.generator.include,
+                            self.generator.exclude,
+                        )
+                    ):
+                        image_paths.append(dir_entry.path)
+                except OSError:
+                    continue
+
+        return image_paths
+
+    def remove_directory(self, inotify: Inotify, directory: str):
+        """
+        Stops watching a directory that was deleted or moved away, and
+        removes the lockscreens of the images within it
+
+        Arguments:
+            inotify (Inotify): the inotify instance watching it
+            directory (str): the directory
+        """
+        for watch_descriptor, watched_directory in list(self.watches.items()):
+            if is_within(watched_directory, directory):
+                # A moved directory would otherwise still be watched
+                inotify.remove_watch(watch_descriptor)
+                del self.watches[watch_descriptor]
+
+        image_paths = set(self.generator.index.entries)
+        image_paths.update(self.generator.image_paths)
+        for image_path in sorted(image_paths):
+            if is_within(image_path, directory):
+                # pylint: disable=broad-except
+                try:
+                    self.remove_image(image_path)
+                except Exception as error:
+                    logger.error("Failed to remove %s: %s", image_path, error)
+
+    def add_images(self, image_paths: List[str]):
+        """
+        Renders the lockscreens of added or changed images, removing the
+        outputs of their previous contents
+
+        Arguments:
+            image_paths (List[str]): the paths to the images
+        """
+        index = self.generator.index
+        previous_entries = {
+            image_path: (
+                index.entries.get(image_path, {}).get("digest"),
+                index.get_outputs(image_path),
+            )
+            for image_path in image_paths
+        }
+
+        image_paths = [i for i in image_paths if os.path.isfile(i)]
+        for image_path in image_paths:
+            if image_path not in self.generator.image_paths:
+                self.generator.image_paths.append(image_path)
+
+        logger.info("Generating lockscreens for %d images", len(image_paths))
+        self.generator.generate(image_paths)
+
+        for image_path in image_paths:
+            previous_digest, previous_outputs = previous_entries[image_path]
+            current_digest = index.entries.get(image_path, {}).get("digest")
+            if previous_digest and previous_digest != current_digest:
+                remove_outputs(self.get_unused_outputs(image_path, previous_outputs))
+
+    def remove_image(self, image_path: str):
+        """
+        Removes the lockscreens of a deleted image
+
+        Arguments:
+            image_path (str): the path to the image
+        """
+        if image_path in self.generator.image_paths:
+            self.generator.image_paths.remove(image_path)
+
+        index = self.generator.index
+        remove_outputs(
+            self.get_unused_outputs(image_path, index.get_outputs(image_path))
+        )
+        index.remove(image_path)
+        index.save()
+        logger.info("Removed lockscreens for %s", image_path)
+
+    def get_unused_outputs(self, image_path: str, out_paths: List[str]) -> List[str]:
+        """
+        Gets the lockscreens of an image that nothing else uses. Lockscreens
+        are named by the fingerprint of their image, so identical images share
+        them, and the current lockscreen must stay until it is replaced.
+
+        Arguments:
+            image_path (str): the path to the image
+            out_paths (List[str]): the lockscreens that were rendered from it
+
+        Returns:
+            (List[str]): the lockscreens that can be removed
+        """
+        protected = set(get_current_lockscreens(self.generator.out_dir))
+        shared_paths = set()
+        shared_digests = set()
+        for other_path, entry in self.generator.index.entries.items():
+            if other_path != image_path:
+                shared_paths.update(entry["outputs"])
+                shared_digests.add(entry["digest"][:OUT_NAME_DIGEST_LENGTH])
+
+        return [
+            out_path
+            for out_path in out_paths
+            if os.path.realpath(out_path) not in protected
+            and out_path not in shared_paths
+            and os.path.basename(out_path)[:OUT_NAME_DIGEST_LENGTH]
+            not in shared_digests
+        ]
+
+    def handle_connection(self, server: socket.socket):
+        """
+        Answers a single request on the socket
+
+        Arguments:
+            server (socket.socket): the listening socket
+        """
+        connection, _ = server.accept()
+        with connection:
+            connection.settimeout(5)
+            try:
+                request = connection.recv(1024).decode("UTF-8", "replace")
+                connection.sendall((self.handle_command(request) + "\n").encode())
+            except OSError as error:
+                logger.warning("Failed to answer request: %s", error)
+
+    def handle_command(self, command: str) -> str:
+        """
+        Runs a command sent over the socket
+
+        Arguments:
+            command (str): the command, one of 'update', 'generate' or 'ping'
+
+        Returns:
+            (str): the response
+        """
+        command = command.strip()
+        # pylint: disable=broad-except
+        try:
+            if command == "update":
+                if not self.generator.image_paths:
+                    return "error no images"
+                out_path = self.generator.update()
+                return f"ok {out_path}" if out_path else "error update failed"
+
+            if command == "generate":
+                # Forget the library so it is listed again
+                self.generator.image_paths = None
+                self.generator.generate()
+                return "ok"
+
+            if command == "ping":
+                return "ok"
+        except Exception as error:
+            logger.error("Failed to run %s: %s", command, error)
+            return f"error {error}"
+
+        return f"error unknown command {command!r}"
+
+
+def parse_events(buffer: bytes) -> List[Dict]:
+    """
+    Parses the raw events read from inotify
+
+    Arguments:
+        buffer (bytes): the bytes read from the inotify file descriptor
+
+    Returns:
+        (List[Dict]): the watch descriptor, mask and name of each event
+    """
+    events = []
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(buffer):
+        watch_descriptor, mask, _, name_length = EVENT_HEADER.unpack_from(
+            buffer, offset
+        )
+        offset += EVENT_HEADER.size
+        name = buffer[offset : offset + name_length].rstrip(b"\0")
+        offset += name_length
+        events.append(
+            {"wd": watch_descriptor, "mask": mask, "name": os.fsdecode(name)}
+        )
+
+    return events
+
+
+def is_within(path: str, directory: str) -> bool:
+    """
+    Checks if a path is a directory or within it
+
+    Arguments:
+        path (str): the path to check
+        directory (str): the directory
+
+    Returns:
+        (bool): if the path is within the directory
+    """
+    return path == directory or path.startswith(directory + os.sep)
+
+
+def open_socket(socket_path: str) -> socket.socket:
+    """
+    Opens the listening socket, replacing a socket left over by a daemon that
+    is no longer running
+
+    Arguments:
+        socket_path (str): the location of the socket
+
+    Returns:
+        (socket.socket): the listening socket
+    """
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            try:
+                client.connect(socket_path)
+            except OSError:
+                os.remove(socket_path)
+            else:
+                raise WatchError(f"Another daemon is listening on {socket_path}")
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen()
+    return server
+
+
+def remove_outputs(out_paths: List[str]):
+    """
+    Removes rendered lockscreens
+
+    Arguments:
+        out_paths (List[str]): the paths to the lockscreens
+    """
+    for out_path in out_paths:
+        try:
+            os.remove(out_path)
+        except FileNotFoundError:
+            pass
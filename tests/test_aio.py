@@ -0,0 +1,156 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+from PIL import Image
+
+from jyou import aio, geometry
+
+# Holds an xrandr reporting 1920x1080+0+0 and 2560x1440+1920+0
+XRANDR_DIR = os.path.abspath("tests/assets/bin")
+
+
+class TestAioGeometry(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.bin_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.bin_dir)
+
+    async def test_get_xrandr_layout(self):
+        with mock.patch.dict(os.environ, {"PATH": XRANDR_DIR}):
+            self.assertEqual(
+                await aio.get_layout(geometry.XrandrProvider()),
+                [(1920, 1080, 0, 0), (2560, 1440, 1920, 0)],
+            )
+
+    async def test_get_layout_fallback(self):
+        provider = geometry.FallbackProvider(
+            [geometry.XrandrProvider(), geometry.LayoutProvider("60x30+0+0")]
+        )
+        with mock.patch.dict(os.environ, {"PATH": self.bin_dir}):
+            self.assertEqual(await aio.get_layout(provider), [(60, 30, 0, 0)])
+            with self.assertRaises(geometry.GeometryError):
+                await aio.get_layout(geometry.XrandrProvider())
+
+
+class TestAioHooks(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.hooks_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.hooks_dir, "log")
+
+    def tearDown(self):
+        shutil.rmtree(self.hooks_dir)
+
+    def add_hook(self, name, script):
+        hook_path = os.path.join(self.hooks_dir, name)
+        with open(hook_path, "w", encoding="UTF-8") as hook_file:
+            hook_file.write(f"#!/bin/sh\n{script}\n")
+        os.chmod(hook_path, 0o755)
+
+    async def test_run_hooks(self):
+        self.add_hook("00-slow", f"sleep 0.3; echo slow >> {self.log_path}")
+        self.add_hook("00-fast", f"echo fast >> {self.log_path}")
+        self.add_hook("10-fails", f"echo last >> {self.log_path}; exit 3")
+
+        results = await aio.run_hooks(self.hooks_dir)
+        with open(self.log_path, encoding="UTF-8") as log_file:
+            self.assertEqual(log_file.read().split(), ["fast", "slow", "last"])
+        self.assertEqual([i["returncode"] for i in results], [0, 0, 3])
+
+    async def test_run_hooks_timeout(self):
+        self.add_hook("00-hangs", "sleep 10")
+        self.add_hook("00-quick", "sleep 0.2")
+
+        start = time.monotonic()
+        results = await aio.run_hooks(
+            self.hooks_dir, timeout=0.1, timeouts={"00-quick": 5}
+        )
+        self.assertLess(time.monotonic() - start, 3)
+
+        results = {i["name"]: i for i in results}
+        self.assertTrue(results["00-hangs"]["timed_out"])
+        self.assertFalse(results["00-quick"]["timed_out"])
+
+    async def test_run_hooks_cancelled(self):
+        self.add_hook("00-hangs", f"sleep 0.5; echo ran >> {self.log_path}")
+
+        hook_task = asyncio.ensure_future(aio.run_hooks(self.hooks_dir))
+        await asyncio.sleep(0.1)
+        hook_task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await hook_task
+
+        await asyncio.sleep(0.6)
+        self.assertFalse(os.path.isfile(self.log_path))
+
+
+class TestAsyncLockscreenGenerator(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.generator = await aio.create_generator(
+            "tests/assets/",
+            geometry_provider=geometry.LayoutProvider("60x30+0+0"),
+            output_path=self.out_dir,
+        )
+
+    async def asyncTearDown(self):
+        await self.generator.close()
+        shutil.rmtree(self.out_dir)
+
+    async def test_create_generator(self):
+        self.assertEqual(self.generator.generator.resolutions, [(60, 30, 0, 0)])
+        with self.assertRaises(FileNotFoundError):
+            await aio.create_generator("/does/not/exist", resolutions=[(1, 1, 0, 0)])
+
+    async def test_update(self):
+        with mock.patch("jyou.aio.run_hooks") as run_hooks:
+            out_path = await self.generator.update()
+            run_hooks.assert_called_once()
+
+        self.assertTrue(os.path.isfile(out_path))
+        symlink_path = os.path.join(self.out_dir, "current_lockscreen.png")
+        self.assertEqual(Image.open(symlink_path).size, (60, 30))
+        lockscreen_generator = self.generator.generator
+        self.assertIn(
+            out_path,
+            [
+                output
+                for image_path in lockscreen_generator.image_paths
+                for output in lockscreen_generator.index.get_outputs(image_path)
+            ],
+        )
+
+    async def test_prefetch(self):
+        await self.generator.prefetch()
+        image_path = self.generator.generator.get_prefetched_image_path()
+        self.assertIsNotNone(image_path)
+        self.assertTrue(
+            os.path.isfile(self.generator.generator.get_lockscreen_out_path(image_path))
+        )
+
+    async def test_update_cancels_prefetch(self):
+        started = asyncio.Event()
+
+        async def slow_render(image_path, out_path):
+            started.set()
+            await asyncio.sleep(10)
+
+        with mock.patch.object(self.generator, "render", slow_render):
+            prefetch_task = self.generator.start_prefetch()
+            await started.wait()
+
+        with mock.patch("jyou.aio.run_hooks"):
+            self.assertIsNotNone(await self.generator.update())
+
+        self.assertTrue(prefetch_task.cancelled())
+        # The render lock of the cancelled prefetch is released
+        lock_paths = [
+            i
+            for i in os.listdir(os.path.join(self.out_dir, "lockscreen"))
+            if i.endswith(".lock")
+        ]
+        self.assertEqual(lock_paths, [])
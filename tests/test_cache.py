@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from PIL import Image
+from jyou import cache, index
+
+IMAGE_PATH = "tests/assets/test.jpg"
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.lockscreen_dir = os.path.join(self.out_dir, "lockscreen")
+        os.mkdir(self.lockscreen_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def add_lockscreen(self, name, size=1024, age=0):
+        out_path = os.path.join(self.lockscreen_dir, name)
+        with open(out_path, "wb") as out_file:
+            out_file.write(b"\0" * size)
+        mtime = time.time() - age
+        os.utime(out_path, (mtime, mtime))
+        return out_path
+
+    def test_enforce_budget_evicts_least_recently_used(self):
+        old_path = self.add_lockscreen("old_screen.png", age=300)
+        used_path = self.add_lockscreen("used_screen.png", age=200)
+        new_path = self.add_lockscreen("new_screen.png", age=100)
+
+        cache_manager = cache.CacheManager(self.out_dir, max_files=2)
+        cache_manager.touch(used_path)
+        self.assertEqual(cache_manager.enforce_budget(), (1, 1024))
+
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(used_path))
+        self.assertTrue(os.path.exists(new_path))
+
+    def test_enforce_budget_keeps_current_lockscreen(self):
+        current_path = self.add_lockscreen("current_screen.png", age=300)
+        self.add_lockscreen("new_screen.png")
+        os.symlink(current_path, os.path.join(self.out_dir, "current_lockscreen.png"))
+
+        cache_manager = cache.CacheManager(self.out_dir, max_mb=1024 / 1024 / 1024)
+        self.assertEqual(cache_manager.enforce_budget(), (1, 1024))
+        self.assertTrue(os.path.exists(current_path))
+
+    def test_collect_garbage(self):
+        image_path = os.path.join(self.out_dir, "missing.jpg")
+        shutil.copy(IMAGE_PATH, image_path)
+        fingerprint_index = index.FingerprintIndex(
+            os.path.join(self.out_dir, index.INDEX_FILE_NAME)
+        )
+        fingerprint_index.get_digest(image_path)
+        missing_path = self.add_lockscreen("missing_recent.png")
+        fingerprint_index.add_output(image_path, missing_path)
+        os.remove(image_path)
+
+        recent_path = self.add_lockscreen("image_recent.png")
+        old_path = self.add_lockscreen("image_old.png", size=2048)
+
+        cache_manager = cache.CacheManager(self.out_dir, layout_days=1)
+        cache_manager.see_layout("recent")
+        cache_manager.state["layouts"]["old"] = time.time() - 2 * cache.SECONDS_PER_DAY
+
+        self.assertEqual(cache_manager.collect_garbage(fingerprint_index), (2, 3072))
+        self.assertFalse(os.path.exists(missing_path))
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(recent_path))
+        self.assertEqual(fingerprint_index.entries, {})
+
+    def test_save(self):
+        cache_manager = cache.CacheManager(self.out_dir)
+        cache_manager.see_layout("screen")
+        cache_manager.save()
+
+        cache_manager = cache.CacheManager(self.out_dir)
+        self.assertIn("screen", cache_manager.state["layouts"])
+
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_save_and_load(self):
+        image_cache = cache.ImageCache(self.cache_dir)
+        cache_path = image_cache.get_path("digest")
+        self.assertIsNone(cache.load_cached_image(cache_path))
+
+        cache.save_cached_image(Image.new("RGB", (8, 4), (10, 20, 30)), cache_path)
+        image = cache.load_cached_image(cache_path)
+        self.assertEqual(image.size, (8, 4))
+        self.assertEqual(image.getpixel((0, 0)), (10, 20, 30))
+
+    def test_load_corrupt(self):
+        cache_path = cache.ImageCache(self.cache_dir).get_path("digest")
+        with open(cache_path, "wb") as cache_file:
+            cache_file.write(b"P6\n8")
+
+        self.assertIsNone(cache.load_cached_image(cache_path))
+        self.assertFalse(os.path.exists(cache_path))
+
+    def test_enforce_budget(self):
+        image_cache = cache.ImageCache(self.cache_dir, max_mb=1.5)
+        for age, key in enumerate(("new", "used", "old")):
+            cache_path = image_cache.get_path(key)
+            with open(cache_path, "wb") as cache_file:
+                cache_file.write(b"\0" * 1024 * 1024)
+            mtime = time.time() - age * 100
+            os.utime(cache_path, (mtime, mtime))
+
+        self.assertEqual(image_cache.enforce_budget(), (2, 2 * 1024 * 1024))
+        self.assertEqual(os.listdir(self.cache_dir), ["new.ppm"])
@@ -0,0 +1,48 @@
+import io
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from jyou import encoders
+
+
+class TestEncoders(unittest.TestCase):
+    def setUp(self):
+        self.image = Image.new("RGB", (4, 2), (10, 20, 30))
+
+    def test_png_encoders(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            for name in ("png", "png-fast", "png-max"):
+                encoder = encoders.get_encoder(name)
+                out_path = os.path.join(out_dir, "test" + encoder.extension)
+                encoder.save(self.image, out_path)
+                self.assertEqual(
+                    Image.open(out_path).tobytes(), self.image.tobytes()
+                )
+
+    def test_raw_encoder(self):
+        encoder = encoders.get_encoder("raw-bgrx")
+        with tempfile.TemporaryDirectory() as out_dir:
+            out_path = os.path.join(out_dir, "test" + encoder.extension)
+            encoder.save(self.image, out_path)
+            with open(out_path, "rb") as out_file:
+                self.assertEqual(out_file.read(), bytes((30, 20, 10, 0)) * 8)
+
+        self.assertEqual(encoder.get_raw_format((4, 2)), "4x2:bgrx")
+
+    def test_encode(self):
+        png = encoders.get_encoder("png").encode(self.image)
+        self.assertEqual(Image.open(io.BytesIO(png)).tobytes(), self.image.tobytes())
+        self.assertEqual(
+            encoders.get_encoder("raw-rgb").encode(self.image), self.image.tobytes()
+        )
+
+    def test_extensions_are_unique(self):
+        extensions = [encoder.extension for encoder in encoders.ENCODERS.values()]
+        self.assertEqual(len(extensions), len(set(extensions)))
+
+    def test_get_encoder_unknown(self):
+        with self.assertRaises(ValueError):
+            encoders.get_encoder("gif")
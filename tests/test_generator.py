@@ -1,17 +1,37 @@
+import errno
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
-import warnings
-from PIL import Image, ImageChops
+from unittest import mock
+from PIL import Image, ImageChops, ImageEnhance, ImageStat
 
-from jyou import generator
+from jyou import generator, index, stats
 
 IMAGE_PATH = "tests/assets/test.jpg"
 OUT_PATH = "/tmp/jyou-git/"
+# Holds an xrandr reporting 1920x1080+0+0 and 2560x1440+1920+0
+XRANDR_DIR = os.path.abspath("tests/assets/bin")
+UPDATE_SCRIPT = """
+import sys
+from jyou import generator
+
+generator.LockscreenGenerator(
+    "tests/assets/", resolutions=[(60, 30, 0, 0)], output_path=sys.argv[1]
+).update()
+print(sorted(i for i in sys.modules if i.split(".")[0] in ("PIL", "tqdm")))
+"""
 
 
 class TestGenerator(unittest.TestCase):
     def test_get_resolution_image(self):
-        # TODO: figure out how to test this
-        warnings.warn("Test not implemented")
+        path = XRANDR_DIR + os.pathsep + os.environ.get("PATH", "")
+        with mock.patch.dict(os.environ, {"PATH": path}):
+            resolutions = generator.get_resolution_image()
+
+        self.assertEqual(resolutions, [(1920, 1080, 0, 0), (2560, 1440, 1920, 0)])
 
     def test_get_out_path_from_md5(self):
         path = generator.get_out_path_from_md5(
@@ -19,8 +39,160 @@ class TestGenerator(unittest.TestCase):
         )
         self.assertEqual(path, "/tmp/31084f2c8577234aeb55_screen.png")
 
+        path = generator.get_out_path_from_md5(
+            "tests/assets/test.jpg", "screen", "/tmp/", pipeline_md5="pipeline"
+        )
+        self.assertEqual(path, "/tmp/31084f2c8577234aeb55_screen_pipeline.png")
+
+    def test_get_pipeline_md5(self):
+        effects = {"blur": 10, "brightness": 0.8, "blur_quality": 1}
+        pipeline_md5 = generator.get_pipeline_md5(effects)
+        self.assertEqual(
+            pipeline_md5,
+            generator.get_pipeline_md5(
+                {"blur": "10", "brightness": "0.8", "blur_quality": 1.0}
+            ),
+        )
+        self.assertNotEqual(
+            pipeline_md5, generator.get_pipeline_md5(dict(effects, blur=20))
+        )
+        self.assertNotEqual(
+            pipeline_md5, generator.get_pipeline_md5(effects, "png-max")
+        )
+        with mock.patch("jyou.generator.RENDERER_VERSION", 0):
+            self.assertNotEqual(pipeline_md5, generator.get_pipeline_md5(effects))
+
+    def test_get_out_path_from_md5_index(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            fingerprint_index = index.FingerprintIndex(
+                os.path.join(out_dir, index.INDEX_FILE_NAME)
+            )
+            path = generator.get_out_path_from_md5(
+                "tests/assets/test.jpg", "screen", "/tmp/", fingerprint_index
+            )
+        self.assertEqual(path, "/tmp/31084f2c8577234aeb55_screen.png")
+
     def test_generate_lockscreen_image(self):
-        pass
+        image = generator.generate_lockscreen_image(
+            IMAGE_PATH, [(100, 50, 0, 0), (100, 50, 100, 0), (50, 50, 200, 0)], 2, 1
+        )
+        self.assertEqual(image.size, (250, 50))
+        self.assertEqual(
+            image.crop((0, 0, 100, 50)).tobytes(),
+            image.crop((100, 0, 200, 50)).tobytes(),
+        )
+
+    def test_generate_lockscreen_image_identical_screens(self):
+        resolutions = [(100, 50, 0, 0), (100, 50, 100, 0), (100, 50, 200, 0)]
+        with mock.patch(
+            "jyou.generator.blur_image", side_effect=generator.blur_image
+        ) as blur_image:
+            generator.generate_lockscreen_image(IMAGE_PATH, resolutions, 2, 1)
+            self.assertEqual(blur_image.call_count, 1)
+
+    def test_compose_lockscreen_image_brightness(self):
+        image = Image.open(IMAGE_PATH).convert("RGB")
+        resolutions = [(100, 50, 0, 0), (60, 80, 100, 20)]
+        lockscreen = generator.compose_lockscreen_image(image, resolutions, 2, 0.7)
+
+        canvas = Image.new("RGB", (160, 100), (0, 0, 0))
+        for resolution in resolutions:
+            tile = generator.crop_image_to_dimensions(
+                image, generator.get_resolution_dimensions(resolution)
+            )
+            offset = generator.get_resolution_offset(resolution)
+            canvas.paste(generator.blur_image(tile, 2), offset)
+        expected = ImageEnhance.Brightness(canvas).enhance(0.7)
+        self.assertEqual(lockscreen.tobytes(), expected.tobytes())
+
+    def test_compose_lockscreen_image_single_screen(self):
+        image = Image.open(IMAGE_PATH).convert("RGB")
+        lockscreen, records = stats.run_recorded(
+            True, generator.compose_lockscreen_image, image, [(100, 50, 0, 0)], 2, 0.5
+        )
+        self.assertEqual(lockscreen.size, (100, 50))
+        self.assertNotIn("paste", [i["stage"] for i in records])
+
+    def test_open_image(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            image_path = os.path.join(out_dir, "large.jpg")
+            Image.open(IMAGE_PATH).resize((2400, 1200)).save(image_path)
+
+            image = generator.open_image(image_path, [(200, 50, 0, 0)])
+            self.assertLess(image.width, 2400)
+            self.assertGreaterEqual(image.width, 200 * generator.REDUCING_GAP)
+
+            reduced_image = generator.crop_image_to_dimensions(image, (200, 50))
+            full_image = generator.crop_image_to_dimensions(
+                Image.open(image_path).convert("RGB"), (200, 50)
+            )
+            difference = ImageStat.Stat(
+                ImageChops.difference(reduced_image, full_image)
+            )
+            self.assertLess(max(difference.mean), 2)
+
+    def test_open_source(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            source_path = os.path.join(cache_dir, "digest.ppm")
+            image = generator.open_source(IMAGE_PATH, [(100, 25, 0, 0)], source_path)
+            self.assertEqual(image.size, (100, 50))
+            self.assertEqual(Image.open(source_path).size, image.size)
+
+            with mock.patch("jyou.generator.open_image") as open_image:
+                cached_image = generator.open_source(
+                    IMAGE_PATH, [(50, 25, 0, 0)], source_path
+                )
+                open_image.assert_not_called()
+            self.assertEqual(cached_image.tobytes(), image.tobytes())
+
+            # A screen larger than the copy covers replaces it
+            image = generator.open_source(IMAGE_PATH, [(200, 50, 0, 0)], source_path)
+            self.assertEqual(image.size, (200, 100))
+            self.assertEqual(Image.open(source_path).size, image.size)
+
+    def test_get_tile_path(self):
+        tile_key = generator.get_tile_key((60, 30, 100, 0), 2, 1, 1)
+        self.assertEqual(tile_key, generator.get_tile_key((60, 30, 0, 0), 2, 0, 1))
+        self.assertEqual(
+            generator.get_tile_path("/tmp/digest", tile_key),
+            "/tmp/digest_60x30_"
+            + generator.get_pipeline_md5({"blur": 2, "brightness": 1}, "tile")
+            + ".ppm",
+        )
+        self.assertNotEqual(
+            generator.get_tile_path("/tmp/digest", tile_key),
+            generator.get_tile_path(
+                "/tmp/digest", generator.get_tile_key((60, 30, 0, 0), 2, 0.5, 1)
+            ),
+        )
+
+    def test_get_required_dimensions(self):
+        dimensions = generator.get_required_dimensions(
+            (4000, 3000), [(1920, 1080, 0, 0), (1080, 1920, 1920, 0)]
+        )
+        self.assertEqual(dimensions, (2560, 1920))
+
+    def test_get_job_count(self):
+        self.assertEqual(generator.get_job_count(4), 4)
+        self.assertEqual(generator.get_job_count(0), os.cpu_count() or 1)
+
+    def test_render_lockscreen(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            out_path = os.path.join(out_dir, "test.png")
+            paths = generator.render_lockscreen(
+                IMAGE_PATH, out_path, [(50, 50, 0, 0)], 0, 1
+            )
+            self.assertEqual(paths, (IMAGE_PATH, out_path))
+            self.assertEqual(Image.open(out_path).size, (50, 50))
+
+    def test_render_lockscreen_failure(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            out_path = os.path.join(out_dir, "test.png")
+            with self.assertRaises(IOError):
+                generator.render_lockscreen(
+                    "tests/assets/test.txt", out_path, [(50, 50, 0, 0)], 0, 1
+                )
+            self.assertEqual(os.listdir(out_dir), [])
 
     def test_get_resolution_dimensions(self):
         dimensions = generator.get_resolution_dimensions(("1920", "1080", "1920", "0"))
@@ -46,6 +218,21 @@ class TestGenerator(unittest.TestCase):
         # NOTE: Idk why but comparing does not work
         pass
 
+    def test_get_blur_scale(self):
+        self.assertEqual(generator.get_blur_scale(40, 1), 1)
+        self.assertEqual(generator.get_blur_scale(40, 0.25), 4)
+        self.assertEqual(generator.get_blur_scale(40, 0.01), 10)
+        self.assertEqual(generator.get_blur_scale(5, 0.25), 1)
+
+    def test_blur_image_fast(self):
+        image = Image.open(IMAGE_PATH).convert("RGB")
+        blurred_image = generator.blur_image(image, 20, 0.25)
+        self.assertEqual(blurred_image.size, image.size)
+
+        mean_error, max_error = generator.measure_blur_error(image, 20, 0.25)
+        self.assertLess(mean_error, 1)
+        self.assertLessEqual(max_error, 8)
+
     def test_get_image_path_list_directory(self):
         image_list = generator.get_image_path_list("tests/assets/")
         self.assertTrue(image_list[0].endswith("tests/assets/test.jpg"))
@@ -55,9 +242,231 @@ class TestGenerator(unittest.TestCase):
         self.assertTrue(image_list[0].endswith("tests/assets/test.jpg"))
 
     def test_get_random_image_path(self):
-        # TODO: implement
-        warnings.warn("Test not implemented")
+        image_paths = ["a.jpg", "b.jpg", "c.jpg"]
+        self.assertIn(generator.get_random_image_path(image_paths), image_paths)
+        self.assertEqual(image_paths, ["a.jpg", "b.jpg", "c.jpg"])
+        self.assertIsNone(generator.get_random_image_path([]))
+        self.assertIsNone(generator.get_random_image_path(iter([])))
+
+        picked_paths = {
+            generator.get_random_image_path(iter(image_paths)) for _ in range(200)
+        }
+        self.assertEqual(picked_paths, set(image_paths))
 
     def test_symlink_image(self):
-        # TODO: implement
-        warnings.warn("Test not implemented")
+        with tempfile.TemporaryDirectory() as out_dir:
+            symlink_path = os.path.join(out_dir, "current.png")
+            os.symlink(os.path.join(out_dir, "missing.png"), symlink_path)
+
+            generator.symlink_image(IMAGE_PATH, symlink_path)
+            self.assertEqual(os.readlink(symlink_path), os.path.abspath(IMAGE_PATH))
+
+    def test_save_raw_format(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            raw_format_path = os.path.join(out_dir, "current_lockscreen.raw")
+            generator.save_raw_format("1920x1080:bgrx", raw_format_path)
+            generator.save_raw_format("4480x1440:bgrx", raw_format_path)
+
+            with open(raw_format_path, encoding="UTF-8") as raw_format_file:
+                self.assertEqual(raw_format_file.read(), "4480x1440:bgrx")
+            self.assertEqual(os.listdir(out_dir), ["current_lockscreen.raw"])
+
+
+class TestLockscreenGenerator(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.generator = generator.LockscreenGenerator(
+            "tests/assets/",
+            resolutions=[(60, 30, 0, 0)],
+            output_path=self.out_dir,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def test_generate(self):
+        self.generator.generate()
+        for image_path in self.generator.image_paths:
+            self.assertTrue(
+                os.path.isfile(self.generator.get_lockscreen_out_path(image_path))
+            )
+
+    def test_update(self):
+        with mock.patch("jyou.hooks.run_hooks") as run_hooks:
+            self.generator.update()
+            run_hooks.assert_called_once()
+
+        symlink_path = os.path.join(self.out_dir, "current_lockscreen.png")
+        self.assertEqual(Image.open(symlink_path).size, (60, 30))
+
+    def test_update_streams_library(self):
+        with mock.patch("jyou.hooks.run_hooks"):
+            self.assertIsNotNone(self.generator.update())
+        self.assertIsNone(self.generator._image_paths)
+
+    def test_is_library_image(self):
+        image_path = os.path.abspath(IMAGE_PATH)
+        self.assertTrue(self.generator.is_library_image(image_path))
+        self.assertFalse(
+            self.generator.is_library_image(os.path.abspath("tests/assets/test.txt"))
+        )
+        self.assertFalse(self.generator.is_library_image("/tmp/test.jpg"))
+
+        self.generator.exclude = ["test.jpg"]
+        self.assertFalse(self.generator.is_library_image(image_path))
+
+    def test_update_rendered_imports(self):
+        self.generator.generate()
+        env = dict(os.environ, XDG_CONFIG_HOME=self.out_dir)
+        output = subprocess.run(
+            [sys.executable, "-c", UPDATE_SCRIPT, self.out_dir],
+            env=env,
+            stdout=subprocess.PIPE,
+            check=True,
+            text=True,
+        ).stdout
+        self.assertEqual(output.strip(), "[]")
+
+    def test_prefetch(self):
+        self.generator.prefetch()
+        image_path = self.generator.get_prefetched_image_path()
+        self.assertIn(image_path, self.generator.image_paths)
+        self.assertTrue(
+            os.path.isfile(self.generator.get_lockscreen_out_path(image_path))
+        )
+        self.assertIsNone(self.generator.get_prefetched_image_path())
+
+    def test_render_lock(self):
+        out_path = os.path.join(self.out_dir, "test.png")
+        self.assertTrue(generator.acquire_render_lock(out_path))
+        self.assertFalse(generator.acquire_render_lock(out_path))
+        generator.release_render_lock(out_path)
+        self.assertTrue(generator.acquire_render_lock(out_path))
+
+    def test_render_lock_stale(self):
+        out_path = os.path.join(self.out_dir, "test.png")
+        with open(out_path + ".lock", "w", encoding="UTF-8") as lock:
+            lock.write("999999999")
+        self.assertTrue(generator.acquire_render_lock(out_path))
+
+    def test_generate_variants(self):
+        layouts = [[(60, 30, 0, 0)], [(40, 40, 0, 0), (60, 30, 40, 0)]]
+        presets = [{"blur": 2, "brightness": 1}, {"blur": 2, "brightness": 0.5}]
+        with mock.patch(
+            "jyou.generator.open_image", side_effect=generator.open_image
+        ) as open_image:
+            self.generator.generate_variants(layouts, presets)
+            self.assertEqual(open_image.call_count, len(self.generator.image_paths))
+
+        lockscreen_names = os.listdir(os.path.join(self.out_dir, "lockscreen"))
+        self.assertEqual(len(lockscreen_names), 4 * len(self.generator.image_paths))
+        dark_md5 = generator.get_pipeline_md5(presets[1])
+        self.assertEqual(len([i for i in lockscreen_names if dark_md5 in i]), 4)
+
+    def test_plan_lockscreens(self):
+        image_paths = self.generator.image_paths
+        self.generator.generate(image_paths[:1])
+        planned = self.generator.plan_lockscreens(
+            [self.generator.resolutions], [self.generator.get_effects()], image_paths
+        )
+        self.assertEqual(
+            [i["image_path"] for i in planned],
+            image_paths[1:],
+        )
+        self.assertEqual(len(self.generator.index.get_outputs(image_paths[0])), 1)
+
+    def test_generate_source_cache(self):
+        source_dir = os.path.join(self.out_dir, "sources")
+        self.generator.source_cache = generator.ImageCache(source_dir, 1)
+        self.generator.generate()
+        self.assertEqual(
+            sorted(os.listdir(source_dir)),
+            sorted(
+                self.generator.index.get_digest(i) + ".ppm"
+                for i in self.generator.image_paths
+            ),
+        )
+
+    def test_generate_tile_cache(self):
+        tile_dir = os.path.join(self.out_dir, "tiles")
+        self.generator.tile_cache = generator.ImageCache(tile_dir, 1)
+        image_path = self.generator.image_paths[0]
+        screens = [(60, 30, 0, 0), (40, 40, 60, 0)]
+        self.generator.generate_variants([screens], [{"blur": 2, "brightness": 0.5}])
+        self.assertEqual(len(os.listdir(tile_dir)), 2 * len(self.generator.image_paths))
+
+        # A layout made of screens already rendered decodes nothing
+        stats.enable()
+        try:
+            with mock.patch("jyou.generator.open_source") as open_source:
+                lockscreen = generator.generate_lockscreen_image(
+                    image_path,
+                    [(40, 40, 0, 0), (60, 30, 40, 0)],
+                    2,
+                    0.5,
+                    1,
+                    None,
+                    self.generator.get_tile_prefix(image_path),
+                )
+                open_source.assert_not_called()
+            self.assertNotIn("blur", [i["stage"] for i in stats.get_records()])
+        finally:
+            stats.disable()
+
+        expected = generator.generate_lockscreen_image(
+            image_path, [(40, 40, 0, 0), (60, 30, 40, 0)], 2, 0.5
+        )
+        self.assertEqual(lockscreen.tobytes(), expected.tobytes())
+
+    def test_generate_parallel(self):
+        self.generator.jobs = 2
+        self.generator.generate()
+        for image_path in self.generator.image_paths:
+            self.assertTrue(
+                os.path.isfile(self.generator.get_lockscreen_out_path(image_path))
+            )
+
+        variant = {"out_path": os.path.join(self.out_dir, "missing.png")}
+        variant.update(resolutions=[(60, 30, 0, 0)], blur=0, brightness=1)
+        planned = [{"image_path": "/tmp/missing.jpg", "variants": [variant]}]
+        self.assertEqual(self.generator.render_lockscreens(iter(planned)), (1, 1))
+
+    def test_generate_plan_failure(self):
+        image_paths = self.generator.image_paths
+        get_digest = self.generator.index.get_digest
+
+        def fail_first(image_path):
+            if image_path == image_paths[0]:
+                raise OSError(errno.EIO, "Input/output error")
+            return get_digest(image_path)
+
+        for jobs in (1, 2):
+            self.generator.jobs = jobs
+            self.generator.override = True
+            planned = self.generator.plan_lockscreens(
+                [self.generator.resolutions], [self.generator.get_effects()], image_paths
+            )
+            with mock.patch.object(
+                self.generator.index, "get_digest", side_effect=fail_first
+            ):
+                self.assertEqual(
+                    self.generator.render_lockscreens(planned), (len(image_paths), 1)
+                )
+
+        for image_path in image_paths[1:]:
+            self.assertTrue(
+                os.path.isfile(self.generator.get_lockscreen_out_path(image_path))
+            )
+
+    def test_generate_effects_change(self):
+        self.generator.generate()
+        image_paths = self.generator.image_paths
+        soft_paths = [self.generator.get_lockscreen_out_path(i) for i in image_paths]
+
+        self.generator.brightness = 0.5
+        self.generator.generate()
+        for image_path, soft_path in zip(image_paths, soft_paths):
+            dark_path = self.generator.get_lockscreen_out_path(image_path)
+            self.assertNotEqual(dark_path, soft_path)
+            self.assertTrue(os.path.isfile(dark_path))
+            self.assertTrue(os.path.isfile(soft_path))
@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from jyou import geometry
+
+XRANDR_OUTPUT = """Screen 0: minimum 8 x 8, current 3840 x 1080, maximum 32767 x 32767
+DP-1 connected primary 1920x1080+0+0 (normal left inverted right) 527mm x 296mm
+   1920x1080     60.00*+
+DP-2 connected 1920x1080+1920+0 (normal left inverted right) 527mm x 296mm
+HDMI-1 disconnected (normal left inverted right x axis y axis)
+"""
+
+
+class CountingProvider(geometry.GeometryProvider):
+    def __init__(self, layout):
+        self.layout = layout
+        self.calls = 0
+
+    def get_layout(self):
+        self.calls += 1
+        return self.layout
+
+
+class TestGeometry(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.drm_path = os.path.join(self.directory, "drm")
+        self.add_connector("card0-DP-1", "connected", "2560x1440\n1920x1080\n")
+        self.add_connector("card0-DP-2", "connected", "1920x1080\n")
+        self.add_connector("card0-HDMI-A-1", "disconnected", "")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add_connector(self, name, status, modes, enabled="enabled"):
+        connector_path = os.path.join(self.drm_path, name)
+        os.makedirs(connector_path, exist_ok=True)
+        with open(os.path.join(connector_path, "status"), "w") as status_file:
+            status_file.write(status + "\n")
+        with open(os.path.join(connector_path, "enabled"), "w") as enabled_file:
+            enabled_file.write(enabled + "\n")
+        with open(os.path.join(connector_path, "modes"), "w") as modes_file:
+            modes_file.write(modes)
+
+    def test_parse_layout(self):
+        self.assertEqual(
+            geometry.parse_layout("1920x1080+0+0,1280x1024+1920+56"),
+            [(1920, 1080, 0, 0), (1280, 1024, 1920, 56)],
+        )
+        self.assertEqual(
+            geometry.parse_layout(XRANDR_OUTPUT),
+            [(1920, 1080, 0, 0), (1920, 1080, 1920, 0)],
+        )
+        with self.assertRaises(geometry.GeometryError):
+            geometry.parse_layout("")
+
+    def test_file_provider(self):
+        layout_path = os.path.join(self.directory, "xrandr.txt")
+        with open(layout_path, "w") as layout_file:
+            layout_file.write(XRANDR_OUTPUT)
+
+        provider = geometry.FileProvider(layout_path)
+        self.assertEqual(
+            provider.get_layout(), [(1920, 1080, 0, 0), (1920, 1080, 1920, 0)]
+        )
+
+        with self.assertRaises(geometry.GeometryError):
+            geometry.FileProvider(os.path.join(self.directory, "missing")).get_layout()
+
+    def test_drm_provider(self):
+        provider = geometry.DrmProvider(self.drm_path)
+        self.assertEqual(
+            provider.get_layout(), [(2560, 1440, 0, 0), (1920, 1080, 2560, 0)]
+        )
+
+        with self.assertRaises(geometry.GeometryError):
+            geometry.DrmProvider(os.path.join(self.directory, "missing")).get_layout()
+
+    def test_fallback_provider(self):
+        provider = geometry.FallbackProvider(
+            [
+                geometry.FileProvider(os.path.join(self.directory, "missing")),
+                geometry.LayoutProvider("800x600+0+0"),
+            ]
+        )
+        self.assertEqual(provider.get_layout(), [(800, 600, 0, 0)])
+
+    def test_cached_provider(self):
+        cache_path = os.path.join(self.directory, "cache", "geometry.json")
+        counting_provider = CountingProvider([(1920, 1080, 0, 0)])
+        provider = geometry.CachedProvider(
+            counting_provider, cache_path=cache_path, drm_path=self.drm_path
+        )
+
+        self.assertEqual(provider.get_layout(), [(1920, 1080, 0, 0)])
+        self.assertEqual(provider.get_layout(), [(1920, 1080, 0, 0)])
+        self.assertEqual(counting_provider.calls, 1)
+
+        self.add_connector("card0-HDMI-A-1", "connected", "1920x1080\n")
+        provider.get_layout()
+        self.assertEqual(counting_provider.calls, 2)
+
+        self.add_connector("card0-DP-2", "connected", "1920x1080\n", "disabled")
+        provider.get_layout()
+        self.assertEqual(counting_provider.calls, 3)
+
+    def test_cached_provider_ttl(self):
+        cache_path = os.path.join(self.directory, "cache", "geometry.json")
+        counting_provider = CountingProvider([(1920, 1080, 0, 0)])
+        provider = geometry.CachedProvider(
+            counting_provider, cache_path=cache_path, drm_path=self.drm_path, ttl=60
+        )
+
+        provider.get_layout()
+        provider.get_layout()
+        self.assertEqual(counting_provider.calls, 1)
+
+        with mock.patch("time.time", return_value=time.time() + 61):
+            provider.get_layout()
+        self.assertEqual(counting_provider.calls, 2)
+
+    def test_cached_provider_refresh(self):
+        cache_path = os.path.join(self.directory, "cache", "geometry.json")
+        counting_provider = CountingProvider([(1920, 1080, 0, 0)])
+        provider = geometry.CachedProvider(
+            counting_provider,
+            cache_path=cache_path,
+            drm_path=self.drm_path,
+            refresh=True,
+        )
+
+        provider.get_layout()
+        provider.get_layout()
+        self.assertEqual(counting_provider.calls, 2)
+
+    def test_get_geometry_provider(self):
+        self.assertIsInstance(
+            geometry.get_geometry_provider("auto", layout="800x600+0+0"),
+            geometry.LayoutProvider,
+        )
+        self.assertIsInstance(
+            geometry.get_geometry_provider("drm"), geometry.DrmProvider
+        )
+        with self.assertRaises(geometry.GeometryError):
+            geometry.get_geometry_provider("file")
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from jyou import hooks
+
+
+class TestHooks(unittest.TestCase):
+    def setUp(self):
+        self.hooks_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.hooks_dir, "log")
+
+    def tearDown(self):
+        shutil.rmtree(self.hooks_dir)
+
+    def add_hook(self, name, script, executable=True):
+        hook_path = os.path.join(self.hooks_dir, name)
+        with open(hook_path, "w", encoding="UTF-8") as hook_file:
+            hook_file.write(f"#!/bin/sh\n{script}\n")
+        if executable:
+            os.chmod(hook_path, 0o755)
+
+    def test_spawn_hooks(self):
+        self.add_hook("00-slow", f"sleep 0.5; echo slow >> {self.log_path}")
+
+        read_fd, write_fd = os.pipe()
+        start = time.monotonic()
+        hooks.spawn_hooks(hooks_dir=self.hooks_dir)
+        os.close(write_fd)
+        with os.fdopen(read_fd, "rb") as read_file:
+            self.assertEqual(read_file.read(), b"")
+        self.assertLess(time.monotonic() - start, 0.4)
+
+        deadline = time.monotonic() + 5
+        while not os.path.isfile(self.log_path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(os.path.isfile(self.log_path))
+
+    def test_get_hook_stages(self):
+        self.add_hook("10-second", "true")
+        self.add_hook("00-first", "true")
+        self.add_hook("00-also-first", "true")
+        self.add_hook("20-disabled", "true", executable=False)
+        self.add_hook("notes", "true")
+
+        self.assertEqual(
+            hooks.get_hook_stages(self.hooks_dir),
+            [["00-also-first", "00-first"], ["10-second"]],
+        )
+
+    def test_run_hooks_stages(self):
+        self.add_hook("00-slow", f"sleep 0.3; echo slow >> {self.log_path}")
+        self.add_hook("00-fast", f"echo fast >> {self.log_path}")
+        self.add_hook("10-last", f"echo last >> {self.log_path}")
+
+        start = time.monotonic()
+        results = hooks.run_hooks(self.hooks_dir)
+        self.assertLess(time.monotonic() - start, 1)
+
+        with open(self.log_path, encoding="UTF-8") as log_file:
+            self.assertEqual(log_file.read().split(), ["fast", "slow", "last"])
+        self.assertEqual([i["returncode"] for i in results], [0, 0, 0])
+
+    def test_run_hooks_failure(self):
+        self.add_hook("00-fails", "exit 3")
+        self.add_hook("10-runs", f"echo ran >> {self.log_path}")
+
+        results = hooks.run_hooks(self.hooks_dir)
+        self.assertEqual(results[0]["returncode"], 3)
+        self.assertTrue(os.path.isfile(self.log_path))
+
+    def test_run_hooks_timeout(self):
+        self.add_hook("00-hangs", "sleep 10")
+        self.add_hook("00-quick", "sleep 0.2")
+
+        start = time.monotonic()
+        results = hooks.run_hooks(
+            self.hooks_dir, timeout=0.1, timeouts={"00-quick": 5}
+        )
+        self.assertLess(time.monotonic() - start, 3)
+
+        results = {i["name"]: i for i in results}
+        self.assertTrue(results["00-hangs"]["timed_out"])
+        self.assertFalse(results["00-quick"]["timed_out"])
+        self.assertEqual(results["00-quick"]["returncode"], 0)
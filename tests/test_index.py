@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from jyou import index
+
+IMAGE_PATH = "tests/assets/test.jpg"
+IMAGE_MD5 = "31084f2c8577234aeb5563b95a2786a8"
+
+
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.directory, index.INDEX_FILE_NAME)
+        self.image_path = os.path.join(self.directory, "test.jpg")
+        shutil.copy(IMAGE_PATH, self.image_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_digest(self):
+        fingerprint_index = index.FingerprintIndex(self.index_path)
+        self.assertEqual(fingerprint_index.get_digest(self.image_path), IMAGE_MD5)
+
+    def test_get_digest_skips_unchanged_files(self):
+        fingerprint_index = index.FingerprintIndex(self.index_path)
+        fingerprint_index.get_digest(self.image_path)
+        fingerprint_index.save()
+
+        fingerprint_index = index.FingerprintIndex(self.index_path)
+        with mock.patch("jyou.utils.fingerprint_file") as fingerprint_file:
+            self.assertEqual(fingerprint_index.get_digest(self.image_path), IMAGE_MD5)
+            fingerprint_file.assert_not_called()
+
+    def test_get_digest_rehashes_changed_files(self):
+        fingerprint_index = index.FingerprintIndex(self.index_path)
+        fingerprint_index.get_digest(self.image_path)
+        fingerprint_index.add_output(self.image_path, "/tmp/out.png")
+
+        with open(self.image_path, "ab") as image_file:
+            image_file.write(b"\0")
+
+        self.assertNotEqual(fingerprint_index.get_digest(self.image_path), IMAGE_MD5)
+        self.assertEqual(fingerprint_index.get_outputs(self.image_path), [])
+
+    def test_outputs(self):
+        fingerprint_index = index.FingerprintIndex(self.index_path)
+        fingerprint_index.get_digest(self.image_path)
+        fingerprint_index.add_output(self.image_path, "/tmp/out.png")
+        fingerprint_index.add_output(self.image_path, "/tmp/out.png")
+        fingerprint_index.save()
+
+        fingerprint_index = index.FingerprintIndex(self.index_path)
+        self.assertEqual(
+            fingerprint_index.get_outputs(self.image_path), ["/tmp/out.png"]
+        )
+
+        fingerprint_index.remove(self.image_path)
+        self.assertEqual(fingerprint_index.get_outputs(self.image_path), [])
+
+    def test_load_index_corrupt(self):
+        with open(self.index_path, "w", encoding="UTF-8") as index_file:
+            index_file.write("{not json")
+
+        self.assertEqual(index.load_index(self.index_path), {})
+
+    def test_migrate_fingerprint(self):
+        fingerprint_index = index.FingerprintIndex(self.index_path)
+        out_path = os.path.join(self.directory, IMAGE_MD5[:20] + "_screen_pipeline.png")
+        with open(out_path, "wb"):
+            pass
+        fingerprint_index.get_digest(self.image_path)
+        fingerprint_index.add_output(self.image_path, out_path)
+        fingerprint_index.save()
+
+        fingerprint_index = index.FingerprintIndex(self.index_path, "sampled")
+        digest = fingerprint_index.get_digest(self.image_path)
+        new_path = os.path.join(self.directory, digest[:20] + "_screen_pipeline.png")
+        self.assertEqual(fingerprint_index.get_outputs(self.image_path), [new_path])
+        self.assertEqual(fingerprint_index.renamed, {out_path: new_path})
+        self.assertTrue(os.path.isfile(new_path))
+        self.assertFalse(os.path.exists(out_path))
+
+    def test_load_index_md5_entries(self):
+        with open(self.index_path, "w", encoding="UTF-8") as index_file:
+            json.dump(
+                {"/a.jpg": {"stat": [], "md5": IMAGE_MD5, "outputs": []}}, index_file
+            )
+
+        self.assertEqual(
+            index.load_index(self.index_path),
+            {
+                "/a.jpg": {
+                    "stat": [],
+                    "fingerprint": "md5",
+                    "digest": IMAGE_MD5,
+                    "outputs": [],
+                }
+            },
+        )
+
+    def test_unknown_fingerprint(self):
+        with self.assertRaises(ValueError):
+            index.FingerprintIndex(self.index_path, "sha1")
@@ -0,0 +1,112 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+from PIL import Image
+
+from jyou import generator, geometry, renderer
+
+IMAGE_PATH = "tests/assets/test.jpg"
+TEXT_PATH = "tests/assets/test.txt"
+
+
+class TestRenderer(unittest.TestCase):
+    def setUp(self):
+        self.renderer = renderer.Renderer(
+            [(60, 30, 0, 0), (40, 20, 60, 0)], blur_strength=2, brightness=0.5
+        )
+        with open(IMAGE_PATH, "rb") as image_file:
+            self.image_bytes = image_file.read()
+
+    def tearDown(self):
+        self.renderer.close()
+
+    def test_render_sources(self):
+        expected = generator.generate_lockscreen_image(
+            IMAGE_PATH, self.renderer.resolutions, 2, 0.5
+        )
+        for source in (
+            IMAGE_PATH,
+            self.image_bytes,
+            memoryview(self.image_bytes),
+            io.BytesIO(self.image_bytes),
+        ):
+            image = self.renderer.render(source)
+            self.assertEqual(image.size, (100, 30))
+            self.assertEqual(image.tobytes(), expected.tobytes())
+
+    def test_render_bytes(self):
+        lockscreen = Image.open(io.BytesIO(self.renderer.render_bytes(IMAGE_PATH)))
+        self.assertEqual(lockscreen.format, "PNG")
+        self.assertEqual(lockscreen.size, (100, 30))
+
+        raw_renderer = renderer.Renderer("60x30+0+0", encoder="raw-bgrx")
+        self.assertEqual(len(raw_renderer.render_bytes(self.image_bytes)), 60 * 30 * 4)
+
+    def test_render_overrides(self):
+        image = self.renderer.render(
+            IMAGE_PATH, resolutions="20x10+0+0", effects={"blur": 0}
+        )
+        self.assertEqual(image.size, (20, 10))
+
+    def test_errors(self):
+        with self.assertRaises(renderer.RenderError):
+            self.renderer.render(TEXT_PATH)
+        with self.assertRaises(renderer.RenderError):
+            self.renderer.render(b"not an image")
+        with self.assertRaises(renderer.RenderError):
+            self.renderer.render("/does/not/exist.jpg")
+        with self.assertRaises(TypeError):
+            self.renderer.render(1)
+        with self.assertRaises(geometry.GeometryError):
+            renderer.Renderer("")
+        with self.assertRaises(ValueError):
+            renderer.Renderer("60x30+0+0", encoder="gif")
+
+    def test_render_many(self):
+        for jobs in (1, 2):
+            with renderer.Renderer("60x30+0+0", jobs=jobs) as many_renderer:
+                results = dict(
+                    many_renderer.render_many(
+                        [IMAGE_PATH, TEXT_PATH, "tests/assets/test-blurred.jpg"],
+                        encode=True,
+                    )
+                )
+
+            self.assertEqual(len(results), 3)
+            self.assertIsInstance(results[TEXT_PATH], renderer.RenderError)
+            self.assertEqual(Image.open(io.BytesIO(results[IMAGE_PATH])).size, (60, 30))
+
+    def test_render_many_stops_early(self):
+        with renderer.Renderer("60x30+0+0", jobs=2) as many_renderer:
+            results = many_renderer.render_many([IMAGE_PATH] * 8)
+            _, image = next(results)
+            results.close()
+            self.assertEqual(image.size, (60, 30))
+            self.assertEqual(many_renderer.render(IMAGE_PATH).size, (60, 30))
+
+    def test_close_cancels_renders(self):
+        many_renderer = renderer.Renderer("60x30+0+0", jobs=2)
+        results = many_renderer.render_many([IMAGE_PATH] * 8)
+        next(results)
+        many_renderer.close()
+        self.assertEqual(many_renderer.futures, set())
+        results.close()
+
+    def test_tile_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cached_renderer = renderer.Renderer(
+                "60x30+0+0",
+                blur_strength=2,
+                tile_cache_mb=1,
+                tile_cache_dir=cache_dir,
+            )
+            image = cached_renderer.render(self.image_bytes)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            # The path shares the screens cached from the bytes of its file
+            with mock.patch("jyou.generator.open_image") as open_image:
+                cached_image = cached_renderer.render(IMAGE_PATH)
+            open_image.assert_not_called()
+            self.assertEqual(cached_image.tobytes(), image.tobytes())
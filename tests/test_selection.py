@@ -0,0 +1,214 @@
+import collections
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+from PIL import Image
+
+from jyou import generator, selection
+
+
+class FakeGenerator:
+    def __init__(self, image_paths):
+        self.image_paths = image_paths
+
+    def iter_image_paths(self):
+        return iter(self.image_paths)
+
+    def is_library_image(self, image_path):
+        return image_path in self.image_paths
+
+
+class TestSelection(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.image_paths = [f"/images/{i}.jpg" for i in range(5)]
+        self.generator = FakeGenerator(self.image_paths)
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def test_get_selection_policy(self):
+        policy = selection.get_selection_policy("shuffle", self.out_dir)
+        self.assertIsInstance(policy, selection.ShufflePolicy)
+        self.assertEqual(
+            policy.state_path,
+            os.path.join(self.out_dir, selection.SELECTION_STATE_FILE_NAME),
+        )
+        with self.assertRaises(ValueError):
+            selection.get_selection_policy("unknown", self.out_dir)
+
+    def test_random_excludes_path(self):
+        policy = selection.get_selection_policy("random", self.out_dir)
+        for _ in range(50):
+            self.assertNotEqual(
+                policy.select(self.generator, self.image_paths[0]),
+                self.image_paths[0],
+            )
+
+        only_image = FakeGenerator(self.image_paths[:1])
+        self.assertEqual(
+            policy.select(only_image, self.image_paths[0]), self.image_paths[0]
+        )
+        self.assertIsNone(policy.select(FakeGenerator([])))
+
+    def test_shuffle_kept_between_runs(self):
+        picks = []
+        for _ in range(len(self.image_paths) * 2):
+            policy = selection.get_selection_policy("shuffle", self.out_dir)
+            picks.append(policy.select(self.generator, picks[-1] if picks else None))
+
+        self.assertCountEqual(picks[:5], self.image_paths)
+        self.assertCountEqual(picks[5:], self.image_paths)
+        self.assertNotEqual(picks[4], picks[5])
+
+    def test_shuffle_skips_removed_images(self):
+        policy = selection.get_selection_policy("shuffle", self.out_dir)
+        policy.select(self.generator)
+        self.generator.image_paths = self.image_paths[:1]
+
+        policy = selection.get_selection_policy("shuffle", self.out_dir)
+        self.assertEqual(policy.select(self.generator), self.image_paths[0])
+
+    def test_shuffle_skips_excluded_path(self):
+        policy = selection.get_selection_policy("shuffle", self.out_dir)
+        first_path = policy.select(self.generator)
+
+        # A stale position that would pick the image just shown again
+        with open(policy.state_path, "w", encoding="UTF-8") as state_file:
+            state_file.write('{"shuffle_position": 0}')
+        self.assertNotEqual(policy.select(self.generator, first_path), first_path)
+
+        only_image = FakeGenerator(self.image_paths[:1])
+        policy = selection.get_selection_policy("shuffle", self.out_dir)
+        self.assertEqual(
+            policy.select(only_image, self.image_paths[0]), self.image_paths[0]
+        )
+
+    def test_shuffle_reloads_state(self):
+        policy = selection.get_selection_policy("shuffle", self.out_dir)
+        other_policy = selection.get_selection_policy("shuffle", self.out_dir)
+
+        picks = []
+        for i in range(len(self.image_paths)):
+            picks.append((policy, other_policy)[i % 2].select(self.generator))
+        self.assertCountEqual(picks, self.image_paths)
+
+    def test_recency(self):
+        policy = selection.get_selection_policy("recency", self.out_dir)
+        for image_path in self.image_paths[1:]:
+            policy.record(image_path)
+
+        policy = selection.get_selection_policy("recency", self.out_dir)
+        self.assertIn(self.image_paths[1], policy.load_state()["last_used"])
+        counts = collections.Counter(policy.select(self.generator) for _ in range(200))
+        self.assertEqual(counts[self.image_paths[0]], 200)
+
+        policy.load_state()["last_used"] = {
+            image_path: time.time() - selection.RECENCY_HORIZON
+            for image_path in self.image_paths
+        }
+        counts = collections.Counter(policy.select(self.generator) for _ in range(500))
+        self.assertEqual(set(counts), set(self.image_paths))
+
+    def test_load_selection_state_corrupt(self):
+        state_path = os.path.join(self.out_dir, selection.SELECTION_STATE_FILE_NAME)
+        with open(state_path, "w", encoding="UTF-8") as state_file:
+            state_file.write('{"queue": {}')
+
+        self.assertEqual(
+            selection.load_selection_state(state_path),
+            {"shuffle_position": 0, "last_used": {}},
+        )
+
+    def test_get_weighted_image_path(self):
+        weights = {"a": 1, "b": 1000}
+        counts = collections.Counter(
+            selection.get_weighted_image_path(iter(weights), weights.get)
+            for _ in range(500)
+        )
+        self.assertGreater(counts["b"], counts["a"])
+        self.assertIsNone(selection.get_weighted_image_path([], weights.get))
+
+
+class TestPreferCached(unittest.TestCase):
+    def setUp(self):
+        self.image_dir = tempfile.mkdtemp()
+        self.out_dir = tempfile.mkdtemp()
+        for i in range(4):
+            Image.new("RGB", (80, 40), (i * 60, 0, 0)).save(
+                os.path.join(self.image_dir, f"{i}.jpg")
+            )
+
+        self.generator = generator.LockscreenGenerator(
+            self.image_dir,
+            resolutions=[(60, 30, 0, 0)],
+            output_path=self.out_dir,
+            selection="prefer-cached",
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.image_dir)
+        shutil.rmtree(self.out_dir)
+
+    def test_prefers_rendered_images(self):
+        self.assertIsNotNone(self.generator.selection.select(self.generator))
+
+        rendered_path = self.generator.image_paths[2]
+        self.generator.generate([rendered_path])
+        self.assertEqual(
+            list(self.generator.get_rendered_image_paths()), [rendered_path]
+        )
+        for _ in range(20):
+            self.assertEqual(
+                self.generator.selection.select(self.generator), rendered_path
+            )
+
+    def test_rendered_for_other_settings(self):
+        self.generator.generate([self.generator.image_paths[0]])
+        self.generator.blur_strength = 10
+        self.assertEqual(list(self.generator.get_rendered_image_paths()), [])
+
+
+class TestShuffleUpdates(unittest.TestCase):
+    def setUp(self):
+        self.image_dir = tempfile.mkdtemp()
+        self.out_dir = tempfile.mkdtemp()
+        for i in range(4):
+            Image.new("RGB", (80, 40), (i * 60, 0, 0)).save(
+                os.path.join(self.image_dir, f"{i}.jpg")
+            )
+
+        self.generator = generator.LockscreenGenerator(
+            self.image_dir,
+            resolutions=[(60, 30, 0, 0)],
+            output_path=self.out_dir,
+            selection="shuffle",
+            prefetch=True,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.image_dir)
+        shutil.rmtree(self.out_dir)
+
+    def test_updates_with_prefetch(self):
+        image_paths = {
+            self.generator.get_lockscreen_out_path(i): i
+            for i in self.generator.image_paths
+        }
+        next_path = os.path.join(self.out_dir, generator.NEXT_LOCKSCREEN_FILE_NAME)
+
+        shown = []
+        with mock.patch("jyou.hooks.run_hooks"):
+            for _ in range(8):
+                shown.append(image_paths[self.generator.update()])
+
+                # Wait for the background prefetch of the next image
+                deadline = time.monotonic() + 10
+                while not os.path.isfile(next_path) and time.monotonic() < deadline:
+                    time.sleep(0.01)
+
+        self.assertCountEqual(shown[:4], image_paths.values())
+        self.assertCountEqual(shown[4:], image_paths.values())
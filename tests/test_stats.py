@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+import unittest
+
+from jyou import generator, stats
+
+IMAGE_PATH = "tests/assets/test.jpg"
+
+
+class TestStats(unittest.TestCase):
+    def tearDown(self):
+        stats.disable()
+
+    def test_stage_disabled(self):
+        self.assertIs(stats.stage("decode"), stats.NULL_STAGE)
+        with stats.stage("decode"):
+            pass
+        self.assertEqual(stats.get_records(), [])
+
+    def test_stage(self):
+        stats.enable()
+        with stats.stage("render", IMAGE_PATH):
+            with stats.stage("decode"):
+                pass
+        with stats.stage("hooks"):
+            pass
+
+        records = stats.get_records()
+        self.assertEqual([i["stage"] for i in records], ["decode", "render", "hooks"])
+        self.assertEqual(records[0]["image"], IMAGE_PATH)
+        self.assertIsNone(records[2]["image"])
+        self.assertGreaterEqual(records[1]["wall"], records[0]["wall"])
+
+    def test_run_recorded(self):
+        result, records = stats.run_recorded(
+            True,
+            generator.generate_lockscreen_image,
+            IMAGE_PATH,
+            [(50, 50, 0, 0)],
+            2,
+            1,
+        )
+        self.assertEqual(result.size, (50, 50))
+        self.assertEqual(
+            [i["stage"] for i in records],
+            ["decode", "resize", "blur"],
+        )
+        self.assertFalse(stats.is_enabled())
+
+        self.assertEqual(stats.run_recorded(False, len, "abc"), (3, []))
+
+    def test_add_records(self):
+        stats.enable()
+        self.assertEqual(stats.add_records("result", [{"stage": "blur"}]), "result")
+        self.assertEqual(stats.get_records(), [{"stage": "blur"}])
+
+    def test_summarise(self):
+        keys = ("stage", "wall", "cpu", "rss_delta", "peak_rss_delta")
+        records = [
+            dict(zip(keys, ("blur", 1, 1, 10, 0))),
+            dict(zip(keys, ("encode", 2, 1, 0, 5))),
+            dict(zip(keys, ("blur", 3, 2, 20, 0))),
+        ]
+        summary = stats.summarise(records)
+        self.assertEqual([i["stage"] for i in summary], ["blur", "encode"])
+        self.assertEqual(summary[0]["count"], 2)
+        self.assertEqual(summary[0]["wall"], 4)
+        self.assertEqual(summary[0]["memory"], 20)
+        self.assertIn("encode", stats.format_summary(records))
+
+    def test_write_trace(self):
+        stats.enable()
+        with stats.stage("decode", IMAGE_PATH):
+            pass
+
+        with tempfile.TemporaryDirectory() as out_dir:
+            trace_path = os.path.join(out_dir, "trace.jsonl")
+            stats.write_trace(stats.get_records(), trace_path)
+            with open(trace_path, encoding="UTF-8") as trace_file:
+                records = [json.loads(line) for line in trace_file]
+
+        self.assertEqual(records[0]["stage"], "decode")
+        self.assertEqual(records[0]["image"], IMAGE_PATH)
@@ -1,5 +1,8 @@
+import hashlib
+import os
+import tempfile
+import time
 import unittest
-import warnings
 
 from jyou import utils
 
@@ -13,6 +16,89 @@ class TestUtils(unittest.TestCase):
         md5 = utils.md5_file("tests/assets/test.jpg")
         self.assertEqual(md5, "31084f2c8577234aeb5563b95a2786a8")
 
+    def test_blake2b_file(self):
+        image_hash = hashlib.blake2b(digest_size=16)
+        with open("tests/assets/test.jpg", "rb") as image_file:
+            image_hash.update(image_file.read())
+
+        self.assertEqual(
+            utils.blake2b_file("tests/assets/test.jpg"), image_hash.hexdigest()
+        )
+        with tempfile.NamedTemporaryFile() as empty_file:
+            self.assertEqual(
+                utils.blake2b_file(empty_file.name),
+                hashlib.blake2b(digest_size=16).hexdigest(),
+            )
+
+    def test_sample_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "large.png")
+            with open(path, "wb") as large_file:
+                large_file.write(bytes(utils.SAMPLE_BLOCK_SIZE * 8))
+            digest = utils.sample_file(path)
+
+            # Bytes between the sampled blocks are not read
+            with open(path, "r+b") as large_file:
+                large_file.seek(utils.SAMPLE_BLOCK_SIZE * 2)
+                large_file.write(b"changed")
+            self.assertEqual(utils.sample_file(path), digest)
+
+            with open(path, "r+b") as large_file:
+                large_file.seek(utils.SAMPLE_BLOCK_SIZE * 4)
+                large_file.write(b"changed")
+            self.assertNotEqual(utils.sample_file(path), digest)
+
+            with open(path, "ab") as large_file:
+                large_file.write(b"\0")
+            self.assertNotEqual(utils.sample_file(path), digest)
+
+    def test_fingerprint_file(self):
+        self.assertEqual(
+            utils.fingerprint_file("tests/assets/test.jpg"),
+            utils.md5_file("tests/assets/test.jpg"),
+        )
+        with self.assertRaises(ValueError):
+            utils.fingerprint_file("tests/assets/test.jpg", "sha1")
+
+    def test_format_size(self):
+        self.assertEqual(utils.format_size(512), "512 B")
+        self.assertEqual(utils.format_size(1536), "1.5 KiB")
+        self.assertEqual(utils.format_size(3 * 1024**3), "3.0 GiB")
+
+    def test_write_file_atomic(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "state", "state.json")
+            utils.write_json_atomic(file_path, {"a": [1, 2]})
+            utils.write_file_atomic(file_path, "replaced")
+            with open(file_path, encoding="UTF-8") as state_file:
+                self.assertEqual(state_file.read(), "replaced")
+
+            with self.assertRaises(TypeError):
+                utils.write_json_atomic(file_path, {"a": object()})
+            self.assertEqual(os.listdir(os.path.dirname(file_path)), ["state.json"])
+
+    def test_run_detached(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "detached")
+            utils.run_detached(utils.write_file_atomic, file_path, str(os.getpid()))
+
+            deadline = time.monotonic() + 5
+            while not os.path.isfile(file_path) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            with open(file_path, encoding="UTF-8") as detached_file:
+                self.assertEqual(detached_file.read(), str(os.getpid()))
+
+    def test_run_detached_closes_files(self):
+        read_fd, write_fd = os.pipe()
+        start = time.monotonic()
+        utils.run_detached(time.sleep, 2)
+        os.close(write_fd)
+
+        # The pipe is only held open by the caller, not the sleeping process
+        with os.fdopen(read_fd, "rb") as read_file:
+            self.assertEqual(read_file.read(), b"")
+        self.assertLess(time.monotonic() - start, 1)
+
     def test_get_absolute_image_path(self):
         image_path = utils.get_absolute_image_path("tests/assets/test.jpg")
         self.assertTrue(image_path.endswith("/tests/assets/test.jpg"))
@@ -21,6 +107,28 @@ class TestUtils(unittest.TestCase):
         images = utils.get_directory_image_paths("tests/assets/")
         self.assertEqual(images, ["test.jpg", "test-blurred.jpg"])
 
-    def test_run_hooks(self):
-        # TODO: Implement
-        warnings.warn("Test is not implemented")
+    def test_scan_image_paths(self):
+        with tempfile.TemporaryDirectory() as image_dir:
+            for path in ("a.jpg", "b.txt", "nested/c.PNG", "nested/deep/d.jpeg"):
+                path = os.path.join(image_dir, path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                open(path, "wb").close()
+            os.symlink(image_dir, os.path.join(image_dir, "nested", "loop"))
+
+            def scan(**kwargs):
+                return sorted(
+                    os.path.relpath(i, image_dir)
+                    for i in utils.scan_image_paths(image_dir, **kwargs)
+                )
+
+            self.assertEqual(scan(), ["a.jpg", "nested/c.PNG", "nested/deep/d.jpeg"])
+            self.assertEqual(scan(exclude=["deep"]), ["a.jpg", "nested/c.PNG"])
+            self.assertEqual(
+                scan(include=["nested/*"]), ["nested/c.PNG", "nested/deep/d.jpeg"]
+            )
+            self.assertEqual(scan(include=["*.jpg"], exclude=["a.*"]), [])
+
+    def test_is_included_path(self):
+        self.assertTrue(utils.is_included_path("dir/a.jpg"))
+        self.assertTrue(utils.is_included_path("dir/a.jpg", include=["a.*"]))
+        self.assertFalse(utils.is_included_path("dir/a.jpg", exclude=["dir/*"]))
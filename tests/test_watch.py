@@ -0,0 +1,159 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+from jyou import generator, watch
+
+IMAGE_PATH = "tests/assets/test.jpg"
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.image_directory = os.path.join(self.directory, "images")
+        os.mkdir(self.image_directory)
+        shutil.copy(IMAGE_PATH, self.image_directory)
+
+        self.generator = generator.LockscreenGenerator(
+            self.image_directory,
+            resolutions=[(60, 30, 0, 0)],
+            output_path=os.path.join(self.directory, "out"),
+        )
+        self.daemon = watch.WatchDaemon(
+            self.generator,
+            self.image_directory,
+            os.path.join(self.directory, "jyou.sock"),
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_events(self):
+        buffer = watch.EVENT_HEADER.pack(1, watch.IN_CLOSE_WRITE, 0, 16)
+        buffer += b"test.jpg".ljust(16, b"\0")
+        buffer += watch.EVENT_HEADER.pack(1, watch.IN_DELETE, 0, 0)
+        self.assertEqual(
+            watch.parse_events(buffer),
+            [
+                {"wd": 1, "mask": watch.IN_CLOSE_WRITE, "name": "test.jpg"},
+                {"wd": 1, "mask": watch.IN_DELETE, "name": ""},
+            ],
+        )
+
+    def test_inotify(self):
+        inotify = watch.Inotify()
+        try:
+            inotify.add_watch(self.image_directory)
+            shutil.copy(IMAGE_PATH, os.path.join(self.image_directory, "new.jpg"))
+            events = inotify.read_events()
+        finally:
+            inotify.close()
+
+        self.assertIn(
+            {"wd": 1, "mask": watch.IN_CLOSE_WRITE, "name": "new.jpg"}, events
+        )
+
+    def test_watch_nested_directories(self):
+        nested_directory = os.path.join(self.image_directory, "nested")
+        os.mkdir(nested_directory)
+        old_path = os.path.join(nested_directory, "old.jpg")
+        shutil.copy(IMAGE_PATH, old_path)
+
+        inotify = watch.Inotify()
+        try:
+            self.assertCountEqual(
+                self.daemon.watch_directory(inotify, self.image_directory),
+                [os.path.join(self.image_directory, "test.jpg"), old_path],
+            )
+
+            # Images in a new directory are found even if they are added
+            # before it is watched
+            new_directory = os.path.join(nested_directory, "new")
+            os.mkdir(new_directory)
+            new_path = os.path.join(new_directory, "new.jpg")
+            shutil.copy("tests/assets/test-blurred.jpg", new_path)
+            self.daemon.handle_events(inotify)
+            out_path = self.generator.get_lockscreen_out_path(new_path)
+            self.assertTrue(os.path.isfile(out_path))
+
+            shutil.rmtree(nested_directory)
+            self.daemon.handle_events(inotify)
+            self.assertFalse(os.path.isfile(out_path))
+            self.assertNotIn(new_path, self.generator.image_paths)
+            self.assertNotIn(old_path, self.generator.image_paths)
+            self.assertEqual(list(self.daemon.watches.values()), [self.image_directory])
+        finally:
+            inotify.close()
+
+    def test_add_and_remove_image(self):
+        image_path = os.path.join(self.image_directory, "new.jpg")
+        shutil.copy(IMAGE_PATH, image_path)
+
+        self.daemon.add_images([image_path])
+        self.assertIn(image_path, self.generator.image_paths)
+        out_path = self.generator.get_lockscreen_out_path(image_path)
+        self.assertTrue(os.path.isfile(out_path))
+
+        os.remove(image_path)
+        self.daemon.remove_image(image_path)
+        self.assertNotIn(image_path, self.generator.image_paths)
+        self.assertFalse(os.path.isfile(out_path))
+
+    def test_remove_image_keeps_used_outputs(self):
+        image_path = os.path.join(self.image_directory, "new.jpg")
+        duplicate_path = os.path.join(self.image_directory, "duplicate.jpg")
+        shutil.copy(IMAGE_PATH, image_path)
+        shutil.copy(IMAGE_PATH, duplicate_path)
+        self.daemon.add_images([image_path, duplicate_path])
+        out_path = self.generator.get_lockscreen_out_path(image_path)
+
+        # Identical images share their lockscreens
+        os.remove(image_path)
+        self.daemon.remove_image(image_path)
+        self.assertTrue(os.path.isfile(out_path))
+
+        # The current lockscreen stays until it is replaced
+        os.symlink(
+            out_path, os.path.join(self.generator.out_dir, "current_lockscreen.png")
+        )
+        os.remove(duplicate_path)
+        self.daemon.remove_image(duplicate_path)
+        self.assertTrue(os.path.isfile(out_path))
+
+    def test_handle_events_survives_errors(self):
+        inotify = mock.Mock()
+        inotify.read_events.return_value = [
+            {"wd": 1, "mask": watch.IN_CLOSE_WRITE, "name": "test.jpg"},
+            {"wd": 1, "mask": watch.IN_DELETE, "name": "gone.jpg"},
+        ]
+        self.daemon.watches = {1: self.image_directory}
+        error = OSError(5, "Input/output error")
+        with mock.patch.object(
+            self.generator, "generate", side_effect=error
+        ), mock.patch.object(self.daemon, "remove_image", side_effect=error):
+            self.daemon.handle_events(inotify)
+
+    def test_handle_command(self):
+        self.assertEqual(self.daemon.handle_command("ping\n"), "ok")
+        self.assertTrue(self.daemon.handle_command("bad").startswith("error"))
+
+        with mock.patch("jyou.hooks.run_hooks"):
+            response = self.daemon.handle_command("update")
+        self.assertTrue(response.startswith("ok "))
+        self.assertTrue(os.path.isfile(response[3:]))
+
+    def test_open_socket_replaces_stale_socket(self):
+        socket_path = os.path.join(self.directory, "stale.sock")
+        stale_server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale_server.bind(socket_path)
+        stale_server.close()
+
+        server = watch.open_socket(socket_path)
+        try:
+            with self.assertRaises(watch.WatchError):
+                watch.open_socket(socket_path)
+        finally:
+            server.close()